@@ -10,6 +10,7 @@ from datetime import datetime, timedelta
 
 from database import db
 from models.schemas import UserResponse
+from services.user_state import user_states
 
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
@@ -38,23 +39,26 @@ def create_access_token(data: dict):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
-    if credentials is None:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    token = credentials.credentials
+def decode_token(token: str) -> dict:
+    """JWT payload with a subject, or 401."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.exceptions.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return payload
 
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+
+def check_user_access(user: Optional[dict], payload: dict) -> None:
+    """Account and session checks shared by HTTP auth and chat sockets (services/user_state.py)."""
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
     if user.get("isDisabled", False):
@@ -65,6 +69,18 @@ async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] =
         if token_iat < force_logout_at:
             raise HTTPException(status_code=401, detail="Session has been invalidated")
 
+
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    payload = decode_token(credentials.credentials)
+    user_id: str = payload["sub"]
+
+    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    check_user_access(user, payload)
+    # Routes need the whole document; sockets reuse its auth fields from the cache
+    user_states.remember(user)
+
     # Fire-and-forget lastActiveAt update — throttled to once every 5 minutes
     now = datetime.utcnow()
     last_active = user.get("lastActiveAt")
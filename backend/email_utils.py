@@ -19,7 +19,8 @@ BUSINESS_PHONE = '608-301-7091'
 
 
 def is_email_configured() -> bool:
-    return bool(SMTP_USER and SMTP_PASS)
+    # A local relay / test stand-in (e.g. aiosmtpd) needs no credentials
+    return bool(SMTP_USER and SMTP_PASS) or SMTP_HOST in ('localhost', '127.0.0.1')
 
 
 def send_email(to: str, subject: str, html_body: str) -> bool:
@@ -178,6 +178,7 @@ class Product(BaseModel):
     category: str
     image: str
     images: Optional[List[str]] = []
+    imageVariants: Optional[dict] = None  # {thumb|card|detail: {webp, avif?: url}}
     puffCount: Optional[int] = None
     flavor: str
     nicotinePercent: Optional[float] = 5.0
@@ -185,7 +186,9 @@ class Product(BaseModel):
     deviceType: Optional[str] = None
     slug: Optional[str] = None
     price: float
-    stock: Optional[int] = 0
+    stock: Optional[int] = 0                # on hand
+    reservedStock: int = 0                  # held by pending-payment orders
+    availableStock: Optional[int] = None    # stock - reservedStock, what customers can buy
     lowStockThreshold: Optional[int] = 5
     description: Optional[str] = None
     isActive: bool = True
@@ -198,6 +201,10 @@ class Product(BaseModel):
     shipmentStatus: Optional[str] = None
     etaDays: Optional[int] = None
     incomingPackCount: Optional[int] = None
+    # Rating aggregates over visible reviews — maintained on review writes
+    ratingCount: int = 0
+    ratingAverage: Optional[float] = None
+    ratingHistogram: Optional[dict] = None
     createdAt: Optional[Any] = None
     updatedAt: Optional[Any] = None
 
@@ -307,10 +314,40 @@ class Order(BaseModel):
     reviewedProductIds: List[str] = Field(default_factory=list)
 
 
+class OrderSummary(BaseModel):
+    """Order history list row — full detail comes from GET /orders/{id}."""
+    id: str
+    status: str
+    total: float
+    createdAt: datetime
+    itemCount: int = 0
+    reviewPromptEligible: bool = False  # only computed for Completed orders
+
+
+class OrderPage(BaseModel):
+    orders: List[OrderSummary]
+    nextCursor: Optional[str] = None  # pass back as ?cursor= for the next page; None on the last page
+
+
 class OrderStatusUpdate(BaseModel):
     status: str
 
 
+class PushCampaignCreate(BaseModel):
+    title: str = Field(min_length=1, max_length=100)
+    body: str = Field(min_length=1, max_length=500)
+    url: Optional[str] = None
+    segment: str  # all | tier | inactive | not_checked_in
+    tierId: Optional[str] = None
+    inactiveDays: Optional[int] = Field(default=None, ge=1, le=365)
+    channels: List[str] = ["push", "web_push"]
+
+
+class BulkOrderStatusUpdate(BaseModel):
+    orderIds: List[str] = Field(min_length=1)
+    status: str
+
+
 class OrderEditItem(BaseModel):
     productId: str
     quantity: int
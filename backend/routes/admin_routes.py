@@ -1,16 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
 from database import db
 from auth import get_admin_user, build_user_response, get_password_hash
 from models.schemas import (
     UserResponse, AdminUserResponse, AdminUserUpdate, CreditAdjust, AdminReferrerUpdate,
     CloudzAdjust, AdminSetPassword, AdminUserNotes, MergeRequest,
-    Order, OrderStatusUpdate, OrderEdit, ReviewModerationUpdate,
+    Order, OrderStatusUpdate, BulkOrderStatusUpdate, OrderEdit, PushCampaignCreate, ReviewModerationUpdate,
     UserUsernameUpdate
 )
 from services.loyalty_service import log_cloudz_transaction, issue_referral_signup_rewards
-from services.order_service import send_push_notification, chat_manager, update_order_status_shared
+from services.order_service import send_push_notification
+from services.chat_inbox import inbox_page, INBOX_PAGE_DEFAULT, INBOX_PAGE_MAX
+from services.user_state import publish_user_state_change
+from services.order_state import transition_order_status, bulk_transition_order_status
+from services.review_service import apply_rating_delta
+from services.inventory_service import release_order_stock, replace_order_items_stock
+from routes.product_routes import _invalidate_product_cache
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
 from typing import List, Optional
 import re as _re
 import asyncio
@@ -51,17 +58,26 @@ async def admin_update_review(review_id: str, update: ReviewModerationUpdate, ad
         update_dict["comment"] = update.comment
     if not update_dict:
         raise HTTPException(status_code=400, detail="No fields to update")
-    result = await db.reviews.update_one({"_id": ObjectId(review_id)}, {"$set": update_dict})
-    if result.matched_count == 0:
+    before = await db.reviews.find_one_and_update(
+        {"_id": ObjectId(review_id)}, {"$set": update_dict}, return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
         raise HTTPException(status_code=404, detail="Review not found")
+    was_hidden = before.get("isHidden", False)
+    if update.isHidden is not None and update.isHidden != was_hidden:
+        await apply_rating_delta(before["productId"], before.get("rating", 0), -1 if update.isHidden else +1)
+        _invalidate_product_cache()
     return {"message": "Review updated"}
 
 
 @router.delete("/admin/reviews/{review_id}")
 async def admin_delete_review(review_id: str, admin=Depends(get_admin_user)):
-    result = await db.reviews.delete_one({"_id": ObjectId(review_id)})
-    if result.deleted_count == 0:
+    deleted = await db.reviews.find_one_and_delete({"_id": ObjectId(review_id)})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Review not found")
+    if not deleted.get("isHidden", False):
+        await apply_rating_delta(deleted["productId"], deleted.get("rating", 0), -1)
+        _invalidate_product_cache()
     return {"message": "Review deleted"}
 
 
@@ -318,6 +334,7 @@ async def admin_disable_user(user_id: str, admin=Depends(get_admin_user)):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     logger.info(f"ADMIN ACTION: user {user_id} disabled by admin {str(admin['_id'])}")
+    await publish_user_state_change(user_id)  # closes their open chat sockets
     return {"success": True, "message": "Account disabled and all active sessions invalidated"}
 
 
@@ -331,6 +348,7 @@ async def admin_enable_user(user_id: str, admin=Depends(get_admin_user)):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     logger.info(f"ADMIN ACTION: user {user_id} enabled by admin {str(admin['_id'])}")
+    await publish_user_state_change(user_id)
     return {"success": True, "message": "Account enabled — user must log in again to get a new token"}
 
 
@@ -345,6 +363,7 @@ async def admin_force_logout(user_id: str, admin=Depends(get_admin_user)):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     logger.info(f"ADMIN ACTION: force-logout user {user_id} by admin {str(admin['_id'])}")
+    await publish_user_state_change(user_id)  # closes their open chat sockets
     return {"success": True, "message": "All active sessions invalidated — user must log in again"}
 
 
@@ -357,6 +376,7 @@ async def admin_clear_force_logout(user_id: str, admin=Depends(get_admin_user)):
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await publish_user_state_change(user_id)
     return {"success": True, "message": "forceLogoutAt cleared"}
 
 
@@ -419,6 +439,7 @@ async def merge_users(data: MergeRequest, admin=Depends(get_admin_user)):
         {"_id": ObjectId(data.sourceUserId)},
         {"$set": {"isDisabled": True, "mergedInto": data.targetUserId, "creditBalance": 0, "loyaltyPoints": 0}}
     )
+    await publish_user_state_change(data.sourceUserId)  # closes the merged account's chat sockets
     return {"success": True, "message": "Accounts merged successfully"}
 
 
@@ -429,12 +450,8 @@ async def admin_edit_order(order_id: str, edit: OrderEdit, admin=Depends(get_adm
     order = await db.orders.find_one({"_id": ObjectId(order_id)})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    old_items = order.get("items", [])
     new_items = [item.dict() for item in edit.items]
-    for item in old_items:
-        await db.products.update_one({"_id": ObjectId(item["productId"])}, {"$inc": {"stock": item["quantity"]}})
-    for item in new_items:
-        await db.products.update_one({"_id": ObjectId(item["productId"])}, {"$inc": {"stock": -item["quantity"]}})
+    await replace_order_items_stock(order, new_items)
     update_dict: dict = {"items": new_items, "total": edit.total}
     if edit.adminNotes is not None:
         update_dict["adminNotes"] = edit.adminNotes
@@ -490,16 +507,8 @@ async def admin_delete_order(order_id: str, admin=Depends(get_admin_user)):
 
     stock_restored = False
     if current_status == "Pending Payment":
-        # Stock is still reserved — restore it before removing the record
-        for item in order.get("items", []):
-            try:
-                await db.products.update_one(
-                    {"_id": ObjectId(item["productId"])},
-                    {"$inc": {"stock": item["quantity"]}},
-                )
-            except Exception:
-                pass
-        stock_restored = True
+        # Stock is still held — return it before removing the record
+        stock_restored = await release_order_stock(order)
 
     await db.orders.delete_one({"_id": oid})
     return {"message": "Order deleted", "orderId": order_id, "stockRestored": stock_restored}
@@ -534,7 +543,13 @@ async def get_all_orders(admin=Depends(get_admin_user)):
 
 @router.patch("/admin/orders/{order_id}/status")
 async def update_order_status(order_id: str, status_update: OrderStatusUpdate, admin=Depends(get_admin_user)):
-    return await update_order_status_shared(order_id, status_update.status, source="admin")
+    return await transition_order_status(order_id, status_update.status, source="admin")
+
+
+@router.post("/admin/orders/bulk-status")
+async def bulk_update_order_status(payload: BulkOrderStatusUpdate, admin=Depends(get_admin_user)):
+    """Move many orders at once (e.g. a pickup window to Completed). Rewards run in one background pass."""
+    return await bulk_transition_order_status(payload.orderIds, payload.status, source="admin-bulk")
 
 
 # ==================== ADMIN USER MANAGEMENT ====================
@@ -664,6 +679,7 @@ async def admin_update_user(user_id: str, user_data: AdminUserUpdate, admin=Depe
         result = await db.users.update_one({"_id": ObjectId(user_id)}, {"$set": update_dict})
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        await publish_user_state_change(user_id)  # isAdmin / name may have changed
     if points_target is not None and old_points is not None:
         delta = points_target - old_points
         if delta != 0:
@@ -687,6 +703,7 @@ async def admin_delete_user(user_id: str, admin=Depends(get_admin_user)):
     if user.get("isAdmin") and str(user["_id"]) != str(admin["_id"]):
         raise HTTPException(status_code=400, detail="Cannot delete another admin account")
     await db.users.delete_one({"_id": ObjectId(user_id)})
+    await publish_user_state_change(user_id)
     return {"message": "User deleted"}
 
 
@@ -714,19 +731,19 @@ async def admin_adjust_credit(user_id: str, data: CreditAdjust, admin=Depends(ge
 
 
 @router.get("/admin/chats")
-async def get_admin_chats(admin=Depends(get_admin_user)):
-    sessions = await db.chat_sessions.find({}, {"_id": 0}).sort("lastMessageAt", -1).to_list(100)
-    active_ids = chat_manager.get_active_chat_ids()
-    for s in sessions:
-        s["online"] = s.get("chatId") in active_ids
-        uid = s.get("userId")
-        if uid:
-            try:
-                u = await db.users.find_one({"_id": ObjectId(uid)}, {"firstName": 1, "lastName": 1, "username": 1, "email": 1})
-                s["userName"] = " ".join(filter(None, [u.get("firstName"), u.get("lastName")])) \
-                    or u.get("username") or u.get("email", "Unknown") if u else "Unknown"
-            except Exception:
-                s["userName"] = "Unknown"
+async def get_admin_chats(
+    response: Response,
+    limit: int = Query(INBOX_PAGE_DEFAULT, ge=1, le=INBOX_PAGE_MAX),
+    before: Optional[str] = None,
+    admin=Depends(get_admin_user),
+):
+    """
+    Chat inbox, most recent conversation first. Page with
+    ?before=<lastMessageAt>_<chatId> of the last row; X-Has-More says whether
+    another page exists. Live changes arrive on /api/ws/admin/inbox.
+    """
+    sessions, has_more = await inbox_page(limit, before)
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     return sessions
 
 
@@ -950,6 +967,130 @@ async def get_admin_analytics(
     return result
 
 
+# ==================== ADMIN UPLOAD SERVING STATS ====================
+
+@router.get("/admin/uploads/stats")
+async def get_upload_serving_stats(admin=Depends(get_admin_user)):
+    """Per-process counters for /api/uploads/products (hits, 304s, ranged reads, bytes)."""
+    from services.upload_static import upload_stats
+    return dict(upload_stats)
+
+
+# ==================== BACKGROUND JOBS ====================
+
+@router.get("/admin/jobs")
+async def get_background_jobs(admin=Depends(get_admin_user)):
+    """Scheduled jobs: interval, current lease owner, last run / duration / error; parked order events."""
+    from services.scheduler import get_job_status
+    from services.leases import WORKER_ID
+    from services.order_state import failed_order_events
+    return {"worker": WORKER_ID, "jobs": await get_job_status(), "failedOrderEvents": await failed_order_events()}
+
+
+# ==================== ORDER EXPIRY JOB ====================
+
+@router.get("/admin/orders/expiry/stats")
+async def get_order_expiry_stats(admin=Depends(get_admin_user)):
+    """Expiry job counters for this process, plus which worker currently holds the job lease."""
+    from services.order_service import order_expiry_stats, ORDER_EXPIRY_JOB
+    from services.leases import get_lease, WORKER_ID
+    from services.scheduler import lease_name
+    lease = await get_lease(lease_name(ORDER_EXPIRY_JOB))
+    return {
+        **order_expiry_stats,
+        "worker": WORKER_ID,
+        "leaseOwner": lease.get("owner") if lease else None,
+        "leaseExpiresAt": lease.get("expiresAt") if lease else None,
+    }
+
+
+# ==================== PUSH CAMPAIGNS ====================
+
+@router.post("/admin/push/campaigns")
+async def create_push_campaign(payload: PushCampaignCreate, admin=Depends(get_admin_user)):
+    """Broadcast a push to a user segment. Sends in the background; poll the campaign for progress."""
+    from services.push_campaigns import SEGMENT_TYPES, create_campaign, campaign_response
+    if payload.segment not in SEGMENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"segment must be one of {', '.join(SEGMENT_TYPES)}")
+    channels = [c for c in dict.fromkeys(payload.channels) if c in ("push", "web_push")]
+    if not channels:
+        raise HTTPException(status_code=400, detail="channels must include push and/or web_push")
+    segment = {"type": payload.segment}
+    if payload.segment == "tier":
+        segment["tierId"] = payload.tierId
+    if payload.segment == "inactive":
+        segment["inactiveDays"] = payload.inactiveDays
+    doc = await create_campaign(payload.title, payload.body, payload.url, segment, channels, str(admin["_id"]))
+    return campaign_response(doc)
+
+
+@router.get("/admin/push/campaigns")
+async def list_push_campaigns(admin=Depends(get_admin_user)):
+    from services.push_campaigns import campaign_response
+    docs = await db.push_campaigns.find().sort("createdAt", -1).limit(50).to_list(50)
+    return [campaign_response(d) for d in docs]
+
+
+@router.get("/admin/push/campaigns/{campaign_id}")
+async def get_push_campaign(campaign_id: str, admin=Depends(get_admin_user)):
+    from services.push_campaigns import campaign_response
+    if not ObjectId.is_valid(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID")
+    doc = await db.push_campaigns.find_one({"_id": ObjectId(campaign_id)})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign_response(doc)
+
+
+@router.post("/admin/push/campaigns/{campaign_id}/cancel")
+async def cancel_push_campaign(campaign_id: str, admin=Depends(get_admin_user)):
+    from services.push_campaigns import cancel_campaign
+    if not ObjectId.is_valid(campaign_id):
+        raise HTTPException(status_code=400, detail="Invalid campaign ID")
+    if not await cancel_campaign(ObjectId(campaign_id)):
+        raise HTTPException(status_code=400, detail="Campaign is not queued or running")
+    return {"message": "Campaign cancelled"}
+
+
+# ==================== NOTIFICATION OUTBOX ====================
+
+@router.get("/admin/notifications/outbox/stats")
+async def get_notification_outbox_stats(admin=Depends(get_admin_user)):
+    """Outbox dispatch counters for this process plus queue depth by status."""
+    from services.notification_outbox import get_outbox_stats
+    from services.leases import WORKER_ID
+    return {**await get_outbox_stats(), "worker": WORKER_ID}
+
+
+# ==================== BACKGROUND IMAGE MIGRATION ====================
+
+@router.get("/admin/migrations/images")
+async def get_image_migration(admin=Depends(get_admin_user)):
+    """Progress of the base64 → file / catalog image migration job."""
+    from services.image_migration import get_image_migration_status
+    return await get_image_migration_status()
+
+
+@router.post("/admin/migrations/images/start")
+async def start_image_migration_job(reset: bool = False, admin=Depends(get_admin_user)):
+    """Start the migration in the background. reset=true discards the checkpoint and starts over."""
+    from services.image_migration import start_image_migration
+    logger.info(f"ADMIN ACTION: image migration start (reset={reset}) by admin {str(admin['_id'])}")
+    return await start_image_migration(reset=reset)
+
+
+@router.post("/admin/migrations/images/pause")
+async def pause_image_migration_job(admin=Depends(get_admin_user)):
+    from services.image_migration import pause_image_migration
+    return await pause_image_migration()
+
+
+@router.post("/admin/migrations/images/resume")
+async def resume_image_migration_job(admin=Depends(get_admin_user)):
+    from services.image_migration import resume_image_migration
+    return await resume_image_migration()
+
+
 # ==================== TEMPORARY DATA MIGRATION ENDPOINTS ====================
 
 MIGRATABLE_COLLECTIONS = [
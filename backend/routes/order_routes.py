@@ -1,14 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Query, Response
 from database import db
 from auth import get_current_user, get_admin_user, touch_last_active
-from models.schemas import Order, OrderCreate, OrderStatusUpdate
+from models.schemas import Order, OrderCreate, OrderStatusUpdate, OrderSummary, OrderPage
 from services.loyalty_service import log_cloudz_transaction, check_and_unlock_referral_reward
-from services.email_service import is_email_configured, send_email, build_order_confirmation_html
-from services.order_service import chat_manager, update_order_status_shared
+from services.email_service import is_email_configured, build_order_confirmation_html
+from services.notification_outbox import enqueue_notification
+from services.order_service import chat_manager
+from services.order_state import transition_order_status
+from services.checkout_service import (
+    FEE_METHODS, PROCESSING_FEE_RATE, PRICE_TOLERANCE,
+    load_cart, minimum_client_total,
+    request_fingerprint, begin_idempotent_request, complete_idempotent_request, abandon_idempotent_request,
+)
+from services.inventory_service import hold_stock, take_stock, undo_checkout_stock
+from services.transactions import run_in_transaction
 from limiter import limiter, get_user_id_or_ip
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
-from typing import List
+from typing import List, Optional
 import logging
 
 router = APIRouter()
@@ -18,6 +27,27 @@ logger = logging.getLogger(__name__)
 @router.post("/orders", response_model=Order)
 @limiter.limit("5/minute", key_func=get_user_id_or_ip)
 async def create_order(request: Request, order_data: OrderCreate, user=Depends(get_current_user)):
+    """
+    Place an order. Clients may send an Idempotency-Key header: retrying with the
+    same key and body returns the original order instead of creating another.
+    """
+    idempotency_key = request.headers.get("Idempotency-Key")
+    auth_user_id = str(user["_id"])
+    if idempotency_key:
+        fingerprint = request_fingerprint(order_data.dict())
+        cached = await begin_idempotent_request(auth_user_id, idempotency_key, fingerprint)
+        if cached is not None:
+            print(f"IDEMPOTENT REPLAY: order {cached.get('id')} key={idempotency_key}")
+            return Order(**cached)
+    try:
+        return await _place_order(order_data, user, idempotency_key)
+    except BaseException:
+        if idempotency_key:
+            await abandon_idempotent_request(auth_user_id, idempotency_key)
+        raise
+
+
+async def _place_order(order_data: OrderCreate, user: dict, idempotency_key: str | None) -> Order:
     # --- Resolve effective user (admin may create on behalf of another user) ---
     print(f"ORDER DATA USER ID: {order_data.userId}")
     print(f"AUTH USER ID: {str(user['_id'])}")
@@ -40,11 +70,8 @@ async def create_order(request: Request, order_data: OrderCreate, user=Depends(g
         order_user = user
         print(f"ORDER CREATED FOR: {effective_user_id} (no override)")
 
-    # Verify products exist (non-atomic, fast pre-check for 404s only)
-    for item in order_data.items:
-        product = await db.products.find_one({"_id": ObjectId(item.productId)}, {"name": 1})
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.productId} not found")
+    # Validate the whole cart in one query; line names/prices come from the catalog
+    lines = await load_cart(order_data.items)
 
     # --- Bulk discount: 10% when total quantity >= 10 items (applied BEFORE store credit) ---
     total_qty = sum(item.quantity for item in order_data.items)
@@ -56,10 +83,9 @@ async def create_order(request: Request, order_data: OrderCreate, user=Depends(g
     final_total = round(order_data.total - bulk_discount, 2)
 
     # 1.75% processing fee for Apple Pay, Cash App, Chime — server-calculated only
-    FEE_METHODS = {"Apple Pay", "Cash App", "Chime"}
     processing_fee = 0.0
     if order_data.paymentMethod in FEE_METHODS:
-        processing_fee = round(final_total * 0.0175, 2)
+        processing_fee = round(final_total * PROCESSING_FEE_RATE, 2)
         final_total = round(final_total + processing_fee, 2)
 
     points_earned = int(final_total) * 3
@@ -75,10 +101,9 @@ async def create_order(request: Request, order_data: OrderCreate, user=Depends(g
         if store_credit_applied > order_data.total:
             store_credit_applied = order_data.total
 
-    # Handle next-order coupon application
+    # Handle next-order coupon application (validated here, marked used after stock is reserved)
     coupon_discount = 0.0
     if order_data.couponApplied:
-        from datetime import timezone
         user_doc = await db.users.find_one({"_id": effective_user_oid}, {"nextOrderCoupon": 1})
         coupon = user_doc.get("nextOrderCoupon") if user_doc else None
         if coupon and not coupon.get("used", False):
@@ -88,14 +113,11 @@ async def create_order(request: Request, order_data: OrderCreate, user=Depends(g
                     exp = exp.replace(tzinfo=timezone.utc)
                 if exp >= datetime.now(timezone.utc):
                     coupon_discount = float(coupon.get("amount", 0))
-                    await db.users.update_one(
-                        {"_id": user["_id"]},
-                        {"$set": {"nextOrderCoupon.used": True, "nextOrderCoupon.usedAt": datetime.utcnow().isoformat()}}
-                    )
             except Exception:
                 pass
 
     # Handle tier-based reward redemption at checkout
+    reward_oid = None
     if order_data.rewardId:
         try:
             reward_oid = ObjectId(order_data.rewardId)
@@ -110,16 +132,21 @@ async def create_order(request: Request, order_data: OrderCreate, user=Depends(g
             raise HTTPException(status_code=400, detail="Invalid or already used reward")
         reward_discount = reward["rewardAmount"]
         reward_points_used = reward["pointsSpent"]
-        await db.loyalty_rewards.update_one(
-            {"_id": ObjectId(order_data.rewardId)},
-            {"$set": {"used": True, "usedAt": datetime.utcnow()}}
-        )
+
+    # Server-side price check: the submitted total may not undercut catalog prices
+    minimum_total = minimum_client_total(
+        lines, order_data.paymentMethod, reward_discount + coupon_discount + store_credit_applied
+    )
+    if order_data.total + PRICE_TOLERANCE < minimum_total:
+        raise HTTPException(status_code=400, detail="Order total does not match cart prices")
 
     created_at = datetime.utcnow()
     is_pending_payment = order_data.paymentMethod != "Cash on Pickup"
+    order_oid = ObjectId()
     order_dict = {
+        "_id": order_oid,
         "userId": effective_user_id,
-        "items": [item.dict() for item in order_data.items],
+        "items": lines,
         "total": final_total,
         "pickupTime": order_data.pickupTime,
         "paymentMethod": order_data.paymentMethod,
@@ -136,56 +163,107 @@ async def create_order(request: Request, order_data: OrderCreate, user=Depends(g
         "expiresAt": created_at + timedelta(minutes=30) if is_pending_payment else None,
         "referralRewardIssued": False,
         "loyaltyRewardIssued": False,
+        "inventoryState": "reserved" if is_pending_payment else "committed",
         "customerName": order_data.name or None,
         "customerEmail": order_data.email or None,
         "customerPhone": order_data.phone or None,
     }
+    response = Order(
+        id=str(order_oid),
+        requestedUserId=order_data.userId,
+        effectiveUserId=effective_user_id,
+        **{k: v for k, v in order_dict.items() if k != "_id"},
+    )
+
+    async def _commit(session):
+        """
+        Stock, reward, coupon, store credit and the order itself. One transaction
+        on a replica set; on a standalone server each step registers an undo.
+        """
+        undo = []
+        try:
+            # Pending-payment orders hold stock until expiresAt; pay-at-pickup takes it now.
+            # Either way every line is checked at once (409 if any line is short).
+            if is_pending_payment:
+                await hold_stock(order_oid, effective_user_id, lines, order_dict["expiresAt"], session=session)
+            else:
+                await take_stock(lines, session=session)
+            undo.append(lambda: undo_checkout_stock(order_oid, lines, held=is_pending_payment))
+
+            if reward_oid is not None:
+                claimed = await db.loyalty_rewards.update_one(
+                    {"_id": reward_oid, "used": False},
+                    {"$set": {"used": True, "usedAt": datetime.utcnow()}},
+                    session=session,
+                )
+                if claimed.modified_count == 0:
+                    raise HTTPException(status_code=400, detail="Invalid or already used reward")
+                undo.append(lambda: db.loyalty_rewards.update_one(
+                    {"_id": reward_oid}, {"$set": {"used": False}, "$unset": {"usedAt": ""}}
+                ))
+
+            if coupon_discount > 0:
+                claimed = await db.users.update_one(
+                    {"_id": effective_user_oid, "nextOrderCoupon.used": {"$ne": True}},
+                    {"$set": {"nextOrderCoupon.used": True, "nextOrderCoupon.usedAt": datetime.utcnow().isoformat()}},
+                    session=session,
+                )
+                if claimed.modified_count == 0:
+                    raise HTTPException(status_code=400, detail="Coupon already used")
+                undo.append(lambda: db.users.update_one(
+                    {"_id": effective_user_oid},
+                    {"$set": {"nextOrderCoupon.used": False}, "$unset": {"nextOrderCoupon.usedAt": ""}},
+                ))
+
+            # Deduct store credit from effective user balance
+            if store_credit_applied > 0:
+                debited = await db.users.update_one(
+                    {"_id": effective_user_oid, "creditBalance": {"$gte": store_credit_applied}},
+                    {"$inc": {"creditBalance": -store_credit_applied}},
+                    session=session,
+                )
+                if debited.modified_count == 0:
+                    raise HTTPException(status_code=400, detail="Insufficient store credit")
+                undo.append(lambda: db.users.update_one(
+                    {"_id": effective_user_oid}, {"$inc": {"creditBalance": store_credit_applied}}
+                ))
+
+            await db.orders.insert_one(order_dict, session=session)
+            undo.append(lambda: db.orders.delete_one({"_id": order_oid}))
+
+            # Order confirmation email rides the same transaction via the notification outbox
+            if is_email_configured() and order_user.get("email"):
+                await enqueue_notification(
+                    effective_user_id, "email",
+                    {
+                        "to": order_user["email"],
+                        "subject": "Order Confirmation - Cloud District Club",
+                        "html": build_order_confirmation_html(
+                            order_id=response.id, items=order_dict["items"], total=order_dict["total"],
+                        ),
+                    },
+                    dedupe_key=f"order-confirmation:{response.id}",
+                    session=session,
+                )
+                undo.append(lambda: db.notification_outbox.delete_one({"dedupeKey": f"order-confirmation:{response.id}"}))
 
-    result = await db.orders.insert_one(order_dict)
-    order_dict["id"] = str(result.inserted_id)
-    order_dict["requestedUserId"] = order_data.userId
-    order_dict["effectiveUserId"] = effective_user_id
-
-    # Deduct store credit from effective user balance
-    if store_credit_applied > 0:
-        await db.users.update_one(
-            {"_id": effective_user_oid},
-            {"$inc": {"creditBalance": -store_credit_applied}}
-        )
-
-    # Atomic inventory deduction
-    decremented = []
-    for item in order_data.items:
-        res = await db.products.update_one(
-            {"_id": ObjectId(item.productId), "stock": {"$gte": item.quantity}},
-            {"$inc": {"stock": -item.quantity}}
-        )
-        if res.modified_count == 0:
-            for rolled in decremented:
-                await db.products.update_one(
-                    {"_id": ObjectId(rolled.productId)},
-                    {"$inc": {"stock": rolled.quantity}}
+            if idempotency_key:
+                await complete_idempotent_request(
+                    str(user["_id"]), idempotency_key, response.dict(), session=session
                 )
-            await db.orders.delete_one({"_id": result.inserted_id})
-            raise HTTPException(status_code=409, detail=f"Out of stock: {item.name}")
-        decremented.append(item)
+        except BaseException:
+            if session is None:
+                for step in reversed(undo):
+                    await step()
+            raise
 
-    # Send order confirmation email (non-blocking)
-    try:
-        if is_email_configured():
-            email_html = build_order_confirmation_html(
-                order_id=order_dict["id"],
-                items=order_dict["items"],
-                total=order_dict["total"],
-            )
-            send_email(order_user.get("email", ""), "Order Confirmation - Cloud District Club", email_html)
-    except Exception as e:
-        logger.warning(f"Order confirmation email skipped: {e}")
+    await run_in_transaction(_commit)
+    print(f"ORDER PLACED: {response.id} for {effective_user_id}")
 
     # Update lastActiveAt for the customer who placed the order
     await touch_last_active(effective_user_id)
 
-    return Order(**order_dict)
+    return response
 
 
 async def _enrich_orders_with_review_state(orders: list, user_id: str) -> list:
@@ -223,12 +301,67 @@ async def _enrich_orders_with_review_state(orders: list, user_id: str) -> list:
     return orders
 
 
-@router.get("/orders", response_model=List[Order])
-async def get_orders(user=Depends(get_current_user)):
+ORDER_PAGE_DEFAULT = 20
+ORDER_PAGE_MAX = 100
+
+
+def _encode_order_cursor(order: dict) -> str:
+    # createdAt is naive UTC (Mongo keeps millisecond precision, so this round-trips exactly)
+    created_ms = int(order["createdAt"].replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return f"{created_ms}_{order['_id']}"
+
+
+def _decode_order_cursor(cursor: str) -> dict:
+    """(createdAt, _id) keyset filter for orders strictly after the cursor in newest-first order."""
+    try:
+        ms, oid = cursor.split("_", 1)
+        created_at = datetime.utcfromtimestamp(int(ms) / 1000)
+        oid = ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"createdAt": {"$lt": created_at}},
+        {"createdAt": created_at, "_id": {"$lt": oid}},
+    ]}
+
+
+@router.get("/orders", response_model=OrderPage)
+async def get_orders(
+    limit: int = Query(ORDER_PAGE_DEFAULT, ge=1, le=ORDER_PAGE_MAX),
+    cursor: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    """
+    Newest-first order history, one page of summaries at a time.
+    Only the fields the list shows are read; review state is computed for the
+    Completed orders on this page only.
+    """
     user_id = str(user["_id"])
-    orders = await db.orders.find({"userId": user_id}).sort("createdAt", -1).to_list(1000)
+    query: dict = {"userId": user_id}
+    if cursor:
+        query.update(_decode_order_cursor(cursor))
+    orders = await db.orders.find(
+        query,
+        {"status": 1, "total": 1, "createdAt": 1, "items.productId": 1, "items.quantity": 1},
+    ).sort([("createdAt", -1), ("_id", -1)]).limit(limit + 1).to_list(limit + 1)
+
+    has_more = len(orders) > limit
+    orders = orders[:limit]
     orders = await _enrich_orders_with_review_state(orders, user_id)
-    return [Order(id=str(o["_id"]), **{k: v for k, v in o.items() if k != "_id"}) for o in orders]
+    return OrderPage(
+        orders=[
+            OrderSummary(
+                id=str(o["_id"]),
+                status=o.get("status", ""),
+                total=o.get("total", 0.0),
+                createdAt=o["createdAt"],
+                itemCount=sum(item.get("quantity", 0) for item in o.get("items", [])),
+                reviewPromptEligible=o.get("reviewPromptEligible", False),
+            )
+            for o in orders
+        ],
+        nextCursor=_encode_order_cursor(orders[-1]) if has_more else None,
+    )
 
 
 @router.get("/orders/{order_id}", response_model=Order)
@@ -251,18 +384,10 @@ async def cancel_order(order_id: str, user=Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Access denied")
     if order["status"] != "Pending Payment":
         raise HTTPException(status_code=400, detail="Only orders with status 'Pending Payment' can be cancelled")
-    for item in order.get("items", []):
-        await db.products.update_one(
-            {"_id": ObjectId(item["productId"])},
-            {"$inc": {"stock": item["quantity"]}}
-        )
-    # Restore store credit if any was applied
-    if order.get("storeCreditApplied", 0) > 0:
-        await db.users.update_one(
-            {"_id": ObjectId(order["userId"])},
-            {"$inc": {"creditBalance": order["storeCreditApplied"]}}
-        )
-    await db.orders.update_one({"_id": ObjectId(order_id)}, {"$set": {"status": "Cancelled"}})
+    # Stock release and store-credit refund are order events; run them before
+    # answering so the customer's next read already shows the stock released
+    await transition_order_status(order_id, "Cancelled", source="customer",
+                                  expected_from=["Pending Payment"], dispatch_inline=True)
     return {"message": "Order cancelled"}
 
 
@@ -270,14 +395,71 @@ async def cancel_order(order_id: str, user=Depends(get_current_user)):
 async def update_order_status_web(order_id: str, status_update: OrderStatusUpdate, admin=Depends(get_admin_user)):
     """
     Web-accessible order status update endpoint.
-    Identical reward logic to /admin/orders/:id/status — both call the shared service.
+    Identical reward logic to /admin/orders/:id/status — both go through the order state machine.
     """
-    return await update_order_status_shared(order_id, status_update.status, source="web")
+    return await transition_order_status(order_id, status_update.status, source="web")
+
+
+CHAT_PAGE_DEFAULT = 50
+CHAT_PAGE_MAX = 200
+
+
+def _decode_chat_cursor(cursor: str, op: str) -> dict:
+    """
+    (createdAt, _id) keyset filter from "<createdAt>" or "<createdAt>_<id>".
+    createdAt is the message's ISO string, which sorts chronologically as text.
+    """
+    created_at, _, mid = cursor.partition("_")
+    try:
+        datetime.fromisoformat(created_at)
+        oid = ObjectId(mid) if mid else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if oid is None:
+        return {"createdAt": {op: created_at}}
+    return {"$or": [
+        {"createdAt": {op: created_at}},
+        {"createdAt": created_at, "_id": {op: oid}},
+    ]}
 
 
 @router.get("/chat/messages/{chat_id}")
-async def get_chat_messages(chat_id: str, user=Depends(get_current_user)):
-    messages = await db.chat_messages.find(
-        {"chatId": chat_id}, {"_id": 0}
-    ).sort("createdAt", 1).to_list(200)
+async def get_chat_messages(
+    chat_id: str,
+    response: Response,
+    limit: int = Query(CHAT_PAGE_DEFAULT, ge=1, le=CHAT_PAGE_MAX),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    """
+    One page of a chat, oldest-first within the page.
+
+    Default / ?before=<createdAt>[_<id>]: the newest `limit` messages older
+    than the cursor (scroll back). ?since=<createdAt>[_<id>]: up to `limit`
+    messages newer than the cursor (catch-up after a socket reconnect).
+    X-Has-More says whether another page exists in that direction; the
+    cursor for it is the createdAt/id of the first (before) or last (since)
+    message returned.
+    """
+    if before and since:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'since', not both")
+    query: dict = {"chatId": chat_id}
+    if since:
+        query.update(_decode_chat_cursor(since, "$gt"))
+        direction = 1
+    else:
+        if before:
+            query.update(_decode_chat_cursor(before, "$lt"))
+        direction = -1
+    messages = await db.chat_messages.find(query).sort(
+        [("createdAt", direction), ("_id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    response.headers["X-Has-More"] = "true" if len(messages) > limit else "false"
+    messages = messages[:limit]
+    if direction == -1:
+        messages.reverse()
+    for m in messages:
+        m["id"] = str(m.pop("_id"))
     return messages
@@ -1,19 +1,20 @@
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request
-from database import db, UPLOADS_DIR
+from database import db
 from auth import get_current_user, get_admin_user
 from models.schemas import (
     Brand, BrandCreate, BrandUpdate,
     Product, ProductCreate, ProductUpdate, StockAdjustment,
     ReviewCreate, ReviewResponse
 )
-from services.order_service import _save_base64_image
+from services.image_service import store_upload_stream, store_data_uri, variants_for_image, UploadTooLarge
 from services.loyalty_service import log_cloudz_transaction
+from services.review_service import apply_rating_delta, rating_summary
+from services.inventory_service import available_stock, in_stock_filter
 from limiter import limiter, get_user_id_or_ip
 from datetime import datetime
 from pathlib import Path
 from bson import ObjectId
 from typing import List, Optional
-import uuid
 import time
 import logging
 
@@ -48,10 +49,24 @@ def resolve_image(image: str | None) -> str:
     return image
 
 
+async def _apply_image_derivatives(fields: dict) -> None:
+    """Store data-URI images as files and attach derivative URLs (thumb / card / detail)."""
+    image = fields.get("image") or ""
+    if image.startswith("data:image/"):
+        stored = await store_data_uri(image)
+        fields["image"] = stored["url"]
+        fields["imageVariants"] = stored["variants"]
+    else:
+        fields["imageVariants"] = await variants_for_image(image)
+
+
 def _build_product(raw: dict) -> dict:
-    """Return a clean product dict with a normalised image URL."""
+    """Return a clean product dict with a normalised image URL and rating summary."""
     d = {k: v for k, v in raw.items() if k not in ("_id", "id")}
     d["image"] = resolve_image(d.get("image"))
+    d.update(rating_summary(raw))
+    d["reservedStock"] = int(raw.get("reserved") or 0)
+    d["availableStock"] = available_stock(raw)
     return d
 
 
@@ -148,7 +163,7 @@ async def get_products(
     if active_only:
         query["isActive"] = True
     if in_stock_only:
-        query["stock"] = {"$gt": 0}
+        query.update(in_stock_filter())
     if category:
         query["category"] = category
     if brand_id:
@@ -178,8 +193,7 @@ async def create_product(product: ProductCreate, admin=Depends(get_admin_user)):
     if not brand:
         raise HTTPException(status_code=404, detail="Brand not found")
     product_dict = product.dict()
-    if product_dict.get("image", "").startswith("data:image/"):
-        product_dict["image"] = _save_base64_image(product_dict["image"])
+    await _apply_image_derivatives(product_dict)
     product_dict["brandName"] = brand["name"]
     product_dict["createdAt"] = datetime.utcnow()
     result = await db.products.insert_one(product_dict)
@@ -193,8 +207,8 @@ async def update_product(product_id: str, product_data: ProductUpdate, admin=Dep
     update_dict = {k: v for k, v in product_data.dict().items() if v is not None}
     if not update_dict:
         raise HTTPException(status_code=400, detail="No fields to update")
-    if update_dict.get("image", "").startswith("data:image/"):
-        update_dict["image"] = _save_base64_image(update_dict["image"])
+    if "image" in update_dict:
+        await _apply_image_derivatives(update_dict)
     if "brandId" in update_dict:
         brand = await db.brands.find_one({"_id": ObjectId(update_dict["brandId"])})
         if not brand:
@@ -252,13 +266,14 @@ async def upload_product_image(file: UploadFile = File(...), admin=Depends(get_a
     ext = Path(file.filename or "image.jpg").suffix.lower()
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail=f"File type {ext} not allowed")
-    data = await file.read()
-    if len(data) > MAX_FILE_SIZE:
+    # Early cutoff when the multipart part already reports its size
+    if file.size is not None and file.size > MAX_FILE_SIZE:
         raise HTTPException(status_code=400, detail="File too large (max 5MB)")
-    filename = f"{uuid.uuid4().hex}{ext}"
-    filepath = UPLOADS_DIR / filename
-    filepath.write_bytes(data)
-    return {"url": f"/api/uploads/products/{filename}"}
+    try:
+        stored = await store_upload_stream(file, ".jpg" if ext == ".jpeg" else ext, MAX_FILE_SIZE)
+    except UploadTooLarge:
+        raise HTTPException(status_code=400, detail="File too large (max 5MB)")
+    return {"url": stored["url"], "variants": stored["variants"]}
 
 
 # ==================== REVIEW ENDPOINTS ====================
@@ -306,6 +321,8 @@ async def create_review(request: Request, review_data: ReviewCreate, user=Depend
     }
     result = await db.reviews.insert_one(doc)
     review_id = str(result.inserted_id)
+    await apply_rating_delta(review_data.productId, review_data.rating, +1)
+    _invalidate_product_cache()
 
     # ── Review reward: 5 Cloudz for first review of this product ─────────────
     # Idempotency: the `if existing: raise 400` block above already prevents
@@ -335,14 +352,13 @@ async def create_review(request: Request, review_data: ReviewCreate, user=Depend
                 metadata={"milestone": 10},
             )
             # Web push for review milestone
-            import asyncio as _asyncio
             from services.web_push_service import send_web_push as _web_push
-            _asyncio.create_task(_web_push(user_id, {
+            await _web_push(user_id, {
                 "title": "+50 Cloudz unlocked",
                 "body":  "You hit the 10-review milestone. Bonus Cloudz added!",
                 "icon":  "/android-chrome-192x192.png",
                 "url":   "/cloudz",
-            }))
+            })
 
     return ReviewResponse(id=review_id, **{k: v for k, v in doc.items()})
 
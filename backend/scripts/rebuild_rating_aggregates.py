@@ -0,0 +1,29 @@
+"""
+ONE-TIME MIGRATION: Build ratingCount / ratingSum / ratingHistogram on every
+product from the reviews collection (hidden reviews excluded).
+
+After this runs, review create / moderate / delete keep the aggregates current.
+Safe to re-run at any time — it recomputes from scratch.
+
+Run:
+  cd /app/backend && python scripts/rebuild_rating_aggregates.py
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database import client  # noqa: E402  (loads .env)
+from services.review_service import rebuild_rating_aggregates  # noqa: E402
+
+
+async def run() -> None:
+    updated = await rebuild_rating_aggregates()
+    print(f"Done. Products with changed rating aggregates: {updated}")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -5,14 +5,30 @@ from pathlib import Path
 
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from limiter import limiter
 
 from database import client, db, UPLOADS_DIR
-from auth import SECRET_KEY, ALGORITHM
-from services.order_service import migrate_base64_images, migrate_catalog_images, cleanup_test_users, expire_pending_orders_loop, leaderboard_snapshot_loop, chat_manager
+from services.upload_static import UploadStaticFiles
+from services.image_migration import resume_interrupted_image_migration
+from services.checkout_service import ensure_checkout_indexes
+from services.inventory_service import ensure_inventory_indexes, release_expired_reservations, RELEASE_INTERVAL_SECONDS
+from services.notification_outbox import ensure_outbox_indexes, dispatch_notification_outbox, DISPATCH_INTERVAL_SECONDS
+from services.order_state import ensure_order_event_indexes, sweep_order_events, EVENT_SWEEP_INTERVAL_SECONDS
+from services.chat_writes import chat_writes, ensure_chat_indexes
+from services.chat_presence import presence, ensure_presence_indexes
+from services.chat_inbox import INBOX_CHANNEL, publish_inbox_event
+from services.user_state import user_states, close_expired_sockets, TOKEN_EXPIRY_INTERVAL_SECONDS
+from services.expo_push import ensure_expo_indexes, check_push_receipts, RECEIPT_INTERVAL_SECONDS
+from services.http_client import start_http_client, close_http_client
+from services.push_campaigns import ensure_campaign_indexes, run_push_campaigns, CAMPAIGN_INTERVAL_SECONDS
+from services.scheduler import Job, register_job, start_scheduler, stop_scheduler
+from auth import decode_token, check_user_access
+from services.order_service import (
+    cleanup_test_users, run_order_expiry, take_leaderboard_snapshot, chat_manager,
+    ORDER_EXPIRY_JOB, ORDER_EXPIRY_INTERVAL_SECONDS,
+)
 from routes.auth_routes import router as auth_router
 from routes.user_routes import router as user_router
 from routes.product_routes import router as product_router
@@ -21,8 +37,6 @@ from routes.loyalty_routes import router as loyalty_router
 from routes.admin_routes import router as admin_router
 from routes.push_routes import router as push_router
 
-import jwt
-from bson import ObjectId
 from datetime import datetime
 
 logging.basicConfig(
@@ -41,6 +55,8 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paged list endpoints (chat history, admin inbox) signal further pages in this header
+    expose_headers=["X-Has-More"],
 )
 
 
@@ -65,7 +81,8 @@ app.include_router(push_router,    prefix=api_prefix)
 
 # ==================== STATIC FILES ====================
 
-app.mount("/api/uploads/products", StaticFiles(directory=str(UPLOADS_DIR)), name="product-uploads")
+# Immutable caching, range requests and precompressed variants — see services/upload_static.py
+app.mount("/api/uploads/products", UploadStaticFiles(directory=str(UPLOADS_DIR)), name="product-uploads")
 
 
 # ==================== HEALTH CHECKS ====================
@@ -112,47 +129,84 @@ async def health_check():
 
 # ==================== WEBSOCKET (must be on app, not router) ====================
 
-@app.websocket("/api/ws/chat/{chat_id}")
-async def websocket_chat(websocket: WebSocket, chat_id: str, token: str = ""):
+async def _authenticate_socket(websocket: WebSocket, token: str):
+    """
+    (auth state, token payload) for a socket's ?token=, or None after closing
+    it with 4001. Goes through the shared user-state cache, not a users query.
+    """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            await websocket.close(code=4001)
-            return
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            await websocket.close(code=4001)
-            return
+        payload = decode_token(token)
+        user = await user_states.get(payload["sub"])
+        check_user_access(user, payload)
     except Exception:
         await websocket.close(code=4001)
-        return
+        return None
+    return user, payload
+
 
-    await chat_manager.connect(chat_id, websocket)
+def _bind_socket_user(conn, user: dict, payload: dict) -> None:
+    conn.user_id = str(user["_id"])
+    conn.token_iat = payload.get("iat", 0)
+    conn.token_exp = payload.get("exp")
+
+
+@app.websocket("/api/ws/chat/{chat_id}")
+async def websocket_chat(websocket: WebSocket, chat_id: str, token: str = "", heartbeat: bool = False):
+    if chat_id == INBOX_CHANNEL or chat_manager.is_reserved(chat_id):
+        await websocket.close(code=4003)
+        return
+    auth = await _authenticate_socket(websocket, token)
+    if not auth:
+        return
+    user, payload = auth
+    user_id = str(user["_id"])
+
+    conn = await chat_manager.connect(chat_id, websocket)
+    conn.heartbeat = heartbeat
+    _bind_socket_user(conn, user, payload)
+    is_admin = bool(user.get("isAdmin", False))
+    presence.joined(chat_id, is_admin)
+    if not is_admin:
+        await publish_inbox_event({"type": "presence", "chatId": chat_id, "online": True})
     try:
         while True:
             data = await websocket.receive_json()
+            conn.touch()
             msg_type = data.get("type", "message")
 
+            if msg_type in ("pong", "ping"):
+                continue
+
+            if msg_type == "auth":
+                # Move the socket onto a fresh token without reconnecting
+                try:
+                    fresh = decode_token(data.get("token", ""))
+                    if fresh["sub"] != user_id:
+                        raise ValueError("token is for another user")
+                    check_user_access(await user_states.get(user_id), fresh)
+                except Exception:
+                    await conn.close(4001)
+                    break
+                _bind_socket_user(conn, user, fresh)
+                continue
+
             if msg_type == "typing":
-                await chat_manager.broadcast(chat_id, {
-                    "type": "typing",
-                    "senderId": user_id,
-                    "senderName": user.get("name", user.get("email", "User")),
-                    "isTyping": data.get("isTyping", False),
-                })
+                # Debounced and expired server-side; see services/chat_presence.py
+                await presence.typing(
+                    chat_id, user_id, user.get("name", user.get("email", "User")), bool(data.get("isTyping", False))
+                )
                 continue
 
             if msg_type == "read":
-                await db.chat_messages.update_many(
-                    {"chatId": chat_id, "senderId": {"$ne": user_id}, "readAt": {"$exists": False}},
-                    {"$set": {"readAt": datetime.utcnow().isoformat(), "readBy": user_id}},
-                )
-                await chat_manager.broadcast(chat_id, {
-                    "type": "read",
-                    "readBy": user_id,
-                    "readAt": datetime.utcnow().isoformat(),
-                })
+                # Coalesced per (chat, reader); only the first request in a window is broadcast
+                if chat_writes.mark_read(chat_id, user_id):
+                    await chat_manager.broadcast(chat_id, {
+                        "type": "read",
+                        "readBy": user_id,
+                        "readAt": datetime.utcnow().isoformat(),
+                    })
+                    if is_admin:
+                        await publish_inbox_event({"type": "chat_read", "chatId": chat_id})
                 continue
 
             msg_text = data.get("message", "").strip()
@@ -170,32 +224,80 @@ async def websocket_chat(websocket: WebSocket, chat_id: str, token: str = ""):
                 "message": msg_text,
                 "createdAt": datetime.utcnow().isoformat(),
             }
-            await db.chat_messages.insert_one({**msg_doc})
-            await db.chat_sessions.update_one(
-                {"chatId": chat_id},
-                {"$set": {
-                    "chatId": chat_id,
-                    "userId": chat_id.replace("chat_", ""),
-                    "lastMessage": msg_text,
-                    "lastMessageAt": datetime.utcnow().isoformat(),
-                    "updatedAt": datetime.utcnow().isoformat(),
-                }, "$setOnInsert": {"createdAt": datetime.utcnow().isoformat()}},
-                upsert=True,
-            )
-            msg_doc.pop("_id", None)
+            await presence.clear_typing(chat_id, user_id, announce=False)  # clients hide it on message
+            # Batched insert + per-chat session upsert; returns once stored
+            stored = {**msg_doc}
+            await chat_writes.add_message(stored)
+            msg_doc["id"] = str(stored["_id"])  # same shape as GET /chat/messages, usable as a cursor
             await chat_manager.broadcast(chat_id, msg_doc)
+            await publish_inbox_event({
+                "type": "chat_updated",
+                "chatId": chat_id,
+                "lastMessage": msg_text,
+                "lastMessageAt": msg_doc["createdAt"],
+                "senderId": user_id,
+                "isAdmin": msg_doc["isAdmin"],
+            })
     except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        # Includes sockets the send side already closed (slow consumer / failed write)
+        logger.info(f"[chat] socket for {chat_id} ended: {type(e).__name__}")
+    finally:
         chat_manager.disconnect(chat_id, websocket)
+        presence.left(chat_id, is_admin)
+        await presence.clear_typing(chat_id, user_id)
+        if not is_admin:
+            await publish_inbox_event({"type": "presence", "chatId": chat_id, "online": presence.is_online(chat_id)})
+
+
+@app.websocket("/api/ws/admin/inbox")
+async def websocket_admin_inbox(websocket: WebSocket, token: str = "", heartbeat: bool = False):
+    """Receive-only feed of inbox changes for admins (services/chat_inbox.py)."""
+    auth = await _authenticate_socket(websocket, token)
+    if not auth:
+        return
+    user, payload = auth
+    if not user.get("isAdmin"):
+        await websocket.close(code=4003)
+        return
+    conn = await chat_manager.connect(INBOX_CHANNEL, websocket)
+    conn.heartbeat = heartbeat
+    _bind_socket_user(conn, user, payload)
+    try:
+        while True:
+            await websocket.receive_text()  # pongs only
+            conn.touch()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.info(f"[chat] inbox socket ended: {type(e).__name__}")
+    finally:
+        chat_manager.disconnect(INBOX_CHANNEL, websocket)
 
 
 # ==================== STARTUP / SHUTDOWN ====================
 
+async def _ensure_indexes():
+    await _ensure_analytics_indexes()
+    await ensure_checkout_indexes()
+    await ensure_inventory_indexes()
+    await ensure_order_event_indexes()
+    await ensure_outbox_indexes()
+    await ensure_expo_indexes()
+    await ensure_campaign_indexes()
+    await ensure_chat_indexes()
+    await ensure_presence_indexes()
+
+
 async def _ensure_analytics_indexes():
     """Create indexes needed for analytics queries. No-op if they already exist."""
     try:
         await db.orders.create_index([("createdAt", -1)], background=True)
         await db.orders.create_index([("userId", 1)], background=True)
         await db.orders.create_index([("status", 1)], background=True)
+        # Customer order history keyset pagination (GET /orders)
+        await db.orders.create_index([("userId", 1), ("createdAt", -1), ("_id", -1)], background=True)
         logger.info("STARTUP: analytics indexes ensured")
     except Exception as e:
         logger.warning(f"STARTUP: index creation warning (non-fatal): {e}")
@@ -214,17 +316,53 @@ async def startup_migrate():
     pub, _ = await ensure_vapid_keys()
     logger.info(f"STARTUP: VAPID public key ready ({len(pub)} chars)")
 
-    # MIGRATIONS TEMPORARILY DISABLED — re-enable after healthcheck is stable
-    # await migrate_base64_images()
-    # await migrate_catalog_images()
+    # Image / catalog migrations run as a background job (POST /api/admin/migrations/images/start);
+    # only an interrupted run is resumed here, without blocking boot.
     # await cleanup_test_users()
-    asyncio.create_task(expire_pending_orders_loop())
-    asyncio.create_task(leaderboard_snapshot_loop())
-    asyncio.create_task(_ensure_analytics_indexes())
+    asyncio.create_task(resume_interrupted_image_migration())
+
+    # Pooled outbound HTTP client shared by Expo + web push; closed on shutdown
+    start_http_client()
+
+    # Chat fan-out across workers (CHAT_BACKPLANE=mongo|memory)
+    await chat_manager.start()
+    presence.start()
+    # Disable / force-logout / merge close open sockets on every worker
+    user_states.start()
+
+    # Background jobs: each runs in only one worker at a time (Mongo lease), see GET /api/admin/jobs
+    register_job(Job("ensure_indexes", _ensure_indexes, interval=None))
+    register_job(Job(ORDER_EXPIRY_JOB, run_order_expiry, interval=ORDER_EXPIRY_INTERVAL_SECONDS, jitter=10))
+    register_job(Job("stock_reservation_release", release_expired_reservations,
+                     interval=RELEASE_INTERVAL_SECONDS, jitter=1))
+    register_job(Job("order_events", sweep_order_events, interval=EVENT_SWEEP_INTERVAL_SECONDS, jitter=2))
+    # Claims are per message, so every worker can dispatch the outbox
+    register_job(Job("notification_outbox", dispatch_notification_outbox,
+                     interval=DISPATCH_INTERVAL_SECONDS, jitter=0.5, leader_only=False))
+    register_job(Job("expo_push_receipts", check_push_receipts, interval=RECEIPT_INTERVAL_SECONDS, jitter=15))
+    # Campaigns hold their own per-campaign lease, so any worker may resume one
+    register_job(Job("push_campaigns", run_push_campaigns, interval=CAMPAIGN_INTERVAL_SECONDS,
+                     jitter=2, leader_only=False))
+    # Sockets are per worker, so each one closes its own expired-token sockets
+    register_job(Job("chat_token_expiry", close_expired_sockets, interval=TOKEN_EXPIRY_INTERVAL_SECONDS,
+                     jitter=5, leader_only=False))
+    register_job(Job("leaderboard_snapshot", take_leaderboard_snapshot, interval=86400, align=True, jitter=30))
+    start_scheduler()
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await stop_scheduler()
+    await presence.stop()
+    await chat_manager.stop()
+    await chat_writes.close()
+    from services.image_service import shutdown_image_pool
+    shutdown_image_pool()
+    from services.email_service import shutdown_email_sender
+    await shutdown_email_sender()
+    await close_http_client()
+    from services.web_push_service import shutdown_web_push_pool
+    shutdown_web_push_pool()
     client.close()
 
 
@@ -0,0 +1,143 @@
+"""
+Pub/sub backplane for chat fan-out.
+
+chat_manager.broadcast() publishes through a backplane instead of writing to
+this process's sockets directly, and every worker delivers what it receives
+to the sockets it holds. Two implementations:
+
+  InProcessBackplane  single worker (or tests): publish == local delivery.
+  MongoBackplane      any number of workers/hosts sharing the database.
+                      Events go into the capped `chat_events` collection and
+                      every worker follows it with a tailable await cursor,
+                      which works on standalone servers as well as replica
+                      sets. The publishing worker delivers locally right away
+                      and skips its own events when they come back round.
+                      ObjectIds from different workers aren't ordered, so
+                      the cursor isn't resumed with `_id $gt last`: it reads
+                      in natural (insertion) order from RESUME_OVERLAP_SECONDS
+                      before the newest event seen, and skips ids it has
+                      already handled.
+
+CHAT_BACKPLANE=memory|mongo picks one (default mongo). If the Mongo
+backplane can't start, chat falls back to in-process delivery.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from database import db
+from services.leases import WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+
+CHAT_EVENTS_SIZE_BYTES = 16 * 1024 * 1024
+CHAT_EVENTS_MAX_DOCS = 50_000
+TAIL_RETRY_SECONDS = 1
+RESUME_OVERLAP_SECONDS = 30
+
+
+class InProcessBackplane:
+    name = "memory"
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, chat_id: str, message: dict) -> None:
+        if self._deliver:
+            await self._deliver(chat_id, message)
+
+    async def stop(self) -> None:
+        self._deliver = None
+
+
+class MongoBackplane:
+    name = "mongo"
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+        self._task: Optional[asyncio.Task] = None
+        self._seen: dict = {}  # event _id -> None, oldest first (bounded by CHAT_EVENTS_MAX_DOCS)
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        try:
+            await db.create_collection(
+                "chat_events", capped=True, size=CHAT_EVENTS_SIZE_BYTES, max=CHAT_EVENTS_MAX_DOCS
+            )
+        except CollectionInvalid:
+            pass  # already exists
+        # A tailable cursor on an empty capped collection dies straight away
+        if await db.chat_events.find_one({}, {"_id": 1}) is None:
+            await db.chat_events.insert_one({"chatId": None, "origin": WORKER_ID, "createdAt": datetime.utcnow()})
+        # Don't replay history: events already in the first overlap window count as seen
+        started = datetime.utcnow()
+        since = started - timedelta(seconds=RESUME_OVERLAP_SECONDS)
+        async for event in db.chat_events.find({"createdAt": {"$gte": since}}, {"_id": 1}):
+            self._mark_seen(event["_id"])
+        self._task = asyncio.create_task(self._follow(started))
+
+    async def publish(self, chat_id: str, message: dict) -> None:
+        await db.chat_events.insert_one({
+            "chatId": chat_id,
+            "message": message,
+            "origin": WORKER_ID,
+            "createdAt": datetime.utcnow(),
+        })
+        if self._deliver:
+            await self._deliver(chat_id, message)
+
+    def _mark_seen(self, event_id) -> bool:
+        """Record an event id; False if it was already handled."""
+        if event_id in self._seen:
+            return False
+        self._seen[event_id] = None
+        if len(self._seen) > CHAT_EVENTS_MAX_DOCS:
+            del self._seen[next(iter(self._seen))]
+        return True
+
+    async def _follow(self, newest: datetime) -> None:
+        while True:
+            try:
+                # Natural order; the overlap re-reads events another worker's clock placed earlier
+                since = newest - timedelta(seconds=RESUME_OVERLAP_SECONDS)
+                cursor = db.chat_events.find(
+                    {"createdAt": {"$gte": since}}, cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    async for event in cursor:
+                        if not self._mark_seen(event["_id"]):
+                            continue
+                        newest = max(newest, event["createdAt"])
+                        if event.get("origin") == WORKER_ID or not event.get("chatId"):
+                            continue
+                        try:
+                            await self._deliver(event["chatId"], event["message"])
+                        except Exception as e:
+                            logger.warning(f"[chat] local delivery failed: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[chat] backplane cursor error: {e}")
+            await asyncio.sleep(TAIL_RETRY_SECONDS)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._deliver = None
+        self._seen.clear()
+
+
+def create_backplane():
+    kind = os.environ.get("CHAT_BACKPLANE", "mongo").lower()
+    return InProcessBackplane() if kind == "memory" else MongoBackplane()
@@ -0,0 +1,200 @@
+"""
+Chat WebSocket connections held by this worker.
+
+broadcast() goes through the pub/sub backplane (services/chat_backplane.py)
+so participants connected to other workers receive the message too;
+deliver_local() hands it to the sockets held here.
+
+Every socket gets a ChatConnection with a send queue and its own writer
+task, so fan-out never waits on a slow client: a message is serialised to
+JSON once and the same string is queued for each recipient. Whether a client
+is too slow is judged by how long its oldest unsent frame has been waiting
+(SLOW_CONSUMER_SECONDS) and how many bytes are waiting (MAX_QUEUED_BYTES),
+not by the number of frames, so a healthy client can absorb a burst that
+arrives before its writer gets to run. Past SEND_QUEUE_SIZE frames,
+ephemeral frames (typing, ping) are dropped for that client; a client that
+is behind on time or bytes is disconnected (it catches up from history on
+reconnect). A send that errors or exceeds SEND_TIMEOUT_SECONDS closes the
+socket and removes the connection.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from services.chat_backplane import InProcessBackplane, create_backplane
+
+logger = logging.getLogger(__name__)
+
+SEND_QUEUE_SIZE = 100
+SEND_TIMEOUT_SECONDS = 10
+SLOW_CONSUMER_SECONDS = 5
+MAX_QUEUED_BYTES = 1024 * 1024
+SLOW_CONSUMER_CLOSE_CODE = 4008
+DROPPABLE_TYPES = {"typing", "ping"}
+
+
+class ChatConnection:
+    def __init__(self, manager: "ConnectionManager", chat_id: str, websocket):
+        self.manager = manager
+        self.chat_id = chat_id
+        self.websocket = websocket
+        self._pending: deque = deque()  # (monotonic enqueue time, text)
+        self._queued_bytes = 0
+        self._sending_since: Optional[float] = None  # enqueue time of the frame being sent
+        self._wake = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.heartbeat = False  # client opted into ping/pong (services/chat_presence.py)
+        self.last_seen = time.monotonic()
+        # Who the socket is authenticated as (services/user_state.py)
+        self.user_id: Optional[str] = None
+        self.token_iat: float = 0
+        self.token_exp: Optional[float] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def touch(self) -> None:
+        """Record inbound traffic from the client."""
+        self.last_seen = time.monotonic()
+
+    def lag(self) -> float:
+        """Seconds the oldest frame not yet sent has been waiting."""
+        if self._sending_since is not None:
+            oldest = self._sending_since
+        elif self._pending:
+            oldest = self._pending[0][0]
+        else:
+            return 0.0
+        return time.monotonic() - oldest
+
+    def offer(self, text: str, droppable: bool) -> None:
+        """Queue a serialised frame without waiting."""
+        if self.closed:
+            return
+        if droppable and len(self._pending) >= SEND_QUEUE_SIZE:
+            self.dropped += 1
+            return
+        if self.lag() > SLOW_CONSUMER_SECONDS or self._queued_bytes + len(text) > MAX_QUEUED_BYTES:
+            if droppable:
+                self.dropped += 1
+                return
+            logger.info(f"[chat] slow consumer on {self.chat_id}; disconnecting")
+            asyncio.create_task(self.close(SLOW_CONSUMER_CLOSE_CODE))
+            return
+        self._pending.append((time.monotonic(), text))
+        self._queued_bytes += len(text)
+        self._wake.set()
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                while not self._pending:
+                    self._wake.clear()
+                    await self._wake.wait()
+                enqueued, text = self._pending.popleft()
+                self._queued_bytes -= len(text)
+                self._sending_since = enqueued
+                await asyncio.wait_for(self.websocket.send_text(text), timeout=SEND_TIMEOUT_SECONDS)
+                self._sending_since = None
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info(f"[chat] send failed on {self.chat_id} ({type(e).__name__}); dropping socket")
+            await self.close(1011)
+
+    async def close(self, code: int = 1000) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.manager.remove(self)
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    def __init__(self):
+        self.active_connections: dict[str, list[ChatConnection]] = {}
+        self.backplane = InProcessBackplane()
+        # Channels consumed by a service instead of sockets (see subscribe())
+        self._subscribers: dict[str, Callable[[dict], Awaitable[None]]] = {}
+
+    async def start(self):
+        backplane = create_backplane()
+        try:
+            await backplane.start(self.deliver_local)
+        except Exception as e:
+            logger.warning(f"[chat] {backplane.name} backplane unavailable ({e}); using in-process delivery")
+            backplane = InProcessBackplane()
+            await backplane.start(self.deliver_local)
+        self.backplane = backplane
+        logger.info(f"[chat] backplane: {backplane.name}")
+
+    async def stop(self):
+        await self.backplane.stop()
+
+    async def connect(self, chat_id: str, websocket) -> ChatConnection:
+        await websocket.accept()
+        conn = ChatConnection(self, chat_id, websocket)
+        self.active_connections.setdefault(chat_id, []).append(conn)
+        conn.start()
+        return conn
+
+    def remove(self, conn: ChatConnection) -> None:
+        conns = self.active_connections.get(conn.chat_id)
+        if not conns:
+            return
+        self.active_connections[conn.chat_id] = [c for c in conns if c is not conn]
+        if not self.active_connections[conn.chat_id]:
+            del self.active_connections[conn.chat_id]
+
+    def disconnect(self, chat_id: str, websocket):
+        for conn in list(self.active_connections.get(chat_id, [])):
+            if conn.websocket is websocket:
+                conn.closed = True
+                if conn._writer:
+                    conn._writer.cancel()
+                self.remove(conn)
+
+    def subscribe(self, channel: str, handler: Callable[[dict], Awaitable[None]]) -> None:
+        """Route a backplane channel to a handler on every worker (e.g. user state changes)."""
+        self._subscribers[channel] = handler
+
+    def is_reserved(self, channel: str) -> bool:
+        return channel in self._subscribers
+
+    async def broadcast(self, chat_id: str, message: dict):
+        await self.backplane.publish(chat_id, message)
+
+    async def deliver_local(self, chat_id: str, message: dict):
+        handler = self._subscribers.get(chat_id)
+        if handler:
+            await handler(message)
+            return
+        conns = self.active_connections.get(chat_id)
+        if not conns:
+            return
+        text = json.dumps(message, default=str)
+        droppable = message.get("type") in DROPPABLE_TYPES
+        for conn in list(conns):
+            conn.offer(text, droppable)
+
+    def get_active_chat_ids(self) -> list:
+        return list(self.active_connections.keys())
+
+    def all_connections(self) -> list[ChatConnection]:
+        return [c for conns in self.active_connections.values() for c in conns]
+
+    def connections_for_user(self, user_id: str) -> list[ChatConnection]:
+        return [c for c in self.all_connections() if c.user_id == user_id]
+
+
+chat_manager = ConnectionManager()
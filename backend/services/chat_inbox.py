@@ -0,0 +1,99 @@
+"""
+Admin chat inbox: page assembly for GET /admin/chats and live updates.
+
+A page of chat_sessions (newest lastMessageAt first) is completed with one
+$in lookup for the customers' display names and one aggregation for the
+unread counts (customer messages an admin hasn't read yet), instead of a
+query per row.
+
+Admin inbox sockets (/api/ws/admin/inbox) are registered with the chat
+connection manager under INBOX_CHANNEL, so inbox events go through the same
+backplane as chat messages and reach admins on every worker:
+
+    {"type": "chat_updated", "chatId", "lastMessage", "lastMessageAt", "senderId", "isAdmin"}
+    {"type": "chat_read", "chatId"}              an admin read the chat
+    {"type": "presence", "chatId", "online"}     the customer came or went
+
+A client that sees a chatId it doesn't have reloads the first page.
+"""
+import logging
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from database import db
+from services.chat_connections import chat_manager
+from services.chat_presence import presence
+
+logger = logging.getLogger(__name__)
+
+INBOX_CHANNEL = "admin_inbox"
+INBOX_PAGE_DEFAULT = 100
+INBOX_PAGE_MAX = 200
+
+
+def display_name(user: Optional[dict]) -> str:
+    if not user:
+        return "Unknown"
+    return " ".join(filter(None, [user.get("firstName"), user.get("lastName")])) \
+        or user.get("username") or user.get("email", "Unknown")
+
+
+def _decode_inbox_cursor(cursor: str) -> dict:
+    """(lastMessageAt, chatId) keyset filter from "<lastMessageAt>" or "<lastMessageAt>_<chatId>"."""
+    last_at, _, chat_id = cursor.partition("_")
+    if not last_at:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not chat_id:
+        return {"lastMessageAt": {"$lt": last_at}}
+    return {"$or": [
+        {"lastMessageAt": {"$lt": last_at}},
+        {"lastMessageAt": last_at, "chatId": {"$lt": chat_id}},
+    ]}
+
+
+async def inbox_page(limit: int, before: Optional[str]) -> tuple[list, bool]:
+    """One page of the inbox and whether another follows it."""
+    query = _decode_inbox_cursor(before) if before else {}
+    sessions = await db.chat_sessions.find(query, {"_id": 0}).sort(
+        [("lastMessageAt", -1), ("chatId", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    has_more = len(sessions) > limit
+    sessions = sessions[:limit]
+    if not sessions:
+        return [], False
+
+    user_ids = {s["userId"] for s in sessions if ObjectId.is_valid(s.get("userId") or "")}
+    users = {
+        str(u["_id"]): u
+        async for u in db.users.find(
+            {"_id": {"$in": [ObjectId(uid) for uid in user_ids]}},
+            {"firstName": 1, "lastName": 1, "username": 1, "email": 1},
+        )
+    }
+    unread = {
+        row["_id"]: row["count"]
+        async for row in db.chat_messages.aggregate([
+            {"$match": {
+                "chatId": {"$in": [s["chatId"] for s in sessions]},
+                "isAdmin": {"$ne": True},
+                "readAt": {"$exists": False},
+            }},
+            {"$group": {"_id": "$chatId", "count": {"$sum": 1}}},
+        ])
+    }
+    for s in sessions:
+        s["userName"] = display_name(users.get(s.get("userId")))
+        s["unread"] = unread.get(s["chatId"], 0)
+        # Customer has a socket open on any worker (services/chat_presence.py)
+        s["online"] = presence.is_online(s["chatId"])
+    return sessions, has_more
+
+
+async def publish_inbox_event(event: dict) -> None:
+    """Push an inbox change to every connected admin; never fails the caller."""
+    try:
+        await chat_manager.broadcast(INBOX_CHANNEL, event)
+    except Exception as e:
+        logger.warning(f"[chat] inbox event not published: {e}")
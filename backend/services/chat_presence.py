@@ -0,0 +1,207 @@
+"""
+Chat presence, typing state and socket heartbeats.
+
+Typing
+  Clients send a typing frame on keystrokes and an isTyping=false frame on
+  every edit that empties the box. PresenceService keeps one state per
+  (chat, user): a start is broadcast when the user begins typing and then at
+  most every TYPING_REFRESH_SECONDS while they keep going (clients hide the
+  indicator after ~3s without one); stop frames are only broadcast for a user
+  who is actually typing. A timer ends the state after TYPING_TIMEOUT_SECONDS
+  without a keystroke, and sending a message or disconnecting clears it.
+
+Presence
+  Counts of customer and admin sockets per chat. This worker's counts change
+  as sockets join and leave; every PRESENCE_SYNC_SECONDS it publishes them to
+  its row in `chat_presence` (TTL'd, so a crashed worker's row expires) and
+  reads the other workers' rows into one total per chat. counts() and
+  is_online() are dictionary lookups, cheap enough to call per inbox row.
+
+Heartbeats
+  Sockets opened with ?heartbeat=1 get a {"type": "ping"} frame every
+  HEARTBEAT_INTERVAL_SECONDS and must send something back (the clients reply
+  {"type": "pong"}); one silent for HEARTBEAT_TIMEOUT_SECONDS is half-open and
+  gets closed. It is opt-in because older app builds render unknown frames as
+  messages; their sockets rely on the server's protocol-level pings.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import db
+from services.chat_connections import chat_manager
+from services.leases import WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+TYPING_TIMEOUT_SECONDS = 5
+TYPING_REFRESH_SECONDS = 2.5
+HEARTBEAT_INTERVAL_SECONDS = 25
+HEARTBEAT_TIMEOUT_SECONDS = 60
+HEARTBEAT_CLOSE_CODE = 4009
+PRESENCE_SYNC_SECONDS = 5
+PRESENCE_TTL_SECONDS = 30
+
+_PING = '{"type": "ping"}'
+
+
+class _Typing:
+    __slots__ = ("sender_name", "announced", "timer")
+
+    def __init__(self, sender_name: str):
+        self.sender_name = sender_name
+        self.announced = 0.0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class PresenceService:
+    def __init__(self):
+        self._local: dict[str, dict] = {}    # chat_id -> {"users": n, "admins": n} on this worker
+        self._remote: dict[str, dict] = {}   # chat_id -> totals on the other workers
+        self._typing: dict[tuple[str, str], _Typing] = {}
+        self._dirty = False
+        self._published_at = datetime.min
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- presence ----------
+
+    def joined(self, chat_id: str, is_admin: bool) -> None:
+        counts = self._local.setdefault(chat_id, {"users": 0, "admins": 0})
+        counts["admins" if is_admin else "users"] += 1
+        self._dirty = True
+
+    def left(self, chat_id: str, is_admin: bool) -> None:
+        counts = self._local.get(chat_id)
+        if not counts:
+            return
+        role = "admins" if is_admin else "users"
+        counts[role] = max(0, counts[role] - 1)
+        if not counts["users"] and not counts["admins"]:
+            del self._local[chat_id]
+        self._dirty = True
+
+    def counts(self, chat_id: str) -> dict:
+        local = self._local.get(chat_id)
+        remote = self._remote.get(chat_id)
+        return {
+            "users": (local["users"] if local else 0) + (remote["users"] if remote else 0),
+            "admins": (local["admins"] if local else 0) + (remote["admins"] if remote else 0),
+        }
+
+    def is_online(self, chat_id: str) -> bool:
+        """True while the customer has a chat socket open on any worker."""
+        return self.counts(chat_id)["users"] > 0
+
+    async def _sync(self) -> None:
+        now = datetime.utcnow()
+        # Publish on change, and often enough to keep the row from expiring
+        if self._dirty or now - self._published_at >= timedelta(seconds=PRESENCE_TTL_SECONDS / 2):
+            self._dirty = False
+            self._published_at = now
+            await db.chat_presence.replace_one(
+                {"_id": WORKER_ID},
+                {"chats": [[c, n["users"], n["admins"]] for c, n in self._local.items()],
+                 "expiresAt": now + timedelta(seconds=PRESENCE_TTL_SECONDS)},
+                upsert=True,
+            )
+        remote: dict[str, dict] = {}
+        async for row in db.chat_presence.find({"_id": {"$ne": WORKER_ID}, "expiresAt": {"$gt": now}}):
+            for chat_id, users, admins in row.get("chats", []):
+                totals = remote.setdefault(chat_id, {"users": 0, "admins": 0})
+                totals["users"] += users
+                totals["admins"] += admins
+        self._remote = remote
+
+    # ---------- typing ----------
+
+    async def typing(self, chat_id: str, user_id: str, sender_name: str, is_typing: bool) -> None:
+        key = (chat_id, user_id)
+        state = self._typing.get(key)
+        if not is_typing:
+            if state:
+                await self.clear_typing(chat_id, user_id)
+            return
+        if state is None:
+            state = self._typing[key] = _Typing(sender_name)
+        elif state.timer:
+            state.timer.cancel()
+        state.timer = asyncio.get_running_loop().call_later(
+            TYPING_TIMEOUT_SECONDS, lambda: asyncio.create_task(self.clear_typing(chat_id, user_id))
+        )
+        now = time.monotonic()
+        if now - state.announced >= TYPING_REFRESH_SECONDS:
+            state.announced = now
+            await self._announce(chat_id, user_id, state.sender_name, True)
+
+    async def clear_typing(self, chat_id: str, user_id: str, announce: bool = True) -> None:
+        """End a typing state (explicit stop, timeout, message sent, disconnect)."""
+        state = self._typing.pop((chat_id, user_id), None)
+        if state is None:
+            return
+        if state.timer:
+            state.timer.cancel()
+        if announce:
+            await self._announce(chat_id, user_id, state.sender_name, False)
+
+    async def _announce(self, chat_id: str, user_id: str, sender_name: str, is_typing: bool) -> None:
+        await chat_manager.broadcast(chat_id, {
+            "type": "typing",
+            "senderId": user_id,
+            "senderName": sender_name,
+            "isTyping": is_typing,
+        })
+
+    # ---------- heartbeats ----------
+
+    async def _heartbeat(self) -> None:
+        now = time.monotonic()
+        for conn in chat_manager.all_connections():
+            if not conn.heartbeat:
+                continue
+            if now - conn.last_seen > HEARTBEAT_TIMEOUT_SECONDS:
+                logger.info(f"[chat] no heartbeat on {conn.chat_id}; closing half-open socket")
+                await conn.close(HEARTBEAT_CLOSE_CODE)
+            else:
+                conn.offer(_PING, droppable=True)
+
+    # ---------- lifecycle ----------
+
+    async def _run(self) -> None:
+        last_beat = time.monotonic()
+        while True:
+            await asyncio.sleep(PRESENCE_SYNC_SECONDS)
+            try:
+                await self._sync()
+            except Exception as e:
+                logger.warning(f"[chat] presence sync failed: {e}")
+            if time.monotonic() - last_beat >= HEARTBEAT_INTERVAL_SECONDS:
+                last_beat = time.monotonic()
+                await self._heartbeat()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for state in self._typing.values():
+            if state.timer:
+                state.timer.cancel()
+        self._typing.clear()
+        try:
+            await db.chat_presence.delete_one({"_id": WORKER_ID})
+        except Exception:
+            pass
+
+
+presence = PresenceService()
+
+
+async def ensure_presence_indexes() -> None:
+    try:
+        await db.chat_presence.create_index("expiresAt", expireAfterSeconds=0)
+    except Exception as e:
+        logger.warning(f"[chat] index creation warning (non-fatal): {e}")
@@ -0,0 +1,198 @@
+"""
+Buffered chat persistence.
+
+The chat socket handler used to write each message with its own insert_one
+plus a chat_sessions upsert, and each read receipt with its own update_many.
+ChatWriteBuffer groups those writes:
+
+  messages   held for FLUSH_WINDOW_SECONDS (or until MAX_BATCH are waiting)
+             and written with one insert_many. add_message() returns once its
+             batch is stored, so nothing is broadcast before it is durable.
+  sessions   the chat_sessions lastMessage upsert is collapsed per chat: a
+             flush writes one upsert per chat (latest message wins) in a
+             single bulk_write.
+  reads      read receipts are coalesced per (chat, reader). A pending
+             receipt is written at most once per READ_RECEIPT_INTERVAL_SECONDS
+             per key, marking everything created up to the newest request;
+             mark_read() returns True only for the call that opened the
+             pending receipt, so the "read" broadcast is rate-limited too.
+
+Writes are serialised under one lock so a later flush can't overwrite a
+session with an older lastMessage. close() flushes everything on shutdown.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from pymongo import UpdateMany, UpdateOne
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+FLUSH_WINDOW_SECONDS = 0.05
+MAX_BATCH = 500
+READ_RECEIPT_INTERVAL_SECONDS = 2.0
+
+chat_write_stats: dict = {
+    "messages": 0,
+    "message_batches": 0,
+    "session_upserts": 0,
+    "read_requests": 0,
+    "read_writes": 0,
+}
+
+
+class ChatWriteBuffer:
+    def __init__(self, window: float = FLUSH_WINDOW_SECONDS,
+                 read_interval: float = READ_RECEIPT_INTERVAL_SECONDS):
+        self.window = window
+        self.read_interval = read_interval
+        self._messages: list[tuple[dict, asyncio.Future]] = []
+        self._sessions: dict[str, dict] = {}
+        # (chat_id, reader_id) -> [readAt of newest request, monotonic time it may be written]
+        self._reads: dict[tuple[str, str], list] = {}
+        self._last_read_write: dict[tuple[str, str], float] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    # ---------- messages ----------
+
+    async def add_message(self, msg_doc: dict) -> None:
+        """Queue a chat_messages document and wait until its batch is stored (sets msg_doc['_id'])."""
+        future = asyncio.get_running_loop().create_future()
+        self._messages.append((msg_doc, future))
+        self._sessions[msg_doc["chatId"]] = {
+            "lastMessage": msg_doc["message"],
+            "lastMessageAt": msg_doc["createdAt"],
+        }
+        if len(self._messages) >= MAX_BATCH:
+            asyncio.create_task(self._flush(0))
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush(self.window))
+        await future
+
+    async def _flush(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        async with self._lock:
+            while self._messages or self._sessions:
+                batch, self._messages = self._messages[:MAX_BATCH], self._messages[MAX_BATCH:]
+                sessions, self._sessions = self._sessions, {}
+                if batch:
+                    try:
+                        await db.chat_messages.insert_many([doc for doc, _ in batch], ordered=False)
+                        chat_write_stats["messages"] += len(batch)
+                        chat_write_stats["message_batches"] += 1
+                    except Exception as e:
+                        logger.error(f"[chat] message batch of {len(batch)} failed: {e}")
+                        for _, future in batch:
+                            if not future.done():
+                                future.set_exception(e)
+                        continue
+                if sessions:
+                    await self._write_sessions(sessions)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def _write_sessions(self, sessions: dict[str, dict]) -> None:
+        now = datetime.utcnow().isoformat()
+        ops = [
+            UpdateOne(
+                {"chatId": chat_id},
+                {"$set": {
+                    "chatId": chat_id,
+                    "userId": chat_id.replace("chat_", ""),
+                    "lastMessage": s["lastMessage"],
+                    "lastMessageAt": s["lastMessageAt"],
+                    "updatedAt": now,
+                }, "$setOnInsert": {"createdAt": now}},
+                upsert=True,
+            )
+            for chat_id, s in sessions.items()
+        ]
+        try:
+            await db.chat_sessions.bulk_write(ops, ordered=False)
+            chat_write_stats["session_upserts"] += len(ops)
+        except Exception as e:
+            # Messages are stored; the next message in the chat refreshes the session
+            logger.warning(f"[chat] session update for {len(ops)} chat(s) failed: {e}")
+
+    # ---------- read receipts ----------
+
+    def mark_read(self, chat_id: str, reader_id: str) -> bool:
+        """
+        Record that reader_id has read chat_id up to now. Returns True if the
+        caller should broadcast the receipt (first request since the last write).
+        """
+        chat_write_stats["read_requests"] += 1
+        key = (chat_id, reader_id)
+        read_at = datetime.utcnow().isoformat()
+        pending = self._reads.get(key)
+        if pending:
+            pending[0] = read_at
+            return False
+        now = time.monotonic()
+        due = max(now + self.window, self._last_read_write.get(key, 0) + self.read_interval)
+        self._reads[key] = [read_at, due]
+        if self._read_task is None or self._read_task.done():
+            self._read_task = asyncio.create_task(self._read_loop())
+        return True
+
+    async def _read_loop(self) -> None:
+        while self._reads:
+            await asyncio.sleep(self.window)
+            await self._flush_reads(force=False)
+
+    async def _flush_reads(self, force: bool) -> None:
+        now = time.monotonic()
+        due = [key for key, (_, at) in self._reads.items() if force or at <= now]
+        if not due:
+            return
+        ops = []
+        for key in due:
+            read_at, _ = self._reads.pop(key)
+            self._last_read_write[key] = now
+            chat_id, reader_id = key
+            ops.append(UpdateMany(
+                {"chatId": chat_id, "senderId": {"$ne": reader_id},
+                 "readAt": {"$exists": False}, "createdAt": {"$lte": read_at}},
+                {"$set": {"readAt": read_at, "readBy": reader_id}},
+            ))
+        # Forget write times that can no longer delay anything
+        stale = now - self.read_interval
+        self._last_read_write = {k: t for k, t in self._last_read_write.items() if t > stale}
+        async with self._lock:
+            try:
+                await db.chat_messages.bulk_write(ops, ordered=False)
+                chat_write_stats["read_writes"] += len(ops)
+            except Exception as e:
+                logger.warning(f"[chat] read receipt batch of {len(ops)} failed: {e}")
+
+    # ---------- lifecycle ----------
+
+    async def close(self) -> None:
+        """Flush everything still buffered (shutdown)."""
+        await self._flush(0)
+        await self._flush_reads(force=True)
+        for task in (self._flush_task, self._read_task):
+            if task and not task.done():
+                task.cancel()
+
+
+chat_writes = ChatWriteBuffer()
+
+
+async def ensure_chat_indexes() -> None:
+    try:
+        # History pages: GET /chat/messages/{chat_id} with before/since cursors
+        await db.chat_messages.create_index([("chatId", 1), ("createdAt", 1), ("_id", 1)])
+        await db.chat_sessions.create_index("chatId")
+        # Admin inbox pages (services/chat_inbox.py)
+        await db.chat_sessions.create_index([("lastMessageAt", -1), ("chatId", -1)])
+    except Exception as e:
+        logger.warning(f"[chat] index creation warning (non-fatal): {e}")
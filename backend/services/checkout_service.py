@@ -0,0 +1,172 @@
+"""
+Checkout engine behind POST /orders.
+
+The whole cart is validated with one `$in` query against products: every
+line must exist, and the stored line name/price come from the catalog rather
+than from the client. Stock for the cart is held with one bulk_write of
+conditional updates (see services/inventory_service.py).
+
+When the deployment supports transactions (replica set or mongos — a local
+single-node replica set is enough) the stock, reward, coupon, store-credit
+and order writes run in one transaction via run_in_transaction()
+(services/transactions.py); standalone servers fall back to sequential
+writes with compensation.
+
+Clients may send an Idempotency-Key header. The key, a fingerprint of the
+request body and — once the order exists — the response are kept in
+`idempotency_keys` for 24 hours, so a retried request returns the original
+order instead of placing a second one. The response is recorded inside the
+checkout transaction, so it commits together with the order.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Must match the checkout screen (frontend/app/checkout.tsx + store/cartStore.ts)
+BULK_DISCOUNT_THRESHOLD = 10
+BULK_DISCOUNT_RATE = 0.10
+FEE_METHODS = {"Apple Pay", "Cash App", "Chime"}
+PROCESSING_FEE_RATE = 0.0175
+PRICE_TOLERANCE = 0.01
+
+IDEMPOTENCY_TTL = timedelta(hours=24)
+IDEMPOTENCY_LOCK_SECONDS = 60
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+def _product_oid(product_id: str) -> ObjectId:
+    try:
+        return ObjectId(product_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+
+
+async def load_cart(items) -> list[dict]:
+    """
+    Validate all cart lines with a single products query.
+    Returns [{productId, quantity, name, price}] priced from the catalog.
+    404 for an unknown product, 409 when the client's price is stale.
+    """
+    oids = {item.productId: _product_oid(item.productId) for item in items}
+    products = await db.products.find(
+        {"_id": {"$in": list(set(oids.values()))}},
+        {"name": 1, "price": 1},
+    ).to_list(len(oids))
+    by_oid = {p["_id"]: p for p in products}
+
+    lines = []
+    for item in items:
+        product = by_oid.get(oids[item.productId])
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product {item.productId} not found")
+        price = round(float(product.get("price", 0)), 2)
+        name = product.get("name") or item.name
+        if abs(item.price - price) > PRICE_TOLERANCE:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Price changed for {name} — please refresh your cart",
+            )
+        lines.append({
+            "productId": str(product["_id"]),
+            "quantity": item.quantity,
+            "name": name,
+            "price": price,
+        })
+    return lines
+
+
+def minimum_client_total(lines: list[dict], payment_method: str, discounts: float) -> float:
+    """
+    Lowest total the checkout screen can legitimately submit for these catalog
+    prices: subtotal less bulk discount, plus processing fee, less the
+    server-validated reward / coupon / store-credit discounts.
+    """
+    subtotal = sum(line["price"] * line["quantity"] for line in lines)
+    if sum(line["quantity"] for line in lines) >= BULK_DISCOUNT_THRESHOLD:
+        subtotal -= round(subtotal * BULK_DISCOUNT_RATE, 2)
+    if payment_method in FEE_METHODS:
+        subtotal += subtotal * PROCESSING_FEE_RATE
+    return round(max(0.0, subtotal - discounts), 2)
+
+
+# ==================== IDEMPOTENCY KEYS ====================
+
+def request_fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _idempotency_id(user_id: str, key: str) -> str:
+    return f"{user_id}:{key}"
+
+
+async def begin_idempotent_request(user_id: str, key: str, fingerprint: str) -> Optional[dict]:
+    """
+    Claim an Idempotency-Key for this user. Returns the cached response when the
+    key already completed, None when the caller should process the request.
+    422 if the key was used for a different request body, 409 while another
+    attempt with the same key is still running.
+    """
+    if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    now = datetime.utcnow()
+    doc_id = _idempotency_id(user_id, key)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": doc_id,
+            "userId": user_id,
+            "fingerprint": fingerprint,
+            "state": "in_progress",
+            "lockedUntil": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            "createdAt": now,
+            "expiresAt": now + IDEMPOTENCY_TTL,
+        })
+        return None
+    except DuplicateKeyError:
+        existing = await db.idempotency_keys.find_one({"_id": doc_id})
+
+    if existing is None or existing.get("fingerprint") != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    if existing.get("state") == "completed":
+        return existing.get("response")
+
+    # A crashed attempt leaves its lock behind; take it over once it lapses
+    taken = await db.idempotency_keys.find_one_and_update(
+        {"_id": doc_id, "state": "in_progress", "lockedUntil": {"$lt": now}},
+        {"$set": {"lockedUntil": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+    )
+    if taken:
+        return None
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is already in progress")
+
+
+async def complete_idempotent_request(user_id: str, key: str, response: dict, session=None) -> None:
+    await db.idempotency_keys.update_one(
+        {"_id": _idempotency_id(user_id, key)},
+        {"$set": {"state": "completed", "response": response, "completedAt": datetime.utcnow()}},
+        session=session,
+    )
+
+
+async def abandon_idempotent_request(user_id: str, key: str) -> None:
+    """Drop an unfinished claim so the client can retry with the same key."""
+    await db.idempotency_keys.delete_one({"_id": _idempotency_id(user_id, key), "state": "in_progress"})
+
+
+async def ensure_checkout_indexes() -> None:
+    try:
+        await db.idempotency_keys.create_index("expiresAt", expireAfterSeconds=0)
+    except Exception as e:
+        logger.warning(f"[checkout] index creation warning (non-fatal): {e}")
@@ -0,0 +1,223 @@
+"""
+Async SMTP sender with a persistent connection.
+
+send_email() in email_utils opens a fresh smtplib connection per message
+(connect, STARTTLS, login, send, quit) and blocks whatever calls it. This
+sender keeps one aiosmtplib connection open and feeds it from a bounded
+queue: a single writer task takes up to BATCH_SIZE queued messages at a time
+and sends them back to back over the same session, reconnecting when the
+server drops an idle connection. Transient failures (disconnects, 4xx
+replies) are retried with backoff; permanent ones (5xx, refused recipients)
+fail straight away. Each caller gets its own result through a future:
+deliver() raises EmailDeliveryError, whose `transient` flag tells the
+notification outbox whether to retry the message or give up on it; send()
+reduces that to a bool.
+
+Connection settings come from email_utils (SMTP_HOST / SMTP_PORT /
+SMTP_USER / SMTP_PASS). Point SMTP_HOST at a local stand-in such as aiosmtpd
+and set SMTP_STARTTLS=false to exercise it without a real mail server.
+"""
+import asyncio
+import logging
+import os
+from email.message import EmailMessage
+from typing import Optional
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 500
+BATCH_SIZE = 20
+IDLE_CLOSE_SECONDS = 60
+SEND_TIMEOUT_SECONDS = 30
+MAX_RETRIES = 3
+RETRY_BASE_SECONDS = 1
+
+
+class EmailDeliveryError(Exception):
+    """One email was not sent; `transient` says whether a retry may help."""
+
+    def __init__(self, message: str, transient: bool):
+        super().__init__(message)
+        self.transient = transient
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, aiosmtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(e, aiosmtplib.SMTPResponseException):
+        return 400 <= e.code < 500
+    return isinstance(e, (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError))
+
+
+class SmtpSender:
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        from_addr: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        start_tls: bool = True,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.from_addr = from_addr
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "connects": 0, "rejectedQueueFull": 0}
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    # ---- lifecycle ----
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self._disconnect()
+
+    # ---- public API ----
+
+    def build_message(self, to: str, subject: str, html_body: str) -> EmailMessage:
+        msg = EmailMessage()
+        msg["From"] = self.from_addr
+        msg["To"] = to
+        msg["Subject"] = subject
+        msg.set_content("This message requires an HTML-capable email client.")
+        msg.add_alternative(html_body, subtype="html")
+        return msg
+
+    async def deliver(self, to: str, subject: str, html_body: str) -> None:
+        """
+        Queue one email and wait for the writer to send it. Raises
+        EmailDeliveryError on a full queue (transient) or a failed send.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((self.build_message(to, subject, html_body), future))
+        except asyncio.QueueFull:
+            self.stats["rejectedQueueFull"] += 1
+            logger.warning(f"[smtp] send queue full — deferring email to {to}")
+            raise EmailDeliveryError("send queue full", transient=True)
+        await future
+
+    async def send(self, to: str, subject: str, html_body: str) -> bool:
+        """deliver(), reporting failure as False instead of raising."""
+        try:
+            await self.deliver(to, subject, html_body)
+            return True
+        except EmailDeliveryError:
+            return False
+
+    # ---- writer ----
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        if self._smtp is not None and self._smtp.is_connected:
+            return self._smtp
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname, port=self.port,
+            start_tls=self.start_tls, timeout=SEND_TIMEOUT_SECONDS,
+        )
+        await smtp.connect()
+        if self.username:
+            await smtp.login(self.username, self.password or "")
+        self.stats["connects"] += 1
+        self._smtp = smtp
+        return smtp
+
+    async def _disconnect(self) -> None:
+        if self._smtp is not None:
+            try:
+                if self._smtp.is_connected:
+                    await self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+    async def _send_one(self, msg: EmailMessage) -> None:
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                smtp = await self._connect()
+                await smtp.send_message(msg)
+                self.stats["sent"] += 1
+                logger.info(f"Email sent to {msg['To']}: {msg['Subject']}")
+                return
+            except Exception as e:
+                await self._disconnect()
+                transient = _is_transient(e)
+                if not transient or attempt == MAX_RETRIES:
+                    self.stats["failed"] += 1
+                    logger.error(f"Email send failed to {msg['To']}: {e}")
+                    raise EmailDeliveryError(f"SMTP send to {msg['To']} failed: {e}", transient=transient)
+                self.stats["retries"] += 1
+                await asyncio.sleep(RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), timeout=IDLE_CLOSE_SECONDS)
+            except asyncio.TimeoutError:
+                # Nothing to send for a while: let the server have its connection back
+                await self._disconnect()
+                continue
+            batch = [first]
+            while len(batch) < BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            for msg, future in batch:
+                error: Optional[EmailDeliveryError] = None
+                try:
+                    await self._send_one(msg)
+                except EmailDeliveryError as e:
+                    error = e
+                except Exception as e:
+                    logger.error(f"[smtp] unexpected send error: {e}")
+                    error = EmailDeliveryError(f"unexpected send error: {e}", transient=True)
+                if not future.done():
+                    if error:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(None)
+                self.queue.task_done()
+
+
+_sender: Optional[SmtpSender] = None
+
+
+def get_email_sender() -> SmtpSender:
+    """Process-wide sender configured from email_utils' SMTP settings."""
+    global _sender
+    if _sender is None:
+        from email_utils import SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, FROM_EMAIL
+        _sender = SmtpSender(
+            SMTP_HOST, SMTP_PORT, FROM_EMAIL,
+            username=SMTP_USER or None, password=SMTP_PASS or None,
+            start_tls=os.environ.get("SMTP_STARTTLS", "true").lower() != "false",
+        )
+    return _sender
+
+
+async def send_email_async(to: str, subject: str, html_body: str) -> bool:
+    return await get_email_sender().send(to, subject, html_body)
+
+
+async def deliver_email_async(to: str, subject: str, html_body: str) -> None:
+    await get_email_sender().deliver(to, subject, html_body)
+
+
+async def shutdown_email_sender() -> None:
+    if _sender is not None:
+        await _sender.stop()
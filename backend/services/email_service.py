@@ -4,3 +4,26 @@ except ImportError:
     def is_email_configured(): return False
     def send_email(*args, **kwargs): pass
     def build_order_confirmation_html(**kwargs): return ""
+
+try:
+    from services.email_sender import (
+        EmailDeliveryError, deliver_email_async, send_email_async, shutdown_email_sender,
+    )
+except ImportError:
+    import asyncio as _asyncio
+
+    class EmailDeliveryError(Exception):
+        def __init__(self, message, transient):
+            super().__init__(message)
+            self.transient = transient
+
+    # aiosmtplib not installed: fall back to the blocking sender, off the event loop
+    async def send_email_async(to, subject, html_body):
+        return bool(await _asyncio.to_thread(send_email, to, subject, html_body))
+
+    # The blocking sender only reports success, so every failure is treated as retryable
+    async def deliver_email_async(to, subject, html_body):
+        if not await send_email_async(to, subject, html_body):
+            raise EmailDeliveryError(f"SMTP send to {to} failed", transient=True)
+
+    async def shutdown_email_sender(): pass
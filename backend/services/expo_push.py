@@ -0,0 +1,188 @@
+"""
+Batched Expo push sending.
+
+Callers (the notification outbox) hand their messages to ExpoBatcher.send()
+and await their tickets. The batcher holds messages for BATCH_WINDOW_SECONDS
+or until it has a full chunk, then POSTs them in Expo's 100-message chunks
+over the shared HTTP client, so a burst of notifications for many users costs
+a handful of requests instead of one per user.
+
+Tickets come back in message order. A DeviceNotRegistered ticket means the
+token is dead; successful tickets are stored in `expo_push_receipts` and the
+`expo_push_receipts` job checks them after RECEIPT_DELAY (Expo delivers
+receipts asynchronously), removing tokens whose receipt says
+DeviceNotRegistered. Dead tokens are removed from push_tokens with one
+delete_many per batch.
+
+EXPO_API_URL can point at a local HTTP stand-in for tests.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+import httpx
+
+from database import db
+from services.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+EXPO_API_URL = os.environ.get("EXPO_API_URL", "https://exp.host/--/api/v2").rstrip("/")
+CHUNK_SIZE = 100
+RECEIPT_CHUNK_SIZE = 1000
+BATCH_WINDOW_SECONDS = 0.05
+RECEIPT_DELAY = timedelta(minutes=15)
+RECEIPT_INTERVAL_SECONDS = 300
+RECEIPT_RETENTION_SECONDS = 24 * 3600
+HEADERS = {"Accept": "application/json", "Content-Type": "application/json"}
+
+expo_stats: dict = {
+    "requests": 0,
+    "messages": 0,
+    "tickets_ok": 0,
+    "tickets_error": 0,
+    "tokens_removed": 0,
+    "receipts_checked": 0,
+}
+
+
+class ExpoRequestError(Exception):
+    """The whole push request failed; `transient` says whether a retry may help."""
+
+    def __init__(self, message: str, transient: bool):
+        super().__init__(message)
+        self.transient = transient
+
+
+async def remove_dead_tokens(tokens: list[str]) -> int:
+    if not tokens:
+        return 0
+    result = await db.push_tokens.delete_many({"token": {"$in": list(set(tokens))}})
+    expo_stats["tokens_removed"] += result.deleted_count
+    logger.info(f"[expo] removed {result.deleted_count} unregistered push token(s)")
+    return result.deleted_count
+
+
+async def _post(path: str, payload) -> dict:
+    try:
+        resp = await get_http_client().post(f"{EXPO_API_URL}{path}", json=payload, headers=HEADERS)
+    except httpx.HTTPError as e:
+        raise ExpoRequestError(f"Expo unreachable: {e}", transient=True)
+    expo_stats["requests"] += 1
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise ExpoRequestError(f"Expo HTTP {resp.status_code}", transient=True)
+    if resp.status_code >= 400:
+        raise ExpoRequestError(f"Expo HTTP {resp.status_code}: {resp.text[:200]}", transient=False)
+    return resp.json()
+
+
+async def send_chunk(messages: list[dict]) -> list[dict]:
+    """POST up to CHUNK_SIZE messages; returns one ticket per message and handles dead tokens."""
+    body = await _post("/push/send", messages)
+    tickets = body.get("data") or []
+    if len(tickets) != len(messages):
+        raise ExpoRequestError(f"Expo returned {len(tickets)} tickets for {len(messages)} messages", transient=True)
+    expo_stats["messages"] += len(messages)
+
+    dead, receipts = [], []
+    now = datetime.utcnow()
+    for msg, ticket in zip(messages, tickets):
+        if ticket.get("status") == "ok":
+            expo_stats["tickets_ok"] += 1
+            if ticket.get("id"):
+                receipts.append({"_id": ticket["id"], "token": msg["to"], "createdAt": now})
+        else:
+            expo_stats["tickets_error"] += 1
+            if (ticket.get("details") or {}).get("error") == "DeviceNotRegistered":
+                dead.append(msg["to"])
+    if receipts:
+        await db.expo_push_receipts.insert_many(receipts, ordered=False)
+    await remove_dead_tokens(dead)
+    return tickets
+
+
+class ExpoBatcher:
+    """Collects messages from concurrent callers and sends them in shared chunks."""
+
+    def __init__(self, window: float = BATCH_WINDOW_SECONDS):
+        self.window = window
+        self._pending: list[tuple[dict, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def send(self, messages: list[dict]) -> list[dict]:
+        """Queue messages and wait for their tickets (raises ExpoRequestError on request failure)."""
+        if not messages:
+            return []
+        loop = asyncio.get_running_loop()
+        futures = []
+        for msg in messages:
+            future = loop.create_future()
+            self._pending.append((msg, future))
+            futures.append(future)
+        if len(self._pending) >= CHUNK_SIZE:
+            asyncio.create_task(self._flush(0))
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush(self.window))
+        return list(await asyncio.gather(*futures))
+
+    async def _flush(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        while self._pending:
+            chunk, self._pending = self._pending[:CHUNK_SIZE], self._pending[CHUNK_SIZE:]
+            try:
+                tickets = await send_chunk([msg for msg, _ in chunk])
+            except Exception as e:
+                for _, future in chunk:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), ticket in zip(chunk, tickets):
+                if not future.done():
+                    future.set_result(ticket)
+
+
+expo_batcher = ExpoBatcher()
+
+
+# ==================== RECEIPTS ====================
+
+async def check_push_receipts() -> dict:
+    """Scheduler job: read receipts for tickets old enough to have them and prune dead tokens."""
+    cutoff = datetime.utcnow() - RECEIPT_DELAY
+    pending = await db.expo_push_receipts.find(
+        {"createdAt": {"$lte": cutoff}}
+    ).limit(RECEIPT_CHUNK_SIZE * 5).to_list(RECEIPT_CHUNK_SIZE * 5)
+    if not pending:
+        return {"checked": 0, "tokensRemoved": 0}
+
+    token_by_ticket = {r["_id"]: r["token"] for r in pending}
+    ids = list(token_by_ticket)
+    dead, checked = [], []
+    for i in range(0, len(ids), RECEIPT_CHUNK_SIZE):
+        chunk = ids[i:i + RECEIPT_CHUNK_SIZE]
+        body = await _post("/push/getReceipts", {"ids": chunk})
+        receipts = body.get("data") or {}
+        for ticket_id in chunk:
+            receipt = receipts.get(ticket_id)
+            if receipt is None:
+                continue  # not ready yet; retried next run until the TTL drops it
+            checked.append(ticket_id)
+            if receipt.get("status") == "error" and (receipt.get("details") or {}).get("error") == "DeviceNotRegistered":
+                dead.append(token_by_ticket[ticket_id])
+    if checked:
+        await db.expo_push_receipts.delete_many({"_id": {"$in": checked}})
+    removed = await remove_dead_tokens(dead)
+    expo_stats["receipts_checked"] += len(checked)
+    return {"checked": len(checked), "tokensRemoved": removed}
+
+
+async def ensure_expo_indexes() -> None:
+    try:
+        await db.expo_push_receipts.create_index("createdAt", expireAfterSeconds=RECEIPT_RETENTION_SECONDS)
+        await db.push_tokens.create_index([("userId", 1), ("token", 1)])
+        await db.push_tokens.create_index("token")
+    except Exception as e:
+        logger.warning(f"[expo] index creation warning (non-fatal): {e}")
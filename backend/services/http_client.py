@@ -0,0 +1,44 @@
+"""
+Shared outbound HTTP client.
+
+One pooled httpx.AsyncClient per process, opened at startup and closed at
+shutdown by the app lifespan (server.py), reused for push-service traffic so
+each notification rides an existing keep-alive connection instead of paying
+for a fresh TCP + TLS handshake. HTTP/2 is used when the `h2` package is
+installed (push services multiplex many requests over one connection);
+otherwise the client falls back to pooled HTTP/1.1.
+"""
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def start_http_client() -> httpx.AsyncClient:
+    return get_http_client()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The shared client; created on first use if startup hasn't opened it yet."""
+    global _client
+    if _client is None or _client.is_closed:
+        try:
+            _client = httpx.AsyncClient(http2=True, timeout=TIMEOUT, limits=LIMITS)
+        except ImportError:
+            logger.info("[http] h2 not installed — shared client using HTTP/1.1")
+            _client = httpx.AsyncClient(timeout=TIMEOUT, limits=LIMITS)
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
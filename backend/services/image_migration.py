@@ -0,0 +1,486 @@
+"""
+Resumable background job that moves base64 data-URI images out of MongoDB and
+applies the verified catalog image / brand / model fixes.
+
+Replaces the old boot-time `migrate_base64_images` / `migrate_catalog_images`,
+which blocked startup long enough to fail health checks. Progress lives in a
+`migration_checkpoints` document, so a paused or interrupted run picks up at
+the last committed batch:
+
+    products → brands   base64 → file, _id-ordered batches, bulk_write per batch
+    catalog             idempotent catalog fix steps, one checkpoint per step
+
+Only the worker holding the `image_migration` lease runs batches. Pause/resume
+flips the checkpoint state; the runner notices between batches.
+"""
+import asyncio
+import logging
+import re
+from datetime import datetime
+
+from pymongo import UpdateMany, UpdateOne
+
+from database import db
+from services.image_service import decode_data_uri, store_image_bytes
+from services.leases import WORKER_ID, acquire_lease, release_lease, get_lease
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_ID = "image_migration"
+LEASE_NAME = "image_migration"
+LEASE_TTL = 60          # seconds; renewed every batch
+BATCH_SIZE = 50
+DECODE_CONCURRENCY = 4  # parallel decode + file writes per batch
+PHASES = ["products", "brands", "catalog"]
+
+_runner: asyncio.Task | None = None
+
+
+# ==================== CATALOG DATA ====================
+
+CLIO_IMAGES = {
+    "Code Red":             "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-code-red.webp",
+    "Cool Mint":            "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-cool-mint.webp",
+    "White Peach Raspberry":"https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-white-peach-raspberry.webp",
+    "Dragonfruit Lemonade": "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-dragonfruit-lemonade.webp",
+    "Fcuking Fab":          "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-fcuking-fab.webp",
+    "Peach Slush":          "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-peach-slush.webp",
+    "Sour Watermelon Drop": "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-sour-watermelon-drop.webp",
+    "Strawberry B-Burst":   "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-strawberry-bburst.webp",
+}
+CLR_IMAGES = {
+    "Sour Apple Ice":   "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Sour-Apple-Ice.jpg",
+    "Sour Gush":        "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Sour-Gush.jpg",
+    "Sour Strawberry":  "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Sour-Strawberry.jpg",
+    "Amazon Lemonade":  "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Amazon-Lemonade.jpg",
+    "Banana Ice":       "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Banana-Ice.jpg",
+    "Strazz":           "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Strazz.jpg",
+    "Triple Berry Ice": "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Triple-Berry-Ice.jpg",
+    "Watermelon Ice":   "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Watermelon-Ice.jpg",
+    "White Gummy":      "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-White-Gummy.jpg",
+    "Blue Rancher":     "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Blue-Rancher.jpg",
+    "Blue Razz Ice":    "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Blue-Razz-Ice.jpg",
+    "Cool Mint":        "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Cool-Mint.jpg",
+    "Miami Mint":       "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Mint-Mint.jpg",
+    "Peach Berry":      "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Peach-Berry.jpg",
+    "Pineapple Savers": "https://ebcreate.store/cdn/shop/files/Geek-Bar-CLR-50K-Pineapple-Savers.jpg",
+}
+MODEL_CDN_MAP = {
+    # (brandName, model)   → CDN URL
+    ("Geek Bar", "Pulse X"):          "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2539/9022/PULSE_X_01-800x800__41304.1755553340.jpg?c=2",
+    ("Geek Bar", "Pulse"):            "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2490/8990/geek-bar-geek-bar-pulse-15000__33880.1717506396.jpg?c=2",
+    ("Geek Bar", "Meloso Mini"):      "https://oss.geekbar.com/products/meloso-mini/flavor3.jpg",
+    ("Geek Bar", "Meloso"):           "https://oss.geekbar.com/products/meloso-mini/flavor3.jpg",
+    ("Geek Bar", "Meloso Max"):       "https://oss.geekbar.com/products/meloso-mini/flavor3.jpg",
+    ("RAZ",      "CA6000"):           "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2399/5769/raz-ca6000-disposable-6000-puffs__71199.1713328264.jpg?c=2",
+    ("RAZ",      "TN9000"):           "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2480/8471/raz-tn9000__46610.1713328462.jpg?c=2",
+    ("RAZ",      "RYL 35K"):          "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2628/9490/RYL-Classic-35K-Box_Blue-Raz-Ice-800x800__55999.1738881104.jpg?c=2",
+    ("RAZ",      "VUE 50K"):          None,   # handled per-type below
+    ("Lost Mary","Nera 70K"):         None,   # handled per-type below
+    ("Lost Mary","MT35000 Turbo"):    "https://d31ixytk8zua6i.cloudfront.net/products/mt35000/p3_product_2x.png",
+}
+VUE_KIT_IMG  = "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2807/10165/RAZ-VUE-50K-Full-Kit_00-800x800__68447.1769025029.jpg?c=2"
+VUE_POD_IMG  = "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2808/10169/VUE_Pods_Web_Square-800x800__45772.1769025312.jpg?c=2"
+NERA_POD_IMG = "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2768/10013/___77235.1760038255.png?c=2"
+NERA_KIT_IMG = "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2767/10010/___71173.1760037985.png?c=2"
+CLIO_LATE_IMAGES = {
+    "Triple Berry Ice": "https://bigmosmokeshop.com/wp-content/uploads/2026/02/clio-triple-berry-ice.webp",
+}
+RX50K_IMAGES = {
+    "Code Green (Dew Edition)":  "https://cdn11.bigcommerce.com/s-w062o0xp7r/images/stencil/1280x1280/products/5285/20751/RAZ-RX50K-Dew-Edition-Disposable-Vape-Code-Green__53639.1764815893.jpg?c=1",
+    "Code Pink (Dew Edition)":   "https://cdn11.bigcommerce.com/s-w062o0xp7r/images/stencil/1280x1280/products/5285/20747/RAZ-RX50K-Dew-Edition-Disposable-Vape-Code-Pink__54438.1764815893.jpg?c=1",
+    "Code Red (Dew Edition)":    "https://cdn11.bigcommerce.com/s-w062o0xp7r/images/stencil/1280x1280/products/5285/20750/RAZ-RX50K-Dew-Edition-Disposable-Vape-Code-Red__76650.1764815893.jpg?c=1",
+    "Code White (Dew Edition)":  "https://cdn11.bigcommerce.com/s-w062o0xp7r/images/stencil/1280x1280/products/5285/20748/RAZ-RX50K-Dew-Edition-Disposable-Vape-Code-White__86701.1764815893.jpg?c=1",
+}
+RIA_IMAGES = {
+    "Deep Purple":        "https://nexussmoke.com/wp-content/uploads/2025/11/Deep-Purple-Watermark-600x600.png",
+    "Dualicious":         "https://nexussmoke.com/wp-content/uploads/2025/05/Dualicious-600x600.png",
+    "Watermelon B-Burst": "https://nexussmoke.com/wp-content/uploads/2025/05/Watermelon_B-Pop-600x600.png",
+}
+REQUIRED_BRANDS = ["Geek Bar", "Lost Mary", "RAZ", "VIHO", "ExtreBar", "Maskking", "Digiflavor SKY", "RYL 35k"]
+MODEL_PATTERNS = [
+    ("Nera Fullview 70K POD",  "pod",        "Lost Mary"),
+    ("Nera Fullview 70K Kit",  "kit",        "Lost Mary"),
+    ("CLR 50K",                "disposable", "Geek Bar"),
+    ("CLIO Platinum 50K",      "pod",        "Geek Bar"),
+    ("Pulse",                  "disposable", "Geek Bar"),
+    ("RIA NV30K",              "disposable", "Geek Bar"),
+    ("VUE 50K",                "pod",        "RAZ"),
+]
+MELOSO_MINI_IMAGES = {
+    "Blueberry Ice":       "https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTSmHsnkAoXNCVXwhVHPV7rpmrkluktzUXnL0vmoCV9gg&s=10",
+    "Miami Mint":          "https://www.jellypuffs.com/cdn/shop/files/geek-bar-meloso-mini-1500-disposable-miami-mint-1204364919.jpg",
+    "Alaskan Mint":        "https://www.jellypuffs.com/cdn/shop/files/alaskan-mint-geek-bar-meloso-mini-1500-disposable-1192504717.jpg",
+    "Raspberry Watermelon": "https://www.jellypuffs.com/cdn/shop/files/geek-bar-meloso-mini-1500-disposable-raspberry-watermelon-1204364921.jpg",
+    "Strawberry Mango":    "https://www.jellypuffs.com/cdn/shop/files/strawberry-mango-geek-bar-meloso-mini-1500-disposable-1184434120.jpg",
+}
+CA6000_IMAGES = {
+    "Frozen Strawberry":    "https://vaperdudes.com/cdn/shop/products/raz_geek_vape_ca6000_frozen_strawberry_wholesale_distributor_near_me_free_shipping_master_wholesaler_flum_slimz_air_bar.jpg",
+    "Dragon Fruit Lemonade": "https://vaperdudes.com/cdn/shop/products/raz_geek_vape_ca6000_dragonfruit_lemonade_wholesale_distributor_near_me_free_shipping_master_wholesaler_flum_slimz_air_bar.jpg",
+    "Strawberry Kiwi":      "https://vaperdudes.com/cdn/shop/products/raz_geek_vape_ca6000_strawberry_kiwi_wholesale_distributor_near_me_free_shipping_master_wholesaler_flum_slimz_air_bar.jpg",
+    "Fuji Blue Raz":        "https://www.vapepapa.com/cdn/shop/files/raz-ca6000-Fuji-Blue-Razz-flavor-disposable-vape-15.jpg",
+}
+VUE_POD_IMAGES = {
+    "Blue Raz Ice":     "https://www.ejuicedb.com/cdn/shop/files/blue-raz-ice-raz-vue-50k-pod-flavor.webp",
+    "Hawaiian Punch":   "https://www.ejuicedb.com/cdn/shop/files/hawaiian-punch-raz-vue-50k-pod-flavor.webp",
+    "Miami Mint":       "https://www.ejuicedb.com/cdn/shop/files/miami-mint-raz-vue-50k-pod-flavor.webp",
+    "Pineapple MTN Dew": "https://www.ejuicedb.com/cdn/shop/files/pineapple-mtn-dew-raz-vue-50k-pod-flavor.webp",
+    "Polar Ice":        "https://www.ejuicedb.com/cdn/shop/files/polar-ice-raz-vue-50k-pod-flavor.webp",
+    "Strawberry Blast": "https://www.ejuicedb.com/cdn/shop/files/strawberry-blast-raz-vue-50k-pod-flavor.webp",
+    "Triple Berry Lime": "https://www.ejuicedb.com/cdn/shop/files/triple-berry-lime-raz-vue-50k-pod-flavor.webp",
+    "Watermelon Ice":   "https://www.ejuicedb.com/cdn/shop/files/watermelon-ice-raz-vue-50k-pod-flavor.webp",
+    "White Gummy":      "https://www.ejuicedb.com/cdn/shop/files/White_Gummy_1__25161.webp",
+    "Sour Apple Ice":   "https://www.ejuicedb.com/cdn/shop/files/sour-apple-ice-raz-vue-50k-pod-flavor.webp",
+}
+NERA_POD_BRAND_NAME = "Lost Mary"
+NERA_POD_FALLBACK_IMG = "https://cdn11.bigcommerce.com/s-nlylv/images/stencil/1280x1280/products/2768/10013/___77235.1760038255.png?c=2"
+NERA_REQUIRED_PODS = ["Blue Razz Ice", "Pink Lemonade", "Golden Berry"]
+
+
+# ==================== CATALOG STEPS ====================
+# Each step is idempotent; the checkpoint advances after a step completes. Steps that
+# replace `image` with a CDN URL also drop imageVariants, which describe the old file.
+
+def _slugify(text: str) -> str:
+    return re.sub(r'-+', '-', re.sub(r'[^a-z0-9]+', '-', text.lower())).strip('-')
+
+
+async def _bulk_products(ops: list) -> int:
+    modified = 0
+    for i in range(0, len(ops), 500):
+        result = await db.products.bulk_write(ops[i:i + 500], ordered=False)
+        modified += result.modified_count
+    return modified
+
+
+async def _set_flavor_images(base_filter: dict, images: dict) -> int:
+    return await _bulk_products([
+        UpdateMany({**base_filter, "flavor": flavor}, {"$set": {"image": url}, "$unset": {"imageVariants": ""}})
+        for flavor, url in images.items()
+    ])
+
+
+async def _step_local_upload_cdn() -> int:
+    """Replace broken /api/uploads/ paths with CDN images for known model groups."""
+    ops = []
+    async for p in db.products.find(
+        {"image": {"$regex": "^/api/uploads/"}},
+        {"_id": 1, "brandName": 1, "model": 1, "productType": 1},
+    ):
+        bn, mod, pt = p.get("brandName", ""), p.get("model", ""), p.get("productType", "")
+        if (bn, mod) not in MODEL_CDN_MAP:
+            continue
+        new_img = MODEL_CDN_MAP[(bn, mod)]
+        if not new_img and mod == "VUE 50K":
+            new_img = VUE_KIT_IMG if pt == "kit" else VUE_POD_IMG
+        elif not new_img and mod == "Nera 70K":
+            new_img = NERA_KIT_IMG if pt == "kit" else NERA_POD_IMG
+        if new_img:
+            ops.append(UpdateOne({"_id": p["_id"]}, {"$set": {"image": new_img}, "$unset": {"imageVariants": ""}}))
+    return await _bulk_products(ops)
+
+
+async def _step_brand_normalization() -> int:
+    """Ensure required brand documents exist and every product's brandId is valid."""
+    existing = await db.brands.find({"name": {"$in": REQUIRED_BRANDS}}, {"_id": 1, "name": 1}).to_list(100)
+    brand_name_to_id = {b["name"]: str(b["_id"]) for b in existing}
+    for bname in REQUIRED_BRANDS:
+        if bname in brand_name_to_id:
+            continue
+        result = await db.brands.insert_one({
+            "name": bname,
+            "slug": _slugify(bname),
+            "description": f"{bname} disposable vapes",
+            "isActive": True,
+            "createdAt": datetime.utcnow(),
+            "updatedAt": datetime.utcnow(),
+        })
+        brand_name_to_id[bname] = str(result.inserted_id)
+        logger.info(f"Brand normalization: created brand '{bname}'")
+
+    ops = [
+        UpdateMany({"brandName": bname, "brandId": {"$ne": bid}}, {"$set": {"brandId": bid}})
+        for bname, bid in brand_name_to_id.items()
+    ]
+    # Infer missing brandName from model/flavor fields
+    async for p in db.products.find(
+        {"$or": [{"brandName": None}, {"brandName": ""}, {"brandName": {"$exists": False}}]},
+        {"_id": 1, "model": 1, "flavor": 1},
+    ):
+        text = f"{p.get('model', '')} {p.get('flavor', '')}".lower()
+        for bname in REQUIRED_BRANDS:
+            if bname.lower() in text:
+                ops.append(UpdateOne(
+                    {"_id": p["_id"]},
+                    {"$set": {"brandName": bname, "brandId": brand_name_to_id[bname]}},
+                ))
+                break
+    return await _bulk_products(ops)
+
+
+async def _step_model_inference() -> int:
+    """Fill model (and productType) from the product name where model is missing."""
+    ops = []
+    async for p in db.products.find(
+        {"$or": [{"model": None}, {"model": ""}, {"model": {"$exists": False}}]},
+        {"_id": 1, "name": 1, "brandName": 1},
+    ):
+        name = (p.get("name") or "").strip()
+        brand = (p.get("brandName") or "").strip()
+        for model_str, prod_type, expected_brand in MODEL_PATTERNS:
+            if model_str.lower() in name.lower() and (not expected_brand or brand == expected_brand):
+                ops.append(UpdateOne({"_id": p["_id"]}, {"$set": {"model": model_str, "productType": prod_type}}))
+                break
+        else:
+            if name and " - " in name:
+                ops.append(UpdateOne({"_id": p["_id"]}, {"$set": {"model": name.split(" - ")[0].strip()}}))
+    return await _bulk_products(ops)
+
+
+async def _step_nera_normalization() -> int:
+    """Rename legacy Lost Mary 'Nera 70K' models and ensure the required POD products exist."""
+    ops = []
+    async for p in db.products.find(
+        {"brandName": "Lost Mary", "model": {"$regex": "nera 70", "$options": "i"}},
+        {"_id": 1, "model": 1, "flavor": 1, "productType": 1},
+    ):
+        is_kit = "kit" in (p.get("model") or "").lower() or (p.get("productType") or "").lower() == "kit"
+        slug_part = "nera-fullview-70k-kit" if is_kit else "nera-fullview-70k-pod"
+        ops.append(UpdateOne({"_id": p["_id"]}, {"$set": {
+            "model": "Nera Fullview 70K Kit" if is_kit else "Nera Fullview 70K POD",
+            "slug": _slugify(f"lost-mary-{slug_part}-{p.get('flavor', '')}"),
+        }}))
+    changed = await _bulk_products(ops)
+
+    lm_brand = await db.brands.find_one({"name": NERA_POD_BRAND_NAME}, {"_id": 1})
+    if not lm_brand:
+        return changed
+    present = await db.products.distinct(
+        "flavor", {"brandName": NERA_POD_BRAND_NAME, "model": "Nera Fullview 70K POD", "flavor": {"$in": NERA_REQUIRED_PODS}},
+    )
+    missing = [f for f in NERA_REQUIRED_PODS if f not in present]
+    if missing:
+        await db.products.insert_many([{
+            "name":             f"Nera Fullview 70K POD - {flavor}",
+            "brandName":        NERA_POD_BRAND_NAME,
+            "brandId":          str(lm_brand["_id"]),
+            "model":            "Nera Fullview 70K POD",
+            "flavor":           flavor,
+            "productType":      "pod",
+            "category":         "pods",
+            "puffCount":        70000,
+            "nicotinePercent":  5.0,
+            "nicotineStrength": "5%",
+            "price":            25.0,
+            "stock":            1,
+            "cloudzReward":     75,
+            "lowStockThreshold": 3,
+            "image":            NERA_POD_FALLBACK_IMG,
+            "slug":             _slugify(f"lost-mary-nera-fullview-70k-pod-{flavor}"),
+            "isActive":         True,
+            "isFeatured":       False,
+            "displayOrder":     0,
+            "description":      f"Lost Mary Nera Fullview 70K POD – {flavor}. 70,000 puffs. 5% nicotine.",
+            "createdAt":        datetime.utcnow(),
+        } for flavor in missing])
+        logger.info(f"Created missing Nera Fullview 70K PODs: {missing}")
+    return changed + len(missing)
+
+
+CATALOG_STEPS = [
+    ("clio_images",      lambda: _set_flavor_images({"brandName": "Geek Bar", "model": "CLIO Platinum 50K"}, CLIO_IMAGES)),
+    ("clr_images",       lambda: _set_flavor_images({"brandName": "Geek Bar", "model": "CLR 50K"}, CLR_IMAGES)),
+    ("local_upload_cdn", _step_local_upload_cdn),
+    ("rx50k_images",     lambda: _set_flavor_images({"brandName": "RAZ", "model": "RX50K"}, RX50K_IMAGES)),
+    ("ria_images",       lambda: _set_flavor_images({"brandName": "Geek Bar", "model": "RIA"}, RIA_IMAGES)),
+    ("brand_normalization", _step_brand_normalization),
+    ("model_inference",  _step_model_inference),
+    ("clio_late_images", lambda: _set_flavor_images({"brandName": "Geek Bar", "model": "CLIO Platinum 50K"}, CLIO_LATE_IMAGES)),
+    ("meloso_mini_images", lambda: _set_flavor_images({"brandName": "Geek Bar", "model": "Meloso Mini"}, MELOSO_MINI_IMAGES)),
+    ("ca6000_images",    lambda: _set_flavor_images({"brandName": "RAZ", "model": "CA6000"}, CA6000_IMAGES)),
+    ("vue_pod_images",   lambda: _set_flavor_images({"brandName": "RAZ", "model": "VUE 50K", "productType": "pod"}, VUE_POD_IMAGES)),
+    ("nera_normalization", _step_nera_normalization),
+]
+
+
+# ==================== BASE64 → FILE BATCHES ====================
+
+async def _convert_one(doc: dict, prefix: str, sem: asyncio.Semaphore) -> tuple[str, dict | None]:
+    """Decode + write one image. Returns (outcome, $set fields or None)."""
+    async with sem:
+        try:
+            raw, ext = await asyncio.to_thread(decode_data_uri, doc["image"])
+            if len(raw) < 100:
+                return "invalid", None
+            stored = await store_image_bytes(raw, ext, prefix)
+        except Exception as e:
+            logger.warning(f"[image_migration] undecodable image on {doc['_id']}: {e}")
+            return "invalid", None
+    fields = {"image": stored["url"]}
+    if not prefix:
+        fields["imageVariants"] = stored["variants"]
+    return "migrated", fields
+
+
+async def _run_base64_batch(phase: str, checkpoint: dict) -> bool:
+    """Process one batch of the products/brands phase. Returns True when the phase is exhausted."""
+    coll = db.products if phase == "products" else db.brands
+    query: dict = {"image": {"$regex": "^data:image/"}}
+    if checkpoint.get("lastId") is not None:
+        query["_id"] = {"$gt": checkpoint["lastId"]}
+    docs = await coll.find(query, {"_id": 1, "image": 1}).sort("_id", 1).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+    if not docs:
+        return True
+
+    sem = asyncio.Semaphore(DECODE_CONCURRENCY)
+    prefix = "" if phase == "products" else "brand_"
+    results = await asyncio.gather(*(_convert_one(d, prefix, sem) for d in docs))
+
+    ops = []
+    counts = {"migrated": 0, "invalid": 0}
+    for doc, (outcome, fields) in zip(docs, results):
+        counts[outcome] += 1
+        if fields:
+            ops.append(UpdateOne({"_id": doc["_id"], "image": doc["image"]}, {"$set": fields}))
+        elif phase == "products":
+            # Products with corrupt data-URIs are cleared (brands are left as-is)
+            ops.append(UpdateOne(
+                {"_id": doc["_id"], "image": doc["image"]},
+                {"$set": {"image": ""}, "$unset": {"imageVariants": ""}},
+            ))
+    if ops:
+        await coll.bulk_write(ops, ordered=False)
+
+    await db.migration_checkpoints.update_one(
+        {"_id": CHECKPOINT_ID},
+        {
+            "$set": {"lastId": docs[-1]["_id"], "updatedAt": datetime.utcnow()},
+            "$inc": {
+                f"counts.{phase}.processed": len(docs),
+                f"counts.{phase}.migrated": counts["migrated"],
+                f"counts.{phase}.invalid": counts["invalid"],
+            },
+        },
+    )
+    return len(docs) < BATCH_SIZE
+
+
+# ==================== RUNNER ====================
+
+async def _advance_phase(phase: str) -> None:
+    next_phase = PHASES[PHASES.index(phase) + 1] if phase != PHASES[-1] else None
+    update = {"phase": next_phase, "lastId": None, "updatedAt": datetime.utcnow()}
+    if next_phase is None:
+        update.update({"state": "completed", "finishedAt": datetime.utcnow()})
+        logger.info("[image_migration] completed")
+    await db.migration_checkpoints.update_one({"_id": CHECKPOINT_ID, "state": "running"}, {"$set": update})
+
+
+async def _run() -> None:
+    try:
+        while True:
+            if not await acquire_lease(LEASE_NAME, LEASE_TTL):
+                logger.info("[image_migration] another worker holds the lease — not running here")
+                return
+            checkpoint = await db.migration_checkpoints.find_one({"_id": CHECKPOINT_ID})
+            if not checkpoint or checkpoint.get("state") != "running":
+                return
+            phase = checkpoint.get("phase")
+            if phase in ("products", "brands"):
+                if await _run_base64_batch(phase, checkpoint):
+                    await _advance_phase(phase)
+            elif phase == "catalog":
+                step_index = int(checkpoint.get("catalogStep") or 0)
+                if step_index >= len(CATALOG_STEPS):
+                    await _advance_phase(phase)
+                    continue
+                step_name, step = CATALOG_STEPS[step_index]
+                changed = await step()
+                logger.info(f"[image_migration] catalog step {step_name}: {changed} change(s)")
+                await db.migration_checkpoints.update_one(
+                    {"_id": CHECKPOINT_ID},
+                    {"$set": {"catalogStep": step_index + 1, "updatedAt": datetime.utcnow()},
+                     "$inc": {"counts.catalog.changed": changed}},
+                )
+            else:
+                return
+            await asyncio.sleep(0)  # let request handlers in between batches
+    except Exception as e:
+        logger.error(f"[image_migration] failed: {e}")
+        await db.migration_checkpoints.update_one(
+            {"_id": CHECKPOINT_ID},
+            {"$set": {"state": "failed", "error": str(e)[:500], "updatedAt": datetime.utcnow()}},
+        )
+    finally:
+        await release_lease(LEASE_NAME)
+
+
+def _ensure_runner() -> None:
+    global _runner
+    if _runner is None or _runner.done():
+        _runner = asyncio.create_task(_run())
+
+
+# ==================== CONTROL API ====================
+
+async def get_image_migration_status() -> dict:
+    checkpoint = await db.migration_checkpoints.find_one({"_id": CHECKPOINT_ID}) or {"state": "idle"}
+    checkpoint.pop("_id", None)
+    if checkpoint.get("lastId") is not None:
+        checkpoint["lastId"] = str(checkpoint["lastId"])
+    lease = await get_lease(LEASE_NAME)
+    active = lease and lease.get("expiresAt") and lease["expiresAt"] > datetime.utcnow()
+    checkpoint["owner"] = lease.get("owner") if active else None
+    checkpoint["catalogSteps"] = len(CATALOG_STEPS)
+    return checkpoint
+
+
+async def start_image_migration(reset: bool = False) -> dict:
+    """Start (or restart from scratch with reset=True) the migration in the background."""
+    checkpoint = await db.migration_checkpoints.find_one({"_id": CHECKPOINT_ID})
+    if reset or not checkpoint or checkpoint.get("state") in ("completed", "idle"):
+        await db.migration_checkpoints.replace_one(
+            {"_id": CHECKPOINT_ID},
+            {
+                "state": "running",
+                "phase": PHASES[0],
+                "lastId": None,
+                "catalogStep": 0,
+                "counts": {},
+                "startedAt": datetime.utcnow(),
+                "updatedAt": datetime.utcnow(),
+                "startedBy": WORKER_ID,
+            },
+            upsert=True,
+        )
+    else:
+        await db.migration_checkpoints.update_one(
+            {"_id": CHECKPOINT_ID},
+            {"$set": {"state": "running", "updatedAt": datetime.utcnow()}, "$unset": {"error": ""}},
+        )
+    _ensure_runner()
+    return await get_image_migration_status()
+
+
+async def pause_image_migration() -> dict:
+    await db.migration_checkpoints.update_one(
+        {"_id": CHECKPOINT_ID, "state": "running"},
+        {"$set": {"state": "paused", "updatedAt": datetime.utcnow()}},
+    )
+    return await get_image_migration_status()
+
+
+async def resume_image_migration() -> dict:
+    return await start_image_migration(reset=False)
+
+
+async def resume_interrupted_image_migration() -> None:
+    """Startup hook: pick a run back up if a restart interrupted it. Never blocks boot."""
+    try:
+        checkpoint = await db.migration_checkpoints.find_one({"_id": CHECKPOINT_ID}, {"state": 1})
+        if checkpoint and checkpoint.get("state") == "running":
+            # The previous owner's lease must lapse before another worker can take over
+            await asyncio.sleep(LEASE_TTL)
+            _ensure_runner()
+    except Exception as e:
+        logger.warning(f"[image_migration] resume check failed (non-fatal): {e}")
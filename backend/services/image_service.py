@@ -0,0 +1,216 @@
+"""
+Product image derivative pipeline.
+
+Every stored product image gets resized WebP (and AVIF, when the installed
+Pillow build supports it) derivatives for the three sizes the app renders:
+thumb, card and detail. Derivatives are re-encoded from pixels only, so EXIF /
+GPS / ICC metadata from the original upload is never served to clients.
+
+Files are named by content hash, so uploading the same picture twice reuses
+the existing original and derivatives instead of writing new copies.
+Resizing runs in a process pool — Pillow work never blocks the event loop.
+Multipart uploads are streamed to a temp file in chunks and hashed on the fly,
+and base64 decoding / file writes run in worker threads.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import aiofiles
+import aiofiles.os
+
+from database import UPLOADS_DIR
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_URL_PREFIX = "/api/uploads/products/"
+
+# Longest edge in pixels for each derivative
+DERIVATIVE_SIZES = {"thumb": 160, "card": 480, "detail": 1200}
+DERIVATIVE_FORMATS = {"webp": ("WEBP", 80), "avif": ("AVIF", 60)}
+
+MIME_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+_IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class UploadTooLarge(Exception):
+    """Raised when a streamed upload exceeds its byte limit."""
+
+
+def content_digest(raw: bytes) -> str:
+    """Content-addressed file stem — same length as the legacy uuid4().hex names."""
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def _file_digest(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()[:32]
+
+
+def derivative_filename(digest: str, size: str, fmt: str) -> str:
+    return f"{digest}_{size}.{fmt}"
+
+
+def _supported_formats() -> list[str]:
+    from PIL import features
+    formats = ["webp"]
+    if features.check("avif"):
+        formats.append("avif")
+    return formats
+
+
+def _render_derivatives(src_path: str, digest: str, out_dir: str) -> dict:
+    """
+    Runs inside the process pool. Writes any missing derivatives for src_path and
+    returns {size: {fmt: filename}}. Existing files are left untouched (dedup).
+    """
+    from PIL import Image, ImageOps
+
+    out = Path(out_dir)
+    formats = _supported_formats()
+    result: dict = {}
+    with Image.open(src_path) as im:
+        im.seek(0)  # first frame for animated GIF / WebP
+        im = ImageOps.exif_transpose(im)
+        has_alpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        for size, edge in DERIVATIVE_SIZES.items():
+            result[size] = {}
+            resized = None
+            for fmt in formats:
+                name = derivative_filename(digest, size, fmt)
+                target = out / name
+                if not target.exists():
+                    if resized is None:
+                        resized = im.copy()
+                        resized.thumbnail((edge, edge), Image.LANCZOS)
+                    pil_format, quality = DERIVATIVE_FORMATS[fmt]
+                    tmp = target.with_suffix(target.suffix + ".tmp")
+                    resized.save(tmp, format=pil_format, quality=quality)
+                    os.replace(tmp, target)
+                result[size][fmt] = name
+    return result
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown_image_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _variant_urls(names: dict) -> dict:
+    return {
+        size: {fmt: f"{UPLOADS_URL_PREFIX}{name}" for fmt, name in fmts.items()}
+        for size, fmts in names.items()
+    }
+
+
+async def build_derivatives(src: Path, digest: str) -> Optional[dict]:
+    """Generate derivatives for a stored original. Returns variant URLs, or None if undecodable."""
+    loop = asyncio.get_running_loop()
+    try:
+        names = await loop.run_in_executor(_get_pool(), _render_derivatives, str(src), digest, str(UPLOADS_DIR))
+    except Exception as e:
+        logger.warning(f"[images] derivative generation failed for {src.name}: {e}")
+        return None
+    return _variant_urls(names)
+
+
+def _write_content_addressed(raw: bytes, ext: str, prefix: str) -> tuple[str, str]:
+    """Hash + write raw bytes (worker thread). Returns (digest, filename)."""
+    digest = content_digest(raw)
+    filename = f"{prefix}{digest}{ext}"
+    target = UPLOADS_DIR / filename
+    if not target.exists():
+        tmp = UPLOADS_DIR / f".{uuid.uuid4().hex}.tmp"
+        tmp.write_bytes(raw)
+        os.replace(tmp, target)
+    return digest, filename
+
+
+def decode_data_uri(b64: str) -> tuple[bytes, str]:
+    header, encoded = b64.split(",", 1)
+    mime = header.split(";")[0].split(":")[1]
+    return base64.b64decode(encoded), MIME_EXTENSIONS.get(mime, ".jpg")
+
+
+async def store_image_bytes(raw: bytes, ext: str, prefix: str = "") -> dict:
+    """
+    Persist an in-memory image under its content hash and build its derivatives.
+    Returns {"url": original URL, "variants": {size: {fmt: URL}} | None}.
+    """
+    digest, filename = await asyncio.to_thread(_write_content_addressed, raw, ext, prefix)
+    variants = await build_derivatives(UPLOADS_DIR / filename, digest)
+    return {"url": f"{UPLOADS_URL_PREFIX}{filename}", "variants": variants}
+
+
+async def store_data_uri(b64: str, prefix: str = "") -> dict:
+    """Decode a data-URI base64 image off the event loop and store it via store_image_bytes."""
+    raw, ext = await asyncio.to_thread(decode_data_uri, b64)
+    return await store_image_bytes(raw, ext, prefix)
+
+
+async def store_upload_stream(upload, ext: str, max_bytes: int) -> dict:
+    """
+    Stream an UploadFile to disk in UPLOAD_CHUNK_SIZE chunks, hashing as it goes.
+    Raises UploadTooLarge as soon as max_bytes is exceeded; the temp file is removed.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    tmp = UPLOADS_DIR / f".{uuid.uuid4().hex}.tmp"
+    try:
+        async with aiofiles.open(tmp, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                await out.write(chunk)
+        digest = hasher.hexdigest()[:32]
+        filename = f"{digest}{ext}"
+        target = UPLOADS_DIR / filename
+        if await aiofiles.os.path.exists(target):
+            await aiofiles.os.remove(tmp)
+        else:
+            await aiofiles.os.replace(tmp, target)
+    except BaseException:
+        if await aiofiles.os.path.exists(tmp):
+            await aiofiles.os.remove(tmp)
+        raise
+    variants = await build_derivatives(target, digest)
+    return {"url": f"{UPLOADS_URL_PREFIX}{filename}", "variants": variants}
+
+
+async def variants_for_image(image_url: Optional[str]) -> Optional[dict]:
+    """
+    Resolve derivative URLs for a product image URL. Only local uploads have
+    derivatives; legacy uuid-named files are hashed and processed on first use.
+    """
+    if not image_url or not image_url.startswith(UPLOADS_URL_PREFIX):
+        return None
+    src = UPLOADS_DIR / image_url[len(UPLOADS_URL_PREFIX):]
+    if src.parent != UPLOADS_DIR or not src.is_file():
+        return None
+    digest = await asyncio.to_thread(_file_digest, src)
+    return await build_derivatives(src, digest)
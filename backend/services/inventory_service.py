@@ -0,0 +1,349 @@
+"""
+Inventory reservation ledger.
+
+Pending-payment orders hold stock through a `stock_reservations` document
+instead of decrementing products.stock:
+
+    {_id: orderId, userId, items: [{productId, quantity}], status,
+     expiresAt, createdAt, releasedAt, purgeAt}
+
+status moves active → committed (payment confirmed, on-hand stock taken) or
+active → released (cancelled) / expired. Each product keeps `reserved`, the
+sum of its active reservations, so available stock is `stock - reserved`
+without scanning the ledger. Every ledger transition is a conditional update,
+so the counter moves at most once per reservation.
+
+Orders record how their stock is held in `inventoryState`:
+reserved | committed | released. Orders without the field predate the
+ledger and had stock decremented at checkout, so they count as committed.
+
+release_expired_reservations() runs as a scheduler job every few seconds and
+returns expired holds to sale. Finished ledger docs are purged by a
+TTL index on purgeAt.
+"""
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import UpdateOne
+
+from database import db
+from services.transactions import run_in_transaction, transactions_supported
+
+logger = logging.getLogger(__name__)
+
+RELEASE_INTERVAL_SECONDS = 5
+LEDGER_RETENTION = timedelta(days=7)
+RELEASE_CLAIM_STALE = timedelta(minutes=2)
+RELEASE_TXN_BATCH = 500
+
+
+def quantities_by_product(lines: list[dict]) -> dict:
+    """Collapse duplicate cart lines so each product gets one stock update."""
+    qty: dict = {}
+    for line in lines:
+        qty[line["productId"]] = qty.get(line["productId"], 0) + line["quantity"]
+    return qty
+
+
+def _available_at_least(q: int) -> dict:
+    return {"$expr": {"$gte": [{"$subtract": ["$stock", {"$ifNull": ["$reserved", 0]}]}, q]}}
+
+
+def available_stock(product: dict) -> int:
+    """On-hand stock minus active reservations."""
+    return max(0, int(product.get("stock") or 0) - int(product.get("reserved") or 0))
+
+
+def in_stock_filter() -> dict:
+    """Products query fragment matching items with anything left to sell."""
+    return {"$expr": {"$gt": [{"$subtract": ["$stock", {"$ifNull": ["$reserved", 0]}]}, 0]}}
+
+
+async def _inc_products(qty: dict, field: str, sign: int, session=None) -> None:
+    """Unconditional bulk $inc of field by sign * qty for every product."""
+    if not qty:
+        return
+    await db.products.bulk_write(
+        [UpdateOne({"_id": ObjectId(pid)}, {"$inc": {field: sign * q}}) for pid, q in qty.items()],
+        ordered=False,
+        session=session,
+    )
+
+
+async def _out_of_stock_name(lines: list[dict], qty: dict, session=None) -> str:
+    products = await db.products.find(
+        {"_id": {"$in": [ObjectId(pid) for pid in qty]}}, {"stock": 1, "reserved": 1}, session=session
+    ).to_list(len(qty))
+    available = {str(p["_id"]): available_stock(p) for p in products}
+    for line in lines:
+        if available.get(line["productId"], 0) < qty[line["productId"]]:
+            return line["name"]
+    return lines[0]["name"]
+
+
+async def _take_available(lines: list[dict], field: str, sign: int, session=None) -> None:
+    """
+    Apply $inc field: sign*q to every product whose available stock covers q,
+    or raise 409 and change nothing. With a session the bulk runs inside the
+    caller's transaction (the 409 aborts it); without one the lines are applied
+    one by one and rolled back by hand on the first short line.
+    """
+    qty = quantities_by_product(lines)
+
+    if session is not None:
+        ops = [
+            UpdateOne({"_id": ObjectId(pid), **_available_at_least(q)}, {"$inc": {field: sign * q}})
+            for pid, q in qty.items()
+        ]
+        result = await db.products.bulk_write(ops, ordered=False, session=session)
+        if result.modified_count < len(ops):
+            name = await _out_of_stock_name(lines, qty, session)
+            raise HTTPException(status_code=409, detail=f"Out of stock: {name}")
+        return
+
+    applied: dict = {}
+    for pid, q in qty.items():
+        res = await db.products.update_one(
+            {"_id": ObjectId(pid), **_available_at_least(q)}, {"$inc": {field: sign * q}}
+        )
+        if res.modified_count == 0:
+            await _inc_products(applied, field, -sign)
+            name = next(line["name"] for line in lines if line["productId"] == pid)
+            raise HTTPException(status_code=409, detail=f"Out of stock: {name}")
+        applied[pid] = q
+
+
+# ==================== CHECKOUT ====================
+
+async def hold_stock(order_id: ObjectId, user_id: str, lines: list[dict], expires_at: datetime, session=None) -> None:
+    """Reserve stock for a pending-payment order until expires_at (409 if short)."""
+    await _take_available(lines, "reserved", +1, session)
+    try:
+        await db.stock_reservations.insert_one({
+            "_id": order_id,
+            "userId": user_id,
+            "items": [{"productId": pid, "quantity": q} for pid, q in quantities_by_product(lines).items()],
+            "status": "active",
+            "expiresAt": expires_at,
+            "createdAt": datetime.utcnow(),
+        }, session=session)
+    except Exception:
+        if session is None:
+            await _inc_products(quantities_by_product(lines), "reserved", -1)
+        raise
+
+
+async def take_stock(lines: list[dict], session=None) -> None:
+    """Decrement on-hand stock straight away (pay-at-pickup orders; 409 if short)."""
+    await _take_available(lines, "stock", -1, session)
+
+
+async def undo_checkout_stock(order_id: ObjectId, lines: list[dict], held: bool) -> None:
+    """Compensation for a failed non-transactional checkout."""
+    if held:
+        await _release_reservation(order_id, "released")
+    else:
+        await _inc_products(quantities_by_product(lines), "stock", +1)
+
+
+# ==================== ORDER LIFECYCLE ====================
+
+async def _release_reservation(order_id: ObjectId, status: str) -> bool:
+    now = datetime.utcnow()
+    reservation = await db.stock_reservations.find_one_and_update(
+        {"_id": order_id, "status": "active"},
+        {"$set": {"status": status, "releasedAt": now, "purgeAt": now + LEDGER_RETENTION}},
+    )
+    if not reservation:
+        return False
+    await _inc_products(quantities_by_product(reservation["items"]), "reserved", -1)
+    return True
+
+
+async def release_order_stock(order: dict) -> bool:
+    """
+    Return a cancelled / deleted order's stock to sale. Reserved orders drop
+    their reservation; committed (and legacy) orders put on-hand stock back.
+    Returns True if anything was returned.
+    """
+    state = order.get("inventoryState", "committed")
+    if state == "released":
+        return False
+    claimed = await db.orders.update_one(
+        {"_id": order["_id"], "inventoryState": {"$ne": "released"}},
+        {"$set": {"inventoryState": "released"}},
+    )
+    if claimed.modified_count == 0:
+        return False
+    if state == "reserved":
+        return await _release_reservation(order["_id"], "released")
+    await _inc_products(quantities_by_product(order.get("items", [])), "stock", +1)
+    return True
+
+
+async def commit_order_stock(order: dict) -> None:
+    """
+    Payment confirmed: turn a reservation into an on-hand decrement. If the
+    hold already lapsed the admin's confirmation wins and stock is taken anyway.
+    """
+    if order.get("inventoryState") != "reserved":
+        return
+    claimed = await db.orders.update_one(
+        {"_id": order["_id"], "inventoryState": "reserved"},
+        {"$set": {"inventoryState": "committed"}},
+    )
+    if claimed.modified_count == 0:
+        return
+    now = datetime.utcnow()
+    reservation = await db.stock_reservations.find_one_and_update(
+        {"_id": order["_id"], "status": "active"},
+        {"$set": {"status": "committed", "releasedAt": now, "purgeAt": now + LEDGER_RETENTION}},
+    )
+    qty = quantities_by_product(order.get("items", []))
+    if reservation:
+        await db.products.bulk_write(
+            [UpdateOne({"_id": ObjectId(pid)}, {"$inc": {"stock": -q, "reserved": -q}}) for pid, q in qty.items()],
+            ordered=False,
+        )
+    else:
+        await _inc_products(qty, "stock", -1)
+
+
+async def replace_order_items_stock(order: dict, new_items: list[dict]) -> None:
+    """Admin order edit: move the order's hold (or on-hand decrement) to the new items."""
+    state = order.get("inventoryState", "committed")
+    if state == "released":
+        return
+    old_qty = quantities_by_product(order.get("items", []))
+    new_qty = quantities_by_product(new_items)
+    delta = {
+        pid: new_qty.get(pid, 0) - old_qty.get(pid, 0)
+        for pid in set(old_qty) | set(new_qty)
+        if new_qty.get(pid, 0) != old_qty.get(pid, 0)
+    }
+    if state == "reserved":
+        updated = await db.stock_reservations.update_one(
+            {"_id": order["_id"], "status": "active"},
+            {"$set": {"items": [{"productId": pid, "quantity": q} for pid, q in new_qty.items()]}},
+        )
+        if updated.modified_count:
+            await _inc_products(delta, "reserved", +1)
+        return
+    await _inc_products(delta, "stock", -1)
+
+
+# ==================== EXPIRY WORKER ====================
+
+def _expire_update(now: datetime) -> dict:
+    return {"$set": {"status": "expired", "releasedAt": now, "purgeAt": now + LEDGER_RETENTION},
+            "$unset": {"releaseRun": "", "releaseClaimedAt": ""}}
+
+
+async def _expire_claimed_batch(ids: list, run_id: str, now: datetime) -> list:
+    """
+    In one transaction: flip every reservation in ids still claimed by this
+    run from releasing to expired with one update_many, and give their summed
+    quantities back to products.reserved with one bulk_write. Returns the ids
+    flipped.
+    """
+    async def _flip_and_return(session):
+        fence = {"_id": {"$in": ids}, "status": "releasing", "releaseRun": run_id}
+        mine = await db.stock_reservations.find(fence, {"items": 1}, session=session).to_list(None)
+        if not mine:
+            return []
+        # Same snapshot as the find, so this flips exactly `mine`
+        await db.stock_reservations.update_many(fence, _expire_update(now), session=session)
+        qty = quantities_by_product([item for r in mine for item in r["items"]])
+        await _inc_products(qty, "reserved", -1, session=session)
+        return [r["_id"] for r in mine]
+
+    return await run_in_transaction(_flip_and_return)
+
+
+async def _expire_claimed(reservation: dict, run_id: str, now: datetime) -> bool:
+    """
+    No-transaction fallback: flip one claimed reservation from releasing to
+    expired and give its quantities back to products.reserved, only if the
+    flip happened. The flip goes first, so a crash in between leaves
+    `reserved` high (fixable by a recount) rather than decrementing twice.
+    """
+    qty = quantities_by_product(reservation["items"])
+
+    async def _flip_and_return(session):
+        flipped = await db.stock_reservations.update_one(
+            {"_id": reservation["_id"], "status": "releasing", "releaseRun": run_id},
+            _expire_update(now),
+            session=session,
+        )
+        if flipped.modified_count != 1:
+            return False
+        await _inc_products(qty, "reserved", -1, session=session)
+        return True
+
+    return await run_in_transaction(_flip_and_return)
+
+
+async def release_expired_reservations() -> dict:
+    """
+    Expire every lapsed active reservation: claim them with one update_many
+    tagged with this run's id, expire the claimed reservations and return
+    their stock, and flip the still-pending orders to Expired with one
+    update_many.
+
+    With transactions the claimed reservations are expired in bulk, up to
+    RELEASE_TXN_BATCH per transaction (_expire_claimed_batch); without them
+    each one gets its own conditional flip (_expire_claimed). Claims left
+    behind by a crashed run are taken over once they are older than
+    RELEASE_CLAIM_STALE; since the decrement is tied to the releasing →
+    expired flip of this run's claim, a reservation is never returned twice
+    even if two runs overlap.
+    """
+    now = datetime.utcnow()
+    run_id = uuid.uuid4().hex
+    await db.stock_reservations.update_many(
+        {"status": "active", "expiresAt": {"$lt": now}},
+        {"$set": {"status": "releasing", "releaseRun": run_id, "releaseClaimedAt": now}},
+    )
+    # Take over claims a crashed run never finished
+    await db.stock_reservations.update_many(
+        {"status": "releasing", "releaseRun": {"$ne": run_id},
+         "$or": [{"releaseClaimedAt": {"$lt": now - RELEASE_CLAIM_STALE}}, {"releaseClaimedAt": None}]},
+        {"$set": {"releaseRun": run_id, "releaseClaimedAt": now}},
+    )
+    claimed = await db.stock_reservations.find(
+        {"status": "releasing", "releaseRun": run_id}, {"items": 1}
+    ).to_list(None)
+    if not claimed:
+        return {"released": 0, "ordersExpired": 0}
+
+    if await transactions_supported():
+        ids = []
+        for i in range(0, len(claimed), RELEASE_TXN_BATCH):
+            batch = [r["_id"] for r in claimed[i:i + RELEASE_TXN_BATCH]]
+            ids += await _expire_claimed_batch(batch, run_id, now)
+    else:
+        ids = [r["_id"] for r in claimed if await _expire_claimed(r, run_id, now)]
+    if not ids:
+        return {"released": 0, "ordersExpired": 0}
+    expired = await db.orders.update_many(
+        {"_id": {"$in": ids}, "status": "Pending Payment", "inventoryState": "reserved"},
+        {"$set": {"status": "Expired", "inventoryState": "released"}},
+    )
+    # Orders that moved on while their hold lapsed keep their status; only the hold is gone
+    await db.orders.update_many(
+        {"_id": {"$in": ids}, "inventoryState": "reserved"},
+        {"$set": {"inventoryState": "released"}},
+    )
+    logger.info(f"Reservation expiry: released {len(ids)} hold(s), expired {expired.modified_count} order(s)")
+    return {"released": len(ids), "ordersExpired": expired.modified_count}
+
+
+async def ensure_inventory_indexes() -> None:
+    try:
+        await db.stock_reservations.create_index([("status", 1), ("expiresAt", 1)])
+        await db.stock_reservations.create_index("purgeAt", expireAfterSeconds=0)
+    except Exception as e:
+        logger.warning(f"[inventory] index creation warning (non-fatal): {e}")
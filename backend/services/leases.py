@@ -0,0 +1,48 @@
+"""
+Mongo-backed leases so only one worker process runs a given background job.
+
+A lease is a `job_leases` document {_id: name, owner, expiresAt}. A worker
+holds it while expiresAt is in the future and renews it by acquiring again.
+A crashed owner simply stops renewing and the lease becomes free at expiry.
+"""
+import os
+import socket
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire_lease(name: str, ttl_seconds: float) -> bool:
+    """Take or renew the named lease for this worker. Returns False if another worker holds it."""
+    now = datetime.utcnow()
+    try:
+        doc = await db.job_leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": WORKER_ID}, {"expiresAt": {"$lt": now}}]},
+            {
+                "$set": {"owner": WORKER_ID, "expiresAt": now + timedelta(seconds=ttl_seconds), "renewedAt": now},
+                "$setOnInsert": {"createdAt": now},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Lease document exists and is held by a live owner
+        return False
+    return doc is not None and doc.get("owner") == WORKER_ID
+
+
+async def release_lease(name: str) -> None:
+    """Give the lease up early (only if this worker still owns it)."""
+    await db.job_leases.update_one(
+        {"_id": name, "owner": WORKER_ID},
+        {"$set": {"expiresAt": datetime.utcnow()}},
+    )
+
+
+async def get_lease(name: str) -> dict | None:
+    return await db.job_leases.find_one({"_id": name})
@@ -0,0 +1,291 @@
+"""
+Transactional notification outbox.
+
+Anything that notifies a customer (Expo push, browser web push, order
+emails) is written to `notification_outbox` next to the change that
+triggered it — inside the checkout transaction, or from an idempotent order
+event — instead of being fired with asyncio.create_task. Nothing is lost if
+the worker restarts mid-send.
+
+    {_id, userId, channel: push | web_push | email, payload, dedupeKey,
+     status: pending | sending | sent | failed, attempts, nextAttemptAt,
+     lockedUntil, claimedBy, lastError, createdAt, sentAt, purgeAt}
+
+The `notification_outbox` scheduler job claims a batch of due messages,
+coalesces each user's pushes per channel into a single notification (a burst
+of status updates after a bulk change becomes one "… (+N more)" push),
+delivers with bounded concurrency and retries failures with exponential
+backoff. Emails are never coalesced: each is delivered and recorded on its
+own, so one failure doesn't resend its neighbours, and a permanent SMTP
+failure (5xx, refused recipient) is not retried. Messages that keep failing
+end up `failed`. Delivered and failed documents are purged by a TTL index on
+purgeAt.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_INTERVAL_SECONDS = 2
+DISPATCH_BATCH = 200
+DISPATCH_CONCURRENCY = 10
+CLAIM_SECONDS = 120
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 1800
+RETENTION = timedelta(days=3)
+
+outbox_stats: dict = {
+    "batches": 0,
+    "claimed": 0,
+    "sent": 0,
+    "coalesced": 0,
+    "retried": 0,
+    "failed": 0,
+    "lastBatchAt": None,
+    "lastBatchMs": None,
+    "lastError": None,
+}
+
+
+class TransientDeliveryError(Exception):
+    """Delivery failed in a way worth retrying (network error, 5xx, rate limit)."""
+
+
+def _new_message(user_id: str, channel: str, payload: dict, dedupe_key: Optional[str], now: datetime) -> dict:
+    doc = {
+        "_id": uuid.uuid4().hex,
+        "userId": user_id,
+        "channel": channel,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "nextAttemptAt": now,
+        "createdAt": now,
+    }
+    if dedupe_key:
+        doc["dedupeKey"] = dedupe_key
+    return doc
+
+
+async def enqueue_notification(user_id: str, channel: str, payload: dict,
+                               dedupe_key: Optional[str] = None, session=None) -> bool:
+    """
+    Queue one notification. Pass the caller's session to write it in the same
+    transaction as the triggering change. dedupe_key makes the enqueue
+    idempotent (a retried order event doesn't notify twice); returns False
+    when the key was already queued.
+    """
+    try:
+        await db.notification_outbox.insert_one(
+            _new_message(user_id, channel, payload, dedupe_key, datetime.utcnow()), session=session
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def enqueue_notifications(messages: list[dict]) -> int:
+    """Bulk enqueue [{userId, channel, payload, dedupeKey?}]. Returns how many were new."""
+    if not messages:
+        return 0
+    now = datetime.utcnow()
+    docs = [_new_message(m["userId"], m["channel"], m["payload"], m.get("dedupeKey"), now) for m in messages]
+    try:
+        result = await db.notification_outbox.insert_many(docs, ordered=False)
+        return len(result.inserted_ids)
+    except Exception as e:
+        # BulkWriteError: duplicates were skipped, the rest went in
+        details = getattr(e, "details", None)
+        if details is None:
+            raise
+        return details.get("nInserted", 0)
+
+
+# ==================== DELIVERY ====================
+
+def _coalesce(payloads: list[dict]) -> dict:
+    """Newest message wins; older ones are summarised as a count."""
+    latest = dict(payloads[-1])
+    if len(payloads) > 1:
+        latest["body"] = f"{latest.get('body', '')} (+{len(payloads) - 1} more)"
+    return latest
+
+
+async def _deliver_push(user_id: str, payloads: list[dict]) -> None:
+    from services.expo_push import ExpoRequestError, expo_batcher
+    payload = _coalesce(payloads)
+    tokens = await db.push_tokens.find({"userId": user_id}, {"_id": 0, "token": 1}).to_list(10)
+    messages = [
+        {"to": t["token"], "sound": "default", "title": payload.get("title"), "body": payload.get("body")}
+        for t in tokens if t.get("token", "").startswith("ExponentPushToken")
+    ]
+    if not messages:
+        return
+    try:
+        tickets = await expo_batcher.send(messages)
+    except ExpoRequestError as e:
+        if e.transient:
+            raise TransientDeliveryError(str(e))
+        raise
+    if all(t.get("status") != "ok" for t in tickets):
+        errors = {(t.get("details") or {}).get("error") for t in tickets}
+        if "MessageRateExceeded" in errors:
+            raise TransientDeliveryError("Expo rate limited this device")
+
+
+async def _deliver_web_push(user_id: str, payloads: list[dict]) -> None:
+    from services.web_push_service import deliver_web_push
+    await deliver_web_push(user_id, _coalesce(payloads))
+
+
+async def _deliver_email(user_id: str, payloads: list[dict]) -> None:
+    from services.email_service import EmailDeliveryError, deliver_email_async, is_email_configured
+    if not is_email_configured():
+        return
+    # The dispatcher groups emails one per message (see _group_key)
+    for payload in payloads:
+        try:
+            await deliver_email_async(payload["to"], payload["subject"], payload["html"])
+        except EmailDeliveryError as e:
+            if e.transient:
+                raise TransientDeliveryError(str(e))
+            raise
+
+
+DELIVERERS = {
+    "push": _deliver_push,
+    "web_push": _deliver_web_push,
+    "email": _deliver_email,
+}
+
+
+# ==================== DISPATCHER ====================
+
+def _group_key(msg: dict) -> tuple:
+    """Messages delivered together: a user's pushes per channel, but each email alone."""
+    return msg["userId"], msg["channel"], msg["_id"] if msg["channel"] == "email" else None
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1)))
+
+
+async def _claim_batch(run_id: str, now: datetime) -> list[dict]:
+    due = await db.notification_outbox.find(
+        {"$or": [
+            {"status": "pending", "nextAttemptAt": {"$lte": now}},
+            {"status": "sending", "lockedUntil": {"$lt": now}},   # claimed by a worker that died
+        ]},
+        {"_id": 1},
+    ).sort("nextAttemptAt", 1).limit(DISPATCH_BATCH).to_list(DISPATCH_BATCH)
+    if not due:
+        return []
+    await db.notification_outbox.update_many(
+        {"_id": {"$in": [d["_id"] for d in due]},
+         "$or": [{"status": "pending"}, {"status": "sending", "lockedUntil": {"$lt": now}}]},
+        {"$set": {"status": "sending", "claimedBy": run_id, "lockedUntil": now + timedelta(seconds=CLAIM_SECONDS)}},
+    )
+    return await db.notification_outbox.find({"claimedBy": run_id, "status": "sending"}).to_list(DISPATCH_BATCH)
+
+
+async def dispatch_notification_outbox() -> dict:
+    """Scheduler job: deliver one claimed batch of due notifications."""
+    started = time.monotonic()
+    now = datetime.utcnow()
+    run_id = uuid.uuid4().hex
+    claimed = await _claim_batch(run_id, now)
+    if not claimed:
+        return {"claimed": 0}
+
+    groups: dict[tuple, list[dict]] = {}
+    for msg in sorted(claimed, key=lambda m: m["createdAt"]):
+        groups.setdefault(_group_key(msg), []).append(msg)
+
+    sem = asyncio.Semaphore(DISPATCH_CONCURRENCY)
+    sent_ids: list = []
+    retry: list[tuple[dict, str]] = []
+    dead: list[tuple[dict, str]] = []
+
+    async def _send(user_id: str, channel: str, msgs: list[dict]) -> None:
+        deliver = DELIVERERS.get(channel)
+        async with sem:
+            try:
+                if deliver is None:
+                    raise ValueError(f"Unknown channel '{channel}'")
+                await deliver(user_id, [m["payload"] for m in msgs])
+                sent_ids.extend(m["_id"] for m in msgs)
+            except TransientDeliveryError as e:
+                for m in msgs:
+                    (retry if m.get("attempts", 0) + 1 < MAX_ATTEMPTS else dead).append((m, str(e)))
+            except Exception as e:
+                dead.extend((m, f"{type(e).__name__}: {e}") for m in msgs)
+
+    await asyncio.gather(*(_send(uid, channel, msgs) for (uid, channel, _), msgs in groups.items()))
+
+    done_at = datetime.utcnow()
+    if sent_ids:
+        await db.notification_outbox.update_many(
+            {"_id": {"$in": sent_ids}},
+            {"$set": {"status": "sent", "sentAt": done_at, "purgeAt": done_at + RETENTION},
+             "$inc": {"attempts": 1}, "$unset": {"lockedUntil": "", "claimedBy": ""}},
+        )
+    for msg, error in retry:
+        attempts = msg.get("attempts", 0) + 1
+        await db.notification_outbox.update_one(
+            {"_id": msg["_id"]},
+            {"$set": {"status": "pending", "attempts": attempts, "lastError": error,
+                      "nextAttemptAt": done_at + _backoff(attempts)},
+             "$unset": {"lockedUntil": "", "claimedBy": ""}},
+        )
+    for msg, error in dead:
+        logger.error(f"[outbox] giving up on {msg['channel']} for {msg['userId']}: {error}")
+        await db.notification_outbox.update_one(
+            {"_id": msg["_id"]},
+            {"$set": {"status": "failed", "purgeAt": done_at + RETENTION, "lastError": error},
+             "$inc": {"attempts": 1}, "$unset": {"lockedUntil": "", "claimedBy": ""}},
+        )
+
+    outbox_stats["batches"] += 1
+    outbox_stats["claimed"] += len(claimed)
+    outbox_stats["sent"] += len(sent_ids)
+    outbox_stats["coalesced"] += sum(len(msgs) - 1 for msgs in groups.values())
+    outbox_stats["retried"] += len(retry)
+    outbox_stats["failed"] += len(dead)
+    outbox_stats["lastBatchAt"] = done_at
+    outbox_stats["lastBatchMs"] = round((time.monotonic() - started) * 1000, 1)
+    outbox_stats["lastError"] = (retry or dead)[-1][1] if (retry or dead) else None
+    return {"claimed": len(claimed), "sent": len(sent_ids), "retried": len(retry), "failed": len(dead)}
+
+
+async def get_outbox_stats() -> dict:
+    """This process's dispatch counters plus the queue's current shape."""
+    by_status = {
+        row["_id"]: row["count"]
+        for row in await db.notification_outbox.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)
+    }
+    oldest = await db.notification_outbox.find_one(
+        {"status": "pending"}, {"createdAt": 1}, sort=[("createdAt", 1)]
+    )
+    oldest_age = (datetime.utcnow() - oldest["createdAt"]).total_seconds() if oldest else 0
+    return {**outbox_stats, "queue": by_status, "oldestPendingSeconds": round(oldest_age, 1)}
+
+
+async def ensure_outbox_indexes() -> None:
+    try:
+        await db.notification_outbox.create_index([("status", 1), ("nextAttemptAt", 1)])
+        await db.notification_outbox.create_index("claimedBy", sparse=True)
+        await db.notification_outbox.create_index("dedupeKey", unique=True, sparse=True)
+        await db.notification_outbox.create_index("purgeAt", expireAfterSeconds=0)
+    except Exception as e:
+        logger.warning(f"[outbox] index creation warning (non-fatal): {e}")
@@ -0,0 +1,406 @@
+"""
+Order status state machine.
+
+A status change is one conditional write: find_one_and_update on the order,
+filtered on the statuses allowed to move to the new one, that sets the
+status and appends the change's side effects to the order's `pendingEvents`
+outbox in the same document update. The admin's click returns as soon as
+that write lands.
+
+Side effects (stock commit/release, store-credit refund, completion coupon,
+loyalty + referral rewards, push notifications) are handled by
+dispatch_order_events(): kicked off in-process right after the write (or
+awaited before responding, for a customer's own cancel, so the released
+stock is visible on their next read), and swept by the `order_events`
+scheduler job for anything a crashed worker left behind. A dispatcher claims an order's events with a short lock, runs them in
+order and pulls each one once it succeeds. Every handler is idempotent
+(rewards and refunds are guarded by flags on the order), so an event retried
+after a crash never pays out twice. A failing event counts its attempts and
+holds the order's events back with exponential backoff; after
+MAX_EVENT_ATTEMPTS it is parked in the order's `failedEvents` (listed by
+GET /admin/jobs) and the events behind it go ahead.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from database import db
+from services.inventory_service import commit_order_stock, release_order_stock
+from services.order_service import handle_order_completed, send_push_notification
+from services.scheduler import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# status → statuses it may move to
+ORDER_TRANSITIONS = {
+    "Pending Payment":        {"Paid", "Ready for Pickup", "Completed", "Cancelled", "Expired"},
+    "Awaiting Pickup (Cash)": {"Paid", "Ready for Pickup", "Completed", "Cancelled"},
+    "Paid":                   {"Ready for Pickup", "Completed", "Cancelled"},
+    "Ready for Pickup":       {"Paid", "Completed", "Cancelled"},
+    "Completed":              set(),
+    "Cancelled":              set(),
+    "Expired":                set(),
+}
+
+# Side effects emitted when an order enters a status, run in this order
+STATUS_EFFECTS = {
+    "Paid":             ["commit_stock", "notify"],
+    "Ready for Pickup": ["commit_stock", "notify", "web_push_ready"],
+    "Completed":        ["commit_stock", "completion_coupon", "rewards", "notify"],
+    "Cancelled":        ["release_stock", "restore_credit", "notify"],
+    "Expired":          ["release_stock"],
+}
+
+EVENT_LOCK_SECONDS = 60
+MAX_EVENT_ATTEMPTS = 8
+EVENT_BACKOFF_MAX_SECONDS = 3600
+EVENT_SWEEP_INTERVAL_SECONDS = 10
+EVENT_SWEEP_BATCH = 100
+MAX_BULK_ORDERS = 200
+BULK_DISPATCH_CONCURRENCY = 8
+
+
+def allowed_from(new_status: str) -> list[str]:
+    return [old for old, targets in ORDER_TRANSITIONS.items() if new_status in targets]
+
+
+async def transition_order_status(order_id: str, new_status: str, source: str = "unknown",
+                                  expected_from: list[str] | None = None,
+                                  dispatch_inline: bool = False) -> dict:
+    """
+    Move an order to new_status if the state machine allows it.
+    expected_from narrows the allowed predecessors (e.g. customers may only
+    cancel Pending Payment orders). Re-sending the current status is a no-op.
+    dispatch_inline runs the queued events before returning instead of in the
+    background; anything that fails is left for the sweep as usual.
+    """
+    if new_status not in ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown order status '{new_status}'")
+    try:
+        oid = ObjectId(order_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid order ID")
+
+    predecessors = allowed_from(new_status)
+    if expected_from is not None:
+        predecessors = [s for s in predecessors if s in expected_from]
+    now = datetime.utcnow()
+    events = [
+        {"id": uuid.uuid4().hex, "type": effect, "status": new_status, "createdAt": now}
+        for effect in STATUS_EFFECTS.get(new_status, [])
+    ]
+    update: dict = {
+        "$set": {"status": new_status, "statusUpdatedAt": now},
+        "$push": {"statusHistory": {"status": new_status, "source": source, "at": now}},
+    }
+    if events:
+        update["$set"]["hasPendingEvents"] = True
+        update["$push"]["pendingEvents"] = {"$each": events}
+
+    before = await db.orders.find_one_and_update(
+        {"_id": oid, "status": {"$in": predecessors}},
+        update,
+        projection={"status": 1},
+    )
+    if before is None:
+        current = await db.orders.find_one({"_id": oid}, {"status": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if current.get("status") == new_status:
+            return {"message": "Order status unchanged", "status": new_status}
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot change order status from '{current.get('status')}' to '{new_status}'",
+        )
+
+    old_status = before.get("status")
+    print(f"STATUS UPDATE SOURCE: {source}")
+    print(f"ORDER STATUS CHANGE: {old_status} → {new_status} ({len(events)} event(s) queued)")
+
+    if events and dispatch_inline:
+        try:
+            await dispatch_order_events(oid)
+        except Exception as e:
+            logger.error(f"[orders] inline dispatch failed for {oid}: {e}")
+    elif events:
+        run_in_background(dispatch_order_events(oid), f"order events for {oid}")
+    return {"message": "Order status updated", "previousStatus": old_status, "status": new_status}
+
+
+async def bulk_transition_order_status(order_ids: list[str], new_status: str, source: str = "unknown") -> dict:
+    """
+    Move many orders to new_status: one read validates every transition, one
+    update_many applies them, and one background pass runs the queued events.
+    Returns a per-order result list in the order the ids were given.
+    """
+    if new_status not in ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown order status '{new_status}'")
+    if len(order_ids) > MAX_BULK_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ORDERS} orders per request")
+
+    results: dict[str, dict] = {}
+    oids: dict[str, ObjectId] = {}
+    for order_id in dict.fromkeys(order_ids):
+        try:
+            oids[order_id] = ObjectId(order_id)
+        except Exception:
+            results[order_id] = {"orderId": order_id, "ok": False, "error": "Invalid order ID"}
+
+    predecessors = set(allowed_from(new_status))
+    current = {
+        str(o["_id"]): o.get("status")
+        for o in await db.orders.find({"_id": {"$in": list(oids.values())}}, {"status": 1}).to_list(len(oids))
+    }
+    eligible: list[ObjectId] = []
+    for order_id, oid in oids.items():
+        status = current.get(order_id)
+        if status is None:
+            results[order_id] = {"orderId": order_id, "ok": False, "error": "Order not found"}
+        elif status == new_status:
+            results[order_id] = {"orderId": order_id, "ok": True, "previousStatus": status, "unchanged": True}
+        elif status not in predecessors:
+            results[order_id] = {"orderId": order_id, "ok": False, "previousStatus": status,
+                                 "error": f"Cannot change order status from '{status}' to '{new_status}'"}
+        else:
+            eligible.append(oid)
+
+    updated: list[ObjectId] = []
+    if eligible:
+        now = datetime.utcnow()
+        batch_id = uuid.uuid4().hex
+        # Event ids only need to be unique within an order, so every order in the batch shares them
+        events = [
+            {"id": uuid.uuid4().hex, "type": effect, "status": new_status, "createdAt": now}
+            for effect in STATUS_EFFECTS.get(new_status, [])
+        ]
+        update: dict = {
+            "$set": {"status": new_status, "statusUpdatedAt": now, "statusBatch": batch_id},
+            "$push": {"statusHistory": {"status": new_status, "source": source, "at": now}},
+        }
+        if events:
+            update["$set"]["hasPendingEvents"] = True
+            update["$push"]["pendingEvents"] = {"$each": events}
+        await db.orders.update_many({"_id": {"$in": eligible}, "status": {"$in": list(predecessors)}}, update)
+        # An order can move between the read and the write; the batch marker says which ones we changed
+        updated = [o["_id"] for o in await db.orders.find(
+            {"_id": {"$in": eligible}, "statusBatch": batch_id}, {"_id": 1}
+        ).to_list(len(eligible))]
+        changed = set(updated)
+        for oid in eligible:
+            order_id = str(oid)
+            if oid in changed:
+                results[order_id] = {"orderId": order_id, "ok": True, "previousStatus": current[order_id]}
+            else:
+                results[order_id] = {"orderId": order_id, "ok": False, "previousStatus": current[order_id],
+                                     "error": "Order changed concurrently; retry"}
+        if events and updated:
+            run_in_background(dispatch_order_events_batch(updated), f"order events for {len(updated)} orders")
+
+    print(f"STATUS UPDATE SOURCE: {source}")
+    print(f"BULK ORDER STATUS CHANGE → {new_status}: {len(updated)}/{len(order_ids)} updated")
+    return {
+        "status": new_status,
+        "updated": len(updated),
+        "results": [results[order_id] for order_id in dict.fromkeys(order_ids)],
+    }
+
+
+# ==================== EVENT HANDLERS ====================
+
+def _short_id(order: dict) -> str:
+    return str(order["_id"])[-6:].upper()
+
+
+async def _handle_commit_stock(order: dict, event: dict) -> None:
+    await commit_order_stock(order)
+
+
+async def _handle_release_stock(order: dict, event: dict) -> None:
+    await release_order_stock(order)
+
+
+async def _handle_restore_credit(order: dict, event: dict) -> None:
+    amount = float(order.get("storeCreditApplied") or 0)
+    if amount <= 0:
+        return
+    claimed = await db.orders.update_one(
+        {"_id": order["_id"], "storeCreditRestored": {"$ne": True}},
+        {"$set": {"storeCreditRestored": True}},
+    )
+    if claimed.modified_count:
+        await db.users.update_one({"_id": ObjectId(order["userId"])}, {"$inc": {"creditBalance": amount}})
+
+
+async def _handle_completion_coupon(order: dict, event: dict) -> None:
+    """$5 next-order coupon, issued once per completed order."""
+    order_id = str(order["_id"])
+    now = datetime.utcnow()
+    await db.users.update_one(
+        {"_id": ObjectId(order["userId"]), "nextOrderCoupon.orderId": {"$ne": order_id}},
+        {"$set": {"nextOrderCoupon": {
+            "amount": 5.00,
+            "expiresAt": (now + timedelta(days=7)).isoformat(),
+            "orderId": order_id,
+            "used": False,
+            "issuedAt": now.isoformat(),
+        }}}
+    )
+
+
+async def _handle_rewards(order: dict, event: dict) -> None:
+    # Idempotency handled inside handle_order_completed (order reward flags)
+    await handle_order_completed(order)
+
+
+async def _handle_notify(order: dict, event: dict) -> None:
+    if event["status"] == "Cancelled":
+        title, body = "Order Cancelled", f"Order #{_short_id(order)} has been cancelled."
+    else:
+        title, body = "Order Update", f"Order #{_short_id(order)} is now: {event['status']}"
+    await send_push_notification(order["userId"], title, body, dedupe_key=f"{order['_id']}:{event['id']}")
+
+
+async def _handle_web_push_ready(order: dict, event: dict) -> None:
+    from services.web_push_service import send_web_push
+    await send_web_push(order["userId"], {
+        "title": "Order ready for pickup",
+        "body":  f"Order #{_short_id(order)} is ready. Come grab it!",
+        "icon":  "/android-chrome-192x192.png",
+        "url":   "/orders",
+    }, dedupe_key=f"{order['_id']}:{event['id']}")
+
+
+EVENT_HANDLERS = {
+    "commit_stock":      _handle_commit_stock,
+    "release_stock":     _handle_release_stock,
+    "restore_credit":    _handle_restore_credit,
+    "completion_coupon": _handle_completion_coupon,
+    "rewards":           _handle_rewards,
+    "notify":            _handle_notify,
+    "web_push_ready":    _handle_web_push_ready,
+}
+
+
+# ==================== DISPATCHER ====================
+
+async def dispatch_order_events(oid: ObjectId) -> int:
+    """Claim one order's pending events and run them in order. Returns events completed."""
+    now = datetime.utcnow()
+    order = await db.orders.find_one_and_update(
+        {"_id": oid, "hasPendingEvents": True, "eventsLockedUntil": {"$not": {"$gt": now}}},
+        {"$set": {"eventsLockedUntil": now + timedelta(seconds=EVENT_LOCK_SECONDS)}},
+    )
+    if order is None:
+        return 0  # drained, or another dispatcher holds it
+
+    done = 0
+    for event in order.get("pendingEvents", []):
+        handler = EVENT_HANDLERS.get(event.get("type"))
+        try:
+            if handler:
+                # Handlers re-read whatever they guard on; the claimed snapshot is enough context
+                await handler(order, event)
+            else:
+                logger.error(f"[orders] unknown event type {event.get('type')} on {oid}")
+        except Exception as e:
+            attempts = event.get("attempts", 0) + 1
+            error = f"{event.get('type')}: {e}"
+            if attempts >= MAX_EVENT_ATTEMPTS:
+                logger.error(f"[orders] giving up on event {error} for {oid} after {attempts} attempts")
+                await db.orders.update_one(
+                    {"_id": oid},
+                    {"$pull": {"pendingEvents": {"id": event["id"]}},
+                     "$push": {"failedEvents": {**event, "attempts": attempts, "error": str(e),
+                                                "failedAt": datetime.utcnow()}},
+                     "$set": {"hasFailedEvents": True, "lastEventError": error}},
+                )
+                continue  # parked; the events behind it still run
+            logger.error(f"[orders] event {error} failed for {oid} (attempt {attempts})")
+            backoff = min(EVENT_BACKOFF_MAX_SECONDS, EVENT_LOCK_SECONDS * 2 ** (attempts - 1))
+            await db.orders.update_one(
+                {"_id": oid, "pendingEvents.id": event["id"]},
+                {"$set": {"pendingEvents.$.attempts": attempts, "lastEventError": error,
+                          "eventsLockedUntil": datetime.utcnow() + timedelta(seconds=backoff)}},
+            )
+            break  # keep order; the sweep retries once the backoff lapses
+        await db.orders.update_one({"_id": oid}, {"$pull": {"pendingEvents": {"id": event["id"]}}})
+        done += 1
+    else:
+        await db.orders.update_one(
+            {"_id": oid, "pendingEvents": {"$size": 0}},
+            {"$unset": {"hasPendingEvents": "", "eventsLockedUntil": "", "lastEventError": ""}},
+        )
+        # Events appended while we were running get their own pass
+        if await db.orders.count_documents({"_id": oid, "hasPendingEvents": True}, limit=1):
+            await db.orders.update_one({"_id": oid}, {"$unset": {"eventsLockedUntil": ""}})
+            return done + await dispatch_order_events(oid)
+    return done
+
+
+async def dispatch_order_events_batch(oids: list[ObjectId]) -> int:
+    """
+    Run the queued events for many orders in one pass. Orders of different
+    customers run concurrently; one customer's orders run in sequence so
+    streak and balance updates see each other.
+    """
+    by_user: dict[str, list[ObjectId]] = {}
+    for o in await db.orders.find({"_id": {"$in": oids}}, {"userId": 1}).to_list(len(oids)):
+        by_user.setdefault(o.get("userId", ""), []).append(o["_id"])
+    sem = asyncio.Semaphore(BULK_DISPATCH_CONCURRENCY)
+
+    async def _run_user(user_oids: list[ObjectId]) -> int:
+        async with sem:
+            done = 0
+            for oid in user_oids:
+                try:
+                    done += await dispatch_order_events(oid)
+                except Exception as e:
+                    logger.error(f"[orders] dispatch failed for {oid}: {e}")
+            return done
+
+    return sum(await asyncio.gather(*(_run_user(group) for group in by_user.values())))
+
+
+async def sweep_order_events() -> dict:
+    """Scheduler job: finish events left pending by a crashed or failed dispatch."""
+    now = datetime.utcnow()
+    stuck = await db.orders.find(
+        {"hasPendingEvents": True, "eventsLockedUntil": {"$not": {"$gt": now}}},
+        {"_id": 1},
+    ).limit(EVENT_SWEEP_BATCH).to_list(EVENT_SWEEP_BATCH)
+    completed = 0
+    errors = 0
+    for order in stuck:
+        try:
+            completed += await dispatch_order_events(order["_id"])
+        except Exception as e:
+            errors += 1
+            logger.error(f"[orders] sweep dispatch failed for {order['_id']}: {e}")
+    return {"orders": len(stuck), "eventsCompleted": completed, "errors": errors}
+
+
+async def failed_order_events(limit: int = 20) -> dict:
+    """Orders with parked events, newest orders first (for GET /admin/jobs)."""
+    orders = await db.orders.find(
+        {"hasFailedEvents": True}, {"failedEvents": 1}
+    ).sort("_id", -1).limit(limit).to_list(limit)
+    return {
+        "orders": await db.orders.count_documents({"hasFailedEvents": True}),
+        "recent": [
+            {"orderId": str(o["_id"]), "type": e.get("type"), "status": e.get("status"),
+             "attempts": e.get("attempts"), "error": e.get("error"), "failedAt": e.get("failedAt")}
+            for o in orders for e in o.get("failedEvents", [])
+        ],
+    }
+
+
+async def ensure_order_event_indexes() -> None:
+    try:
+        await db.orders.create_index("hasPendingEvents", sparse=True)
+        await db.orders.create_index("hasFailedEvents", sparse=True)
+    except Exception as e:
+        logger.warning(f"[orders] index creation warning (non-fatal): {e}")
@@ -0,0 +1,274 @@
+"""
+Segmented broadcast push campaigns.
+
+An admin creates a campaign (title, body, segment, channels). The campaign
+document in `push_campaigns` is the whole state of the send:
+
+    {_id, title, body, url, segment: {type, tierId?, inactiveDays?},
+     channels: [push, web_push], status: queued | running | completed |
+     cancelled | failed, cursor (last user _id processed), progress: {...},
+     asOf, createdAt, startedAt, finishedAt, lastError}
+
+A runner walks the segment's users in _id order, PAGE_SIZE at a time. For
+each page it loads the users' push_tokens and push_subscriptions with one
+$in query each, sends Expo messages in 100-message chunks and web pushes
+through the concurrent web push sender, then checkpoints the cursor and
+counters on the campaign. A worker holds a per-campaign lease (services/
+leases.py) while running, so a campaign interrupted by a restart is picked
+up from its last checkpoint by the `push_campaigns` scheduler job. Sending
+is paced to MAX_SENDS_PER_SECOND so a broadcast doesn't starve API traffic.
+
+Segments are evaluated against `asOf` (fixed at creation), so a resumed run
+targets the same audience.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from database import db
+from models.schemas import LOYALTY_TIERS
+from services.leases import acquire_lease, release_lease
+from services.scheduler import run_in_background
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+MAX_SENDS_PER_SECOND = 300
+CAMPAIGN_LEASE_SECONDS = 120
+CAMPAIGN_INTERVAL_SECONDS = 10
+MAX_CAMPAIGN_FAILURES = 5
+SEGMENT_TYPES = ("all", "tier", "inactive", "not_checked_in")
+
+# Leases are per worker, so this process also tracks what it is already sending
+_running_here: set = set()
+
+
+def segment_filter(segment: dict, as_of: datetime) -> dict:
+    """users query for a campaign segment, evaluated at as_of."""
+    kind = segment.get("type")
+    query: dict = {"isDisabled": {"$ne": True}}
+    if kind == "all":
+        return query
+    if kind == "tier":
+        tiers = sorted(LOYALTY_TIERS, key=lambda t: t["pointsRequired"])
+        idx = next((i for i, t in enumerate(tiers) if t["id"] == segment.get("tierId")), None)
+        if idx is None:
+            raise HTTPException(status_code=400, detail="Unknown tier")
+        points = {"$gte": tiers[idx]["pointsRequired"]}
+        if idx + 1 < len(tiers):
+            points["$lt"] = tiers[idx + 1]["pointsRequired"]
+        return {**query, "loyaltyPoints": points}
+    if kind == "inactive":
+        days = int(segment.get("inactiveDays") or 0)
+        if days < 1:
+            raise HTTPException(status_code=400, detail="inactiveDays must be at least 1")
+        cutoff = as_of - timedelta(days=days)
+        return {**query, "$or": [{"lastActiveAt": {"$lt": cutoff}}, {"lastActiveAt": None}]}
+    if kind == "not_checked_in":
+        return {**query, "lastCheckInDate": {"$ne": as_of.strftime("%Y-%m-%d")}}
+    raise HTTPException(status_code=400, detail=f"Unknown segment '{kind}'")
+
+
+async def create_campaign(title: str, body: str, url: Optional[str], segment: dict,
+                          channels: list[str], admin_id: str) -> dict:
+    now = datetime.utcnow()
+    segment_filter(segment, now)  # validate before persisting
+    doc = {
+        "title": title,
+        "body": body,
+        "url": url or "/",
+        "segment": segment,
+        "channels": channels,
+        "status": "queued",
+        "cursor": None,
+        "asOf": now,
+        "progress": {"users": 0, "pushSent": 0, "pushFailed": 0, "webSent": 0, "webFailed": 0, "removed": 0},
+        "createdBy": admin_id,
+        "createdAt": now,
+    }
+    result = await db.push_campaigns.insert_one(doc)
+    doc["_id"] = result.inserted_id
+    run_in_background(run_push_campaigns(), "push campaign kick")
+    return doc
+
+
+async def cancel_campaign(campaign_id: ObjectId) -> bool:
+    result = await db.push_campaigns.update_one(
+        {"_id": campaign_id, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"status": "cancelled", "finishedAt": datetime.utcnow()}},
+    )
+    return result.modified_count == 1
+
+
+class _Pacer:
+    """Sleeps just enough to keep the send rate under MAX_SENDS_PER_SECOND."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.sent = 0
+
+    async def wait(self, n: int) -> None:
+        self.sent += n
+        ahead = self.sent / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+
+
+async def _send_page(campaign: dict, user_ids: list[str]) -> dict:
+    from services.expo_push import CHUNK_SIZE, ExpoRequestError, send_chunk
+    from services.web_push_service import push_to_subscriptions
+
+    stats = {"pushSent": 0, "pushFailed": 0, "webSent": 0, "webFailed": 0, "removed": 0}
+    channels = campaign.get("channels") or []
+
+    async def _expo() -> None:
+        if "push" not in channels:
+            return
+        messages = [
+            {"to": t["token"], "sound": "default", "title": campaign["title"], "body": campaign["body"],
+             "data": {"url": campaign["url"], "campaignId": str(campaign["_id"])}}
+            async for t in db.push_tokens.find({"userId": {"$in": user_ids}}, {"_id": 0, "token": 1})
+            if t.get("token", "").startswith("ExponentPushToken")
+        ]
+        for i in range(0, len(messages), CHUNK_SIZE):
+            chunk = messages[i:i + CHUNK_SIZE]
+            try:
+                tickets = await send_chunk(chunk)
+            except ExpoRequestError as e:
+                logger.warning(f"[campaign] Expo chunk failed: {e}")
+                stats["pushFailed"] += len(chunk)
+                continue
+            ok = sum(1 for t in tickets if t.get("status") == "ok")
+            stats["pushSent"] += ok
+            stats["pushFailed"] += len(chunk) - ok
+
+    async def _web() -> None:
+        if "web_push" not in channels:
+            return
+        subs = await db.push_subscriptions.find(
+            {"userId": {"$in": user_ids}}, {"_id": 1, "endpoint": 1, "keys": 1}
+        ).to_list(None)
+        result = await push_to_subscriptions(subs, {
+            "title": campaign["title"],
+            "body": campaign["body"],
+            "icon": "/android-chrome-192x192.png",
+            "url": campaign["url"],
+        })
+        stats["webSent"] += result["sent"]
+        stats["webFailed"] += result["failed"]
+        stats["removed"] += result["removed"]
+
+    await asyncio.gather(_expo(), _web())
+    return stats
+
+
+async def _run_campaign(campaign: dict) -> None:
+    cid = campaign["_id"]
+    lease = f"campaign:{cid}"
+    query = segment_filter(campaign["segment"], campaign["asOf"])
+    cursor = campaign.get("cursor")
+    pacer = _Pacer(MAX_SENDS_PER_SECOND)
+    logger.info(f"[campaign] {cid}: {'resuming after ' + str(cursor) if cursor else 'starting'}")
+
+    while True:
+        page_query = {**query, "_id": {"$gt": cursor}} if cursor else query
+        users = await db.users.find(page_query, {"_id": 1}).sort("_id", 1).limit(PAGE_SIZE).to_list(PAGE_SIZE)
+        if not users:
+            break
+        stats = await _send_page(campaign, [str(u["_id"]) for u in users])
+        cursor = users[-1]["_id"]
+        # Checkpoint; stops if an admin cancelled the campaign meanwhile
+        updated = await db.push_campaigns.update_one(
+            {"_id": cid, "status": "running"},
+            {"$set": {"cursor": cursor, "updatedAt": datetime.utcnow()},
+             "$inc": {"progress.users": len(users), **{f"progress.{k}": v for k, v in stats.items()}}},
+        )
+        if updated.modified_count == 0:
+            logger.info(f"[campaign] {cid}: stopped (no longer running)")
+            return
+        if not await acquire_lease(lease, CAMPAIGN_LEASE_SECONDS):
+            logger.info(f"[campaign] {cid}: lease lost, leaving it to its new owner")
+            return
+        await pacer.wait(stats["pushSent"] + stats["pushFailed"] + stats["webSent"] + stats["webFailed"])
+
+    await db.push_campaigns.update_one(
+        {"_id": cid, "status": "running"},
+        {"$set": {"status": "completed", "finishedAt": datetime.utcnow()}},
+    )
+    logger.info(f"[campaign] {cid}: completed")
+
+
+async def run_push_campaigns() -> dict:
+    """
+    Scheduler job (and post-create kick): run every queued campaign, and any
+    running one whose worker died, from its last checkpoint.
+    """
+    ran = 0
+    candidates = await db.push_campaigns.find(
+        {"status": {"$in": ["queued", "running"]}}, {"_id": 1}
+    ).sort("createdAt", 1).to_list(20)
+    for c in candidates:
+        lease = f"campaign:{c['_id']}"
+        if c["_id"] in _running_here:
+            continue
+        _running_here.add(c["_id"])
+        if not await acquire_lease(lease, CAMPAIGN_LEASE_SECONDS):
+            _running_here.discard(c["_id"])
+            continue  # another worker is sending it
+        try:
+            campaign = await db.push_campaigns.find_one_and_update(
+                {"_id": c["_id"], "status": {"$in": ["queued", "running"]}},
+                {"$set": {"status": "running"}, "$min": {"startedAt": datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if campaign:
+                await _run_campaign(campaign)
+                ran += 1
+        except Exception as e:
+            logger.error(f"[campaign] {c['_id']} failed: {e}")
+            failed = await db.push_campaigns.find_one_and_update(
+                {"_id": c["_id"]},
+                {"$set": {"lastError": f"{type(e).__name__}: {e}"}, "$inc": {"failures": 1}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if failed and failed.get("failures", 0) >= MAX_CAMPAIGN_FAILURES:
+                await db.push_campaigns.update_one(
+                    {"_id": c["_id"], "status": "running"},
+                    {"$set": {"status": "failed", "finishedAt": datetime.utcnow()}},
+                )
+        finally:
+            _running_here.discard(c["_id"])
+            await release_lease(lease)
+    return {"campaignsRun": ran}
+
+
+def campaign_response(doc: dict) -> dict:
+    return {
+        "id": str(doc["_id"]),
+        "title": doc["title"],
+        "body": doc["body"],
+        "url": doc.get("url"),
+        "segment": doc["segment"],
+        "channels": doc.get("channels", []),
+        "status": doc["status"],
+        "progress": doc.get("progress", {}),
+        "createdAt": doc["createdAt"],
+        "startedAt": doc.get("startedAt"),
+        "finishedAt": doc.get("finishedAt"),
+        "lastError": doc.get("lastError"),
+    }
+
+
+async def ensure_campaign_indexes() -> None:
+    try:
+        await db.push_campaigns.create_index([("status", 1), ("createdAt", 1)])
+        await db.push_subscriptions.create_index("userId")
+    except Exception as e:
+        logger.warning(f"[campaign] index creation warning (non-fatal): {e}")
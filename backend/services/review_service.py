@@ -0,0 +1,80 @@
+"""
+Per-product rating aggregates, kept on the product document so the catalog
+can show stars without fetching reviews:
+
+    ratingCount      number of visible reviews
+    ratingSum        sum of their star ratings
+    ratingHistogram  {"1": n, ..., "5": n}
+
+Hidden reviews are excluded. Review writes adjust the aggregates with a single
+$inc; rebuild_rating_aggregates() recomputes them from the reviews collection.
+"""
+import logging
+
+from bson import ObjectId
+from pymongo import UpdateMany, UpdateOne
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+EMPTY_HISTOGRAM = {str(star): 0 for star in range(1, 6)}
+
+
+def _rating_inc(rating: int, sign: int) -> dict:
+    return {
+        "ratingCount": sign,
+        "ratingSum": sign * rating,
+        f"ratingHistogram.{rating}": sign,
+    }
+
+
+async def apply_rating_delta(product_id: str, rating: int, sign: int) -> None:
+    """Add (sign=+1) or remove (sign=-1) one visible review from a product's aggregates."""
+    if not 1 <= int(rating) <= 5:
+        return
+    try:
+        await db.products.update_one({"_id": ObjectId(product_id)}, {"$inc": _rating_inc(int(rating), sign)})
+    except Exception as e:
+        logger.warning(f"[ratings] aggregate update failed for product {product_id}: {e}")
+
+
+def rating_summary(product: dict) -> dict:
+    """Catalog-facing rating fields for a raw product document."""
+    count = int(product.get("ratingCount") or 0)
+    total = int(product.get("ratingSum") or 0)
+    return {
+        "ratingCount": count,
+        "ratingAverage": round(total / count, 2) if count > 0 else None,
+        "ratingHistogram": {**EMPTY_HISTOGRAM, **(product.get("ratingHistogram") or {})},
+    }
+
+
+async def rebuild_rating_aggregates() -> int:
+    """Recompute aggregates for every product from visible reviews. Returns products updated."""
+    pipeline = [
+        {"$match": {"isHidden": {"$ne": True}, "rating": {"$gte": 1, "$lte": 5}}},
+        {"$group": {"_id": {"productId": "$productId", "rating": "$rating"}, "n": {"$sum": 1}}},
+    ]
+    aggregates: dict = {}
+    async for row in db.reviews.aggregate(pipeline):
+        pid, rating, n = row["_id"]["productId"], int(row["_id"]["rating"]), row["n"]
+        agg = aggregates.setdefault(pid, {"ratingCount": 0, "ratingSum": 0, "ratingHistogram": dict(EMPTY_HISTOGRAM)})
+        agg["ratingCount"] += n
+        agg["ratingSum"] += n * rating
+        agg["ratingHistogram"][str(rating)] += n
+
+    ops = [
+        UpdateOne({"_id": ObjectId(pid)}, {"$set": agg})
+        for pid, agg in aggregates.items() if ObjectId.is_valid(pid)
+    ]
+    # Products whose reviews were all deleted / hidden go back to zero
+    ops.append(UpdateMany(
+        {"_id": {"$nin": [ObjectId(pid) for pid in aggregates if ObjectId.is_valid(pid)]}, "ratingCount": {"$ne": 0}},
+        {"$set": {"ratingCount": 0, "ratingSum": 0, "ratingHistogram": dict(EMPTY_HISTOGRAM)}},
+    ))
+    updated = 0
+    for i in range(0, len(ops), 500):
+        result = await db.products.bulk_write(ops[i:i + 500], ordered=False)
+        updated += result.modified_count
+    return updated
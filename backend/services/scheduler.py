@@ -0,0 +1,240 @@
+"""
+Background job scheduler.
+
+Every uvicorn worker registers the same jobs, but a run only happens in the
+worker holding that job's Mongo lease (services/leases.py), so N workers
+still execute each job once per tick. The lease is renewed while a run is in
+progress; if the leader dies another worker takes over once it lapses.
+
+Jobs run every `interval` seconds. With align=True runs land on wall-clock
+multiples of the interval in UTC (300 → :00, :05, …; 86400 → midnight), which
+covers the cron-style schedules this app needs. `jitter` adds a random delay
+so workers don't all wake at once. interval=None runs the job once.
+
+Each job runs under a supervisor: a failed run is retried with exponential
+backoff (capped at the interval), and a runner task that dies unexpectedly
+is restarted. Run history goes to the `job_runs` collection and is served by
+GET /api/admin/jobs.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from database import db
+from services.leases import WORKER_ID, acquire_lease, get_lease, release_lease
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 600
+MIN_LEASE_TTL_SECONDS = 30
+MAX_LEASE_TTL_SECONDS = 600
+
+# Fire-and-forget work started by requests (order events, campaign kicks). The
+# event loop only keeps weak references to tasks, so hold them until they finish.
+_background_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Awaitable, label: str) -> asyncio.Task:
+    """Start coro without awaiting it; the task is kept alive and a failure is logged."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    task.add_done_callback(lambda t: _log_background_failure(t, label))
+    return task
+
+
+def _log_background_failure(task: asyncio.Task, label: str) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"[scheduler] background {label} failed: {task.exception()!r}")
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Optional[dict]]],
+        interval: Optional[float],
+        align: bool = False,
+        jitter: float = 0.0,
+        leader_only: bool = True,
+        run_on_start: bool = True,
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.align = align
+        self.jitter = jitter
+        self.leader_only = leader_only
+        self.run_on_start = run_on_start
+        self.failures = 0
+        self.next_run_at: Optional[datetime] = None
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def lease_ttl(self) -> float:
+        # Capped so a dead leader of a daily job is replaced within minutes, not days
+        return min(MAX_LEASE_TTL_SECONDS, max(MIN_LEASE_TTL_SECONDS, (self.interval or 0) * 2))
+
+    def seconds_until_next_run(self) -> float:
+        if self.interval is None:
+            return 0.0
+        if self.align:
+            now = time.time()
+            delay = self.interval - (now % self.interval)
+        else:
+            delay = self.interval
+        return delay + random.uniform(0, self.jitter)
+
+    def backoff_seconds(self) -> float:
+        cap = min(BACKOFF_MAX_SECONDS, self.interval or BACKOFF_MAX_SECONDS)
+        return min(cap, BACKOFF_BASE_SECONDS * 2 ** (self.failures - 1)) + random.uniform(0, self.jitter)
+
+
+_jobs: dict[str, Job] = {}
+_stopping = False
+
+
+def lease_name(job_name: str) -> str:
+    return f"job:{job_name}"
+
+
+def register_job(job: Job) -> None:
+    _jobs[job.name] = job
+
+
+async def _renew_while_running(job: Job) -> None:
+    while True:
+        await asyncio.sleep(job.lease_ttl / 3)
+        await acquire_lease(lease_name(job.name), job.lease_ttl)
+
+
+async def _run_once(job: Job) -> bool:
+    """One tick. Returns False if the run raised."""
+    if job.leader_only and not await acquire_lease(lease_name(job.name), job.lease_ttl):
+        return True
+    job.running = True
+    started_at = datetime.utcnow()
+    started = time.monotonic()
+    renewer = asyncio.create_task(_renew_while_running(job)) if job.leader_only else None
+    error = None
+    result = None
+    try:
+        result = await job.func()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        logger.error(f"[scheduler] job {job.name} failed: {error}")
+    finally:
+        job.running = False
+        if renewer:
+            renewer.cancel()
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
+
+    update = {
+        "owner": WORKER_ID,
+        "lastRunAt": started_at,
+        "lastDurationMs": duration_ms,
+        "lastError": error,
+    }
+    if error is None:
+        update["lastSuccessAt"] = datetime.utcnow()
+        update["lastResult"] = result if isinstance(result, dict) else None
+    try:
+        await db.job_runs.update_one(
+            {"_id": job.name},
+            {"$set": update, "$inc": {"runs": 1, "failures": 1 if error else 0}},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.warning(f"[scheduler] could not record run of {job.name}: {e}")
+    return error is None
+
+
+async def _job_runner(job: Job) -> None:
+    if not job.run_on_start:
+        delay = job.seconds_until_next_run()
+        job.next_run_at = datetime.utcfromtimestamp(time.time() + delay)
+        await asyncio.sleep(delay)
+    while True:
+        ok = await _run_once(job)
+        if ok:
+            job.failures = 0
+            if job.interval is None:
+                return
+            delay = job.seconds_until_next_run()
+        else:
+            job.failures += 1
+            delay = job.backoff_seconds()
+        job.next_run_at = datetime.utcfromtimestamp(time.time() + delay)
+        await asyncio.sleep(delay)
+
+
+async def _supervise(job: Job) -> None:
+    """Keep the job's runner alive; restart it with backoff if it ever dies."""
+    restarts = 0
+    while not _stopping:
+        try:
+            await _job_runner(job)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            restarts += 1
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (restarts - 1))
+            logger.error(f"[scheduler] runner for {job.name} crashed ({e}); restarting in {delay}s")
+            await asyncio.sleep(delay)
+
+
+def start_scheduler() -> None:
+    for job in _jobs.values():
+        if job.task is None or job.task.done():
+            job.task = asyncio.create_task(_supervise(job))
+    logger.info(f"[scheduler] started {len(_jobs)} job(s) on {WORKER_ID}")
+
+
+async def stop_scheduler() -> None:
+    global _stopping
+    _stopping = True
+    for job in _jobs.values():
+        if job.task and not job.task.done():
+            job.task.cancel()
+        if job.leader_only:
+            try:
+                await release_lease(lease_name(job.name))
+            except Exception:
+                pass
+
+
+async def get_job_status() -> list[dict]:
+    """Registered jobs with schedule, lease owner and last-run history."""
+    runs = {r["_id"]: r for r in await db.job_runs.find({"_id": {"$in": list(_jobs)}}).to_list(len(_jobs))}
+    result = []
+    for job in _jobs.values():
+        lease = await get_lease(lease_name(job.name)) if job.leader_only else None
+        run = runs.get(job.name, {})
+        lease_live = bool(lease and lease.get("expiresAt") and lease["expiresAt"] > datetime.utcnow())
+        result.append({
+            "name": job.name,
+            "intervalSeconds": job.interval,
+            "aligned": job.align,
+            "leaderOnly": job.leader_only,
+            "owner": lease.get("owner") if lease_live else None,
+            "leaseExpiresAt": lease.get("expiresAt") if lease else None,
+            "lastRunBy": run.get("owner"),
+            "lastRunAt": run.get("lastRunAt"),
+            "lastDurationMs": run.get("lastDurationMs"),
+            "lastSuccessAt": run.get("lastSuccessAt"),
+            "lastError": run.get("lastError"),
+            "lastResult": run.get("lastResult"),
+            "runs": run.get("runs", 0),
+            "failures": run.get("failures", 0),
+            # This worker's view of its own runner
+            "runningHere": job.running,
+            "nextRunHereAt": job.next_run_at,
+            "consecutiveFailuresHere": job.failures,
+        })
+    return result
@@ -0,0 +1,45 @@
+"""
+Multi-document transactions where the deployment has them.
+
+Transactions need a replica set or mongos (a local single-node replica set
+is enough). run_in_transaction(mutation) runs mutation(session) inside one
+when they're available, and otherwise calls mutation(None); callers that can
+run on a standalone server pass their writes session=session and undo
+partial work themselves when the session is None. Used by checkout
+(services/checkout_service.py) and the reservation release job
+(services/inventory_service.py).
+"""
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from database import client
+
+logger = logging.getLogger(__name__)
+
+_transactions_supported: Optional[bool] = None
+
+
+async def transactions_supported() -> bool:
+    """True when connected to a replica set or mongos (cached after the first check)."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+            _transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            logger.warning(f"[transactions] could not detect transaction support: {e}")
+            _transactions_supported = False
+        logger.info(f"[transactions] transactions supported: {_transactions_supported}")
+    return _transactions_supported
+
+
+async def run_in_transaction(mutation: Callable[[Any], Awaitable[Any]]) -> Any:
+    """
+    Run mutation(session) as one transaction when the deployment supports it
+    (retried on transient errors by with_transaction); otherwise call
+    mutation(None) and let it compensate on failure.
+    """
+    if await transactions_supported():
+        async with await client.start_session() as session:
+            return await session.with_transaction(mutation)
+    return await mutation(None)
@@ -0,0 +1,157 @@
+"""
+Static file serving for /api/uploads/products.
+
+Upload filenames are content hashes (or legacy random uuids), so a file never
+changes once written. This layer marks those files immutable for a year,
+answers single-range requests with 206, prefers precompressed .br / .gz
+siblings when the client accepts them, and keeps hit/byte counters for the
+admin stats endpoint. Full-file responses go through FileResponse, which uses
+the server's pathsend (sendfile) extension when available.
+"""
+import os
+import re
+import stat
+from mimetypes import guess_type
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+
+# <digest>.<ext>, brand_<digest>.<ext>, <digest>_<size>.<fmt>
+_CONTENT_ADDRESSED_RE = re.compile(r"^(brand_)?[0-9a-f]{32}(_(thumb|card|detail))?\.[a-z0-9]+$")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+_CHUNK_SIZE = 64 * 1024
+
+upload_stats: dict = {
+    "requests": 0,
+    "hits": 0,
+    "misses": 0,
+    "notModified": 0,
+    "partial": 0,
+    "precompressed": 0,
+    "bytesSent": 0,
+}
+
+
+class _FileRangeResponse(Response):
+    """206 response streaming bytes [start, end] of a file."""
+
+    def __init__(self, path: str, start: int, end: int, size: int, headers: dict, media_type: str):
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _parse_range(value: str, size: int):
+    """Return (start, end) for a single satisfiable byte range, None to ignore, or 'unsatisfiable'."""
+    match = _RANGE_RE.match(value.strip())
+    if not match:
+        return None  # multi-range / malformed → serve the full file
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            return "unsatisfiable"
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, end
+
+
+class UploadStaticFiles(StaticFiles):
+    async def get_response(self, path: str, scope) -> Response:
+        upload_stats["requests"] += 1
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code == 404:
+                upload_stats["misses"] += 1
+            raise
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        name = os.path.basename(full_path)
+        media_type = guess_type(name)[0] or "application/octet-stream"
+
+        send_path, send_stat, encoding = full_path, stat_result, None
+        if "range" not in request_headers:
+            accept_encoding = request_headers.get("accept-encoding", "")
+            for enc, suffix in _PRECOMPRESSED:
+                if enc not in accept_encoding:
+                    continue
+                try:
+                    candidate_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                if stat.S_ISREG(candidate_stat.st_mode):
+                    send_path, send_stat, encoding = full_path + suffix, candidate_stat, enc
+                    break
+
+        response = FileResponse(send_path, status_code=status_code, stat_result=send_stat, media_type=media_type)
+        response.headers["cache-control"] = (
+            IMMUTABLE_CACHE_CONTROL if _CONTENT_ADDRESSED_RE.match(name) else DEFAULT_CACHE_CONTROL
+        )
+        response.headers["accept-ranges"] = "bytes"
+        response.headers["vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["content-encoding"] = encoding
+
+        if self.is_not_modified(response.headers, request_headers):
+            upload_stats["notModified"] += 1
+            return NotModifiedResponse(response.headers)
+
+        size = send_stat.st_size
+        range_header = request_headers.get("range")
+        if range_header and status_code == 200:
+            if_range = request_headers.get("if-range")
+            if not if_range or if_range == response.headers.get("etag"):
+                byte_range = _parse_range(range_header, size)
+                if byte_range == "unsatisfiable":
+                    return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+                if byte_range is not None:
+                    start, end = byte_range
+                    headers = {
+                        k: v for k, v in response.headers.items()
+                        if k not in ("content-length", "content-type")
+                    }
+                    upload_stats["hits"] += 1
+                    upload_stats["partial"] += 1
+                    upload_stats["bytesSent"] += end - start + 1
+                    return _FileRangeResponse(full_path, start, end, size, headers, media_type)
+
+        upload_stats["hits"] += 1
+        upload_stats["bytesSent"] += size
+        if encoding:
+            upload_stats["precompressed"] += 1
+        return response
@@ -0,0 +1,173 @@
+"""
+Cached user auth state shared by HTTP auth and the chat sockets.
+
+The cache holds the fields an auth decision needs (admin flag, disabled /
+merged, forceLogoutAt) plus the display-name fields chat uses, for
+USER_STATE_TTL_SECONDS:
+
+  - get_current_user (auth.py) loads the full user document for the route
+    anyway, and refreshes the cache with it via remember();
+  - socket connects read through get(). Misses from concurrent connects are
+    coalesced over LOOKUP_WINDOW_SECONDS into one $in query (and a user
+    already being looked up is never queried twice), so a reconnect storm
+    after a deploy costs a handful of queries instead of one per socket.
+
+Both paths apply the same auth.check_user_access().
+
+State changes (disable, enable, force-logout, merge, delete, admin edits)
+call publish_user_state_change(). It goes out on USER_STATE_CHANNEL through
+the chat backplane, so every worker drops its cached entry, reloads the
+user, and closes that user's sockets that no longer pass the check. Sockets
+whose token has expired are closed by the `chat_token_expiry` job. Clients
+either reconnect with their current token or, without reconnecting, send
+{"type": "auth", "token": ...} to move the socket onto a fresh one.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from database import db
+from services.chat_connections import chat_manager
+
+logger = logging.getLogger(__name__)
+
+USER_STATE_TTL_SECONDS = 60
+LOOKUP_WINDOW_SECONDS = 0.02
+MAX_LOOKUP_BATCH = 500
+USER_STATE_CHANNEL = "user_state"
+TOKEN_EXPIRY_INTERVAL_SECONDS = 30
+REVOKED_CLOSE_CODE = 4001
+
+STATE_FIELDS = {
+    "isAdmin": 1, "isDisabled": 1, "forceLogoutAt": 1, "mergedInto": 1,
+    "firstName": 1, "lastName": 1, "username": 1, "email": 1, "name": 1,
+}
+
+user_state_stats: dict = {"hits": 0, "misses": 0, "queries": 0, "changes": 0, "sockets_closed": 0}
+
+
+class UserStateCache:
+    def __init__(self, ttl: float = USER_STATE_TTL_SECONDS, window: float = LOOKUP_WINDOW_SECONDS):
+        self.ttl = ttl
+        self.window = window
+        self._entries: dict[str, tuple[float, Optional[dict]]] = {}
+        self._pending: dict[str, asyncio.Future] = {}
+        self._forgotten: dict[str, float] = {}  # user_id -> when its state last changed
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def remember(self, user: dict) -> None:
+        """Store the auth fields of a freshly loaded user document."""
+        state = {"_id": user["_id"], **{k: user[k] for k in STATE_FIELDS if k in user}}
+        self._entries[str(user["_id"])] = (time.monotonic() + self.ttl, state)
+
+    def forget(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+        self._forgotten[user_id] = time.monotonic()
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        """Auth state for user_id (None if there is no such user)."""
+        entry = self._entries.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            user_state_stats["hits"] += 1
+            return entry[1]
+        user_state_stats["misses"] += 1
+        if not ObjectId.is_valid(user_id):
+            return None
+        future = self._pending.get(user_id)
+        if future is None:
+            future = self._pending[user_id] = asyncio.get_running_loop().create_future()
+            if len(self._pending) >= MAX_LOOKUP_BATCH:
+                asyncio.create_task(self._flush(0))
+            elif self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.create_task(self._flush(self.window))
+        return await asyncio.shield(future)
+
+    async def _flush(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        while self._pending:
+            batch = dict(list(self._pending.items())[:MAX_LOOKUP_BATCH])
+            for uid in batch:
+                del self._pending[uid]
+            started = time.monotonic()
+            try:
+                user_state_stats["queries"] += 1
+                found = {
+                    str(u["_id"]): u
+                    async for u in db.users.find(
+                        {"_id": {"$in": [ObjectId(uid) for uid in batch]}}, STATE_FIELDS
+                    )
+                }
+            except Exception as e:
+                for future in batch.values():
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            expires = time.monotonic() + self.ttl
+            for uid, future in batch.items():
+                state = found.get(uid)
+                # A change published while the query ran may not be in its result
+                if self._forgotten.get(uid, 0) < started:
+                    self._entries[uid] = (expires, state)
+                if not future.done():
+                    future.set_result(state)
+        # Keep the map from growing without bound
+        if len(self._entries) > 50_000:
+            now = time.monotonic()
+            self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+        if self._forgotten:
+            cutoff = time.monotonic() - self.ttl
+            self._forgotten = {k: t for k, t in self._forgotten.items() if t > cutoff}
+
+    # ---------- change subscription ----------
+
+    async def _on_change(self, message: dict) -> None:
+        from auth import check_user_access  # auth imports this module
+
+        user_id = message.get("userId")
+        if not user_id:
+            return
+        self.forget(user_id)
+        conns = chat_manager.connections_for_user(user_id)
+        if not conns:
+            return
+        state = await self.get(user_id)
+        for conn in conns:
+            try:
+                check_user_access(state, {"iat": conn.token_iat})
+            except HTTPException as e:
+                logger.info(f"[chat] closing socket for user {user_id}: {e.detail}")
+                user_state_stats["sockets_closed"] += 1
+                await conn.close(REVOKED_CLOSE_CODE)
+
+    def start(self) -> None:
+        chat_manager.subscribe(USER_STATE_CHANNEL, self._on_change)
+
+
+user_states = UserStateCache()
+
+
+async def publish_user_state_change(user_id: str) -> None:
+    """Tell every worker a user's auth state changed (drops caches, closes revoked sockets)."""
+    user_state_stats["changes"] += 1
+    user_states.forget(user_id)
+    try:
+        await chat_manager.broadcast(USER_STATE_CHANNEL, {"userId": user_id})
+    except Exception as e:
+        # Other workers still pick the change up when their cache entry expires
+        logger.warning(f"[auth] user state change for {user_id} not published: {e}")
+
+
+async def close_expired_sockets() -> dict:
+    """Scheduler job (every worker): close chat sockets whose token has expired."""
+    now = time.time()
+    closed = 0
+    for conn in chat_manager.all_connections():
+        if conn.token_exp is not None and conn.token_exp <= now:
+            await conn.close(REVOKED_CLOSE_CODE)
+            closed += 1
+    return {"closed": closed}
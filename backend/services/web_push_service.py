@@ -1,63 +1,169 @@
 """
 Web Push Notification service using VAPID + pywebpush.
 Separate from the Expo mobile push in order_service.py.
+
+Delivery never blocks the event loop: payload encryption (ECDH + AES-GCM via
+pywebpush's WebPusher) runs on a small thread pool, requests go out on the
+shared pooled HTTP client (services/http_client.py, HTTP/2 when available)
+with a global cap on in-flight sends, and the VAPID JWT for each push-service
+origin is signed once and reused until shortly before it expires.
+Subscriptions the push service reports gone (404/410) are deleted in one
+delete_many per batch.
 """
-import os
+import asyncio
 import json
 import logging
-from datetime import datetime
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlsplit
+
 from database import db
-from pywebpush import webpush, WebPushException
+from pywebpush import WebPusher
+from py_vapid import Vapid
+
+from services.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
-VAPID_PRIVATE_KEY = os.environ.get("VAPID_PRIVATE_KEY", "")
-VAPID_PUBLIC_KEY  = os.environ.get("VAPID_PUBLIC_KEY", "")
 VAPID_CLAIMS      = {"sub": "mailto:admin@clouddistrict.club"}
+VAPID_JWT_TTL     = 12 * 3600     # the spec allows at most 24h
+VAPID_JWT_MARGIN  = 300           # re-sign this long before expiry
+PUSH_TTL_SECONDS  = 24 * 3600
+SEND_CONCURRENCY  = 50
+
+_encrypt_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="webpush")
+_send_slots: Optional[asyncio.Semaphore] = None
+_vapid: Optional[Vapid] = None
+_vapid_source: Optional[str] = None
+_jwt_cache: dict[str, tuple[dict, float]] = {}   # origin → (auth headers, expires epoch)
+
+
+def _vapid_keys() -> tuple[str, str]:
+    # Read at call time: vapid_bootstrap may populate the env after this module is imported
+    return os.environ.get("VAPID_PRIVATE_KEY", ""), os.environ.get("VAPID_PUBLIC_KEY", "")
+
+
+def _sign_vapid(private_key: str, origin: str) -> tuple[dict, float]:
+    global _vapid, _vapid_source
+    if _vapid is None or _vapid_source != private_key:
+        _vapid = Vapid.from_string(private_key=private_key)
+        _vapid_source = private_key
+        _jwt_cache.clear()
+    expires = time.time() + VAPID_JWT_TTL
+    headers = _vapid.sign({**VAPID_CLAIMS, "aud": origin, "exp": int(expires)})
+    return headers, expires
+
+
+async def _vapid_headers(private_key: str, origin: str) -> dict:
+    cached = _jwt_cache.get(origin)
+    if cached and cached[1] - VAPID_JWT_MARGIN > time.time() and _vapid_source == private_key:
+        return cached[0]
+    loop = asyncio.get_running_loop()
+    headers, expires = await loop.run_in_executor(_encrypt_pool, _sign_vapid, private_key, origin)
+    _jwt_cache[origin] = (headers, expires)
+    return headers
+
+
+def _origin(endpoint: str) -> str:
+    parts = urlsplit(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _encrypt(sub: dict, data: bytes) -> bytes:
+    pusher = WebPusher({"endpoint": sub["endpoint"], "keys": sub["keys"]})
+    return pusher.encode(data, content_encoding="aes128gcm")["body"]
+
+
+async def _send_one(sub: dict, data: bytes, private_key: str) -> int:
+    """POST one encrypted message. Returns the push service's HTTP status."""
+    global _send_slots
+    if _send_slots is None:
+        _send_slots = asyncio.Semaphore(SEND_CONCURRENCY)
+    origin = _origin(sub["endpoint"])
+    loop = asyncio.get_running_loop()
+    async with _send_slots:
+        body = await loop.run_in_executor(_encrypt_pool, _encrypt, sub, data)
+        headers = {
+            **await _vapid_headers(private_key, origin),
+            "Content-Encoding": "aes128gcm",
+            "Content-Type": "application/octet-stream",
+            "TTL": str(PUSH_TTL_SECONDS),
+        }
+        resp = await get_http_client().post(sub["endpoint"], content=body, headers=headers)
+    return resp.status_code
 
 
-async def send_web_push(user_id: str, payload: dict) -> int:
+async def send_web_push(user_id: str, payload: dict, dedupe_key: str | None = None) -> bool:
     """
-    Send a Web Push notification to all active browser subscriptions for user_id.
+    Queue a Web Push notification for all of user_id's browser subscriptions.
+    Delivered by the notification outbox dispatcher; returns False if
+    dedupe_key was already queued.
 
     payload shape:
         { title: str, body: str, icon?: str, url?: str }
+    """
+    from services.notification_outbox import enqueue_notification
+    return await enqueue_notification(user_id, "web_push", payload, dedupe_key=dedupe_key)
 
-    Returns number of successful sends.
-    Automatically removes expired/invalid (404/410) subscriptions.
+
+async def push_to_subscriptions(subs: list[dict], payload: dict) -> dict:
+    """
+    Send one payload to many subscriptions concurrently. Dead (404/410)
+    subscriptions are removed with one delete_many.
+    Returns {"sent", "removed", "failed", "lastError"}.
     """
-    if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
-        logger.debug("[web_push] VAPID keys not configured — skipping")
-        return 0
+    private_key, public_key = _vapid_keys()
+    if not private_key or not public_key or not subs:
+        if subs:
+            logger.debug("[web_push] VAPID keys not configured — skipping")
+        return {"sent": 0, "removed": 0, "failed": 0, "lastError": None}
+
+    data = json.dumps(payload).encode()
+    results = await asyncio.gather(*(_send_one(sub, data, private_key) for sub in subs), return_exceptions=True)
+
+    sent, failed, dead, last_error = 0, 0, [], None
+    for sub, result in zip(subs, results):
+        if isinstance(result, Exception):
+            failed += 1
+            last_error = f"{type(result).__name__}: {result}"
+        elif result in (404, 410):
+            dead.append(sub["_id"])
+        elif result >= 400:
+            failed += 1
+            last_error = f"HTTP {result}"
+            if result in (401, 403):
+                # Push service rejected our JWT; sign a fresh one next time
+                _jwt_cache.pop(_origin(sub["endpoint"]), None)
+        else:
+            sent += 1
+    if dead:
+        await db.push_subscriptions.delete_many({"_id": {"$in": dead}})
+        logger.info(f"[web_push] Removed {len(dead)} expired subscription(s)")
+    if last_error:
+        logger.warning(f"[web_push] {failed} send(s) failed, last: {last_error}")
+    return {"sent": sent, "removed": len(dead), "failed": failed, "lastError": last_error}
+
 
+async def deliver_web_push(user_id: str, payload: dict) -> int:
+    """
+    Send a Web Push notification to all active browser subscriptions for user_id.
+
+    Returns number of successful sends.
+    Raises TransientDeliveryError if nothing was delivered and a send may succeed on retry.
+    """
+    from services.notification_outbox import TransientDeliveryError
     subs = await db.push_subscriptions.find(
         {"userId": user_id},
         {"_id": 1, "endpoint": 1, "keys": 1},
     ).to_list(20)
 
-    if not subs:
-        return 0
-
-    sent = 0
-    for sub in subs:
-        try:
-            webpush(
-                subscription_info={
-                    "endpoint": sub["endpoint"],
-                    "keys":     sub["keys"],
-                },
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS,
-            )
-            sent += 1
-        except WebPushException as e:
-            if e.response is not None and e.response.status_code in (404, 410):
-                await db.push_subscriptions.delete_one({"_id": sub["_id"]})
-                logger.info(f"[web_push] Removed expired subscription for {user_id}")
-            else:
-                logger.warning(f"[web_push] Send failed for {user_id}: {e}")
-        except Exception as e:
-            logger.error(f"[web_push] Unexpected error for {user_id}: {e}")
-
-    return sent
+    result = await push_to_subscriptions(subs, payload)
+    if result["sent"] == 0 and result["failed"]:
+        raise TransientDeliveryError(f"web push failed: {result['lastError']}")
+    return result["sent"]
+
+
+def shutdown_web_push_pool() -> None:
+    _encrypt_pool.shutdown(wait=False)
@@ -0,0 +1,63 @@
+"""
+Shared setup for the in-process unit tests (chat fan-out, presence, write
+buffer, user-state cache, Expo batcher, SMTP sender). The live-HTTP suites
+don't use any of it.
+
+The backend directory goes on sys.path and the database settings get
+placeholders (nothing connects at import time), so tests can import
+`services.*` directly. Modules marked `pytestmark = pytest.mark.backend`
+are skipped when motor isn't installed.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:27017")
+os.environ.setdefault("DB_NAME", "test_unit")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "backend: imports backend services (needs motor)")
+
+
+def pytest_collection_modifyitems(config, items):
+    if importlib.util.find_spec("motor") is not None:
+        return
+    skip = pytest.mark.skip(reason="motor not installed")
+    for item in items:
+        if item.get_closest_marker("backend"):
+            item.add_marker(skip)
+
+
+class FakeSocket:
+    """In-memory WebSocket: records sent frames (decoded) and the close code."""
+
+    def __init__(self, stall: bool = False, fail: bool = False):
+        self.stall = stall
+        self.fail = fail
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        if self.stall:
+            await asyncio.sleep(3600)
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+@pytest.fixture
+def fake_socket():
+    """Factory: fake_socket(stall=True) never finishes a send, fail=True raises on send."""
+    return FakeSocket
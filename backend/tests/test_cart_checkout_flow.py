@@ -259,10 +259,10 @@ class TestCartCheckoutFlow:
         """Test getting user's order history"""
         response = self.session.get(f"{BASE_URL}/api/orders")
         assert response.status_code == 200, f"Failed to get orders: {response.text}"
-        orders = response.json()
-        print(f"User has {len(orders)} orders")
+        orders = response.json()["orders"]
+        print(f"User has {len(orders)} orders on the first page")
         
-        # Verify order structure
+        # Verify order summary structure
         for order in orders[:3]:
             assert "id" in order, "Order missing id"
             assert "status" in order, "Order missing status"
@@ -0,0 +1,77 @@
+"""
+Chat fan-out: per-socket send queues, slow-consumer handling, dead-socket cleanup.
+Uses in-memory fake sockets; no server or database traffic.
+"""
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.backend
+
+
+def _manager():
+    from services import chat_connections
+    return chat_connections, chat_connections.ConnectionManager()
+
+
+def test_fast_clients_unaffected_by_stalled_one(monkeypatch, fake_socket):
+    chat_connections, manager = _manager()
+    monkeypatch.setattr(chat_connections, "SLOW_CONSUMER_SECONDS", 0.02)
+
+    async def run():
+        await manager.backplane.start(manager.deliver_local)
+        fast, slow = fake_socket(), fake_socket(stall=True)
+        await manager.connect("chat_1", fast)
+        await manager.connect("chat_1", slow)
+        for i in range(chat_connections.SEND_QUEUE_SIZE + 5):
+            await manager.broadcast("chat_1", {"type": "typing", "isTyping": bool(i % 2)})
+        await manager.broadcast("chat_1", {"type": "message", "message": "hello"})
+        await asyncio.sleep(0.05)
+        await manager.broadcast("chat_1", {"type": "message", "message": "still there?"})
+        await asyncio.sleep(0.05)
+        return fast, slow
+
+    fast, slow = asyncio.run(run())
+    assert fast.closed_with is None
+    assert fast.sent[-2:] == [
+        {"type": "message", "message": "hello"},
+        {"type": "message", "message": "still there?"},
+    ]
+    # The stalled socket's oldest frame outlived SLOW_CONSUMER_SECONDS and it was disconnected
+    assert slow.closed_with == chat_connections.SLOW_CONSUMER_CLOSE_CODE
+    assert all(c.websocket is not slow for c in manager.active_connections.get("chat_1", []))
+
+
+def test_burst_larger_than_queue_reaches_healthy_client(fake_socket):
+    chat_connections, manager = _manager()
+    burst = chat_connections.SEND_QUEUE_SIZE * 3
+
+    async def run():
+        await manager.backplane.start(manager.deliver_local)
+        sock = fake_socket()
+        await manager.connect("chat_3", sock)
+        # Delivered back to back, before the writer task gets to run
+        for i in range(burst):
+            await manager.deliver_local("chat_3", {"type": "message", "message": str(i)})
+        await asyncio.sleep(0.05)
+        return sock
+
+    sock = asyncio.run(run())
+    assert sock.closed_with is None
+    assert [m["message"] for m in sock.sent] == [str(i) for i in range(burst)]
+
+
+def test_failed_socket_removed(fake_socket):
+    _, manager = _manager()
+
+    async def run():
+        await manager.backplane.start(manager.deliver_local)
+        dead = fake_socket(fail=True)
+        await manager.connect("chat_2", dead)
+        await manager.broadcast("chat_2", {"type": "message", "message": "hi"})
+        await asyncio.sleep(0.05)
+        return dead
+
+    dead = asyncio.run(run())
+    assert dead.closed_with == 1011
+    assert "chat_2" not in manager.active_connections
@@ -0,0 +1,50 @@
+"""
+Typing debounce/expiry and local presence counts.
+Uses the in-process backplane and in-memory fake sockets; no database traffic.
+"""
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.backend
+
+
+@pytest.fixture
+def presence_env(monkeypatch):
+    from services import chat_connections, chat_presence
+    manager = chat_connections.ConnectionManager()
+    monkeypatch.setattr(chat_presence, "chat_manager", manager)
+    monkeypatch.setattr(chat_presence, "TYPING_TIMEOUT_SECONDS", 0.1)
+    return chat_presence, manager
+
+
+def test_typing_debounced_and_expired(presence_env, fake_socket):
+    chat_presence, manager = presence_env
+    service = chat_presence.PresenceService()
+
+    async def run():
+        await manager.backplane.start(manager.deliver_local)
+        watcher = fake_socket()
+        await manager.connect("chat_1", watcher)
+        for _ in range(10):
+            await service.typing("chat_1", "u1", "Sam", True)
+        await service.typing("chat_1", "u1", "Sam", False)
+        await service.typing("chat_1", "u1", "Sam", False)  # not typing: no frame
+        await service.typing("chat_1", "u2", "Lee", True)
+        await asyncio.sleep(0.2)  # u2's state times out
+        return [m["isTyping"] for m in watcher.sent]
+
+    assert asyncio.run(run()) == [True, False, True, False]
+
+
+def test_presence_counts(presence_env):
+    chat_presence, _ = presence_env
+    service = chat_presence.PresenceService()
+    service.joined("chat_1", is_admin=False)
+    service.joined("chat_1", is_admin=True)
+    assert service.counts("chat_1") == {"users": 1, "admins": 1}
+    assert service.is_online("chat_1")
+    service.left("chat_1", is_admin=False)
+    assert not service.is_online("chat_1")
+    service.left("chat_1", is_admin=True)
+    assert service.counts("chat_1") == {"users": 0, "admins": 0}
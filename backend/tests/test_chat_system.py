@@ -92,6 +92,32 @@ class TestChatMessagesAPI:
         )
         assert response.status_code == 403, f"Expected 403 without auth, got: {response.status_code}"
 
+    def test_get_chat_messages_paginated(self, test_user_auth):
+        """Pages come back oldest-first within the page, with X-Has-More and usable cursors"""
+        headers = {"Authorization": f"Bearer {test_user_auth['token']}"}
+        url = f"{BASE_URL}/api/chat/messages/{test_user_auth['chat_id']}"
+        response = requests.get(url, params={"limit": 2}, headers=headers)
+        assert response.status_code == 200, f"Failed to get chat page: {response.text}"
+        assert response.headers.get("X-Has-More") in ("true", "false")
+        page = response.json()
+        assert len(page) <= 2
+        assert [m["createdAt"] for m in page] == sorted(m["createdAt"] for m in page)
+        if page:
+            first, last = page[0], page[-1]
+            older = requests.get(url, params={"before": f"{first['createdAt']}_{first['id']}"}, headers=headers).json()
+            assert all(m["createdAt"] <= first["createdAt"] for m in older)
+            newer = requests.get(url, params={"since": f"{last['createdAt']}_{last['id']}"}, headers=headers).json()
+            assert newer == [], "Nothing is newer than the latest message"
+
+    def test_get_chat_messages_invalid_cursor(self, test_user_auth):
+        """A malformed cursor is rejected"""
+        response = requests.get(
+            f"{BASE_URL}/api/chat/messages/{test_user_auth['chat_id']}",
+            params={"before": "yesterday"},
+            headers={"Authorization": f"Bearer {test_user_auth['token']}"}
+        )
+        assert response.status_code == 400
+
 
 class TestAdminChatsAPI:
     """Test admin chat management REST API"""
@@ -132,6 +158,26 @@ class TestAdminChatsAPI:
         data = response.json()
         assert isinstance(data, list), "Response should be a list"
         print(f"Admin found {len(data)} chat sessions")
+
+    def test_admin_chats_paginated(self, admin_auth):
+        """Inbox rows carry name, unread count and presence; pages follow the lastMessageAt cursor"""
+        headers = {"Authorization": f"Bearer {admin_auth['token']}"}
+        response = requests.get(f"{BASE_URL}/api/admin/chats", params={"limit": 2}, headers=headers)
+        assert response.status_code == 200, f"Failed to get admin chats: {response.text}"
+        assert response.headers.get("X-Has-More") in ("true", "false")
+        page = response.json()
+        assert len(page) <= 2
+        for s in page:
+            assert {"chatId", "userName", "unread", "online", "lastMessageAt"} <= set(s)
+            assert isinstance(s["unread"], int)
+        if response.headers["X-Has-More"] == "true":
+            last = page[-1]
+            next_page = requests.get(
+                f"{BASE_URL}/api/admin/chats",
+                params={"limit": 2, "before": f"{last['lastMessageAt']}_{last['chatId']}"},
+                headers=headers,
+            ).json()
+            assert not {s["chatId"] for s in next_page} & {s["chatId"] for s in page}
     
     def test_admin_chats_requires_admin(self, test_user_auth):
         """Regular user cannot access admin chats endpoint"""
@@ -0,0 +1,76 @@
+"""
+Chat write buffer: batched inserts, collapsed session upserts, coalesced read receipts.
+The collections are replaced with recorders, so no database is needed.
+"""
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.backend
+
+
+class _Recorder:
+    def __init__(self):
+        self.inserts = []
+        self.bulk = []
+
+    async def insert_many(self, docs, ordered=True):
+        for i, doc in enumerate(docs):
+            doc["_id"] = f"id{len(self.inserts)}-{i}"
+        self.inserts.append(list(docs))
+
+    async def bulk_write(self, ops, ordered=True):
+        self.bulk.append(list(ops))
+
+
+class _FakeDb:
+    def __init__(self):
+        self.chat_messages = _Recorder()
+        self.chat_sessions = _Recorder()
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    from services import chat_writes
+    fake = _FakeDb()
+    monkeypatch.setattr(chat_writes, "db", fake)
+    return chat_writes.ChatWriteBuffer(window=0.02, read_interval=0.2), fake
+
+
+def _msg(chat_id, text, at):
+    return {"type": "message", "chatId": chat_id, "senderId": "u", "message": text, "createdAt": at}
+
+
+def test_messages_batched_and_sessions_collapsed(buffer):
+    buf, fake = buffer
+
+    async def run():
+        docs = [_msg(f"chat_{i % 3}", f"m{i}", f"2026-01-01T00:00:{i:02d}") for i in range(30)]
+        await asyncio.gather(*(buf.add_message(d) for d in docs))
+        return docs
+
+    docs = asyncio.run(run())
+    assert all("_id" in d for d in docs)
+    assert len(fake.chat_messages.inserts) == 1 and len(fake.chat_messages.inserts[0]) == 30
+    assert len(fake.chat_sessions.bulk) == 1
+    sessions = {op._filter["chatId"]: op._doc["$set"]["lastMessage"] for op in fake.chat_sessions.bulk[0]}
+    assert sessions == {"chat_0": "m27", "chat_1": "m28", "chat_2": "m29"}
+
+
+def test_read_receipts_coalesced_and_rate_limited(buffer):
+    buf, fake = buffer
+
+    async def run():
+        first = [buf.mark_read("chat_1", "admin") for _ in range(20)]
+        await asyncio.sleep(0.06)
+        second = buf.mark_read("chat_1", "admin")  # inside the interval: held back
+        await asyncio.sleep(0.06)
+        writes_before_interval = sum(len(b) for b in fake.chat_messages.bulk)
+        await asyncio.sleep(0.25)
+        return first, second, writes_before_interval
+
+    first, second, writes_before_interval = asyncio.run(run())
+    assert first[0] is True and not any(first[1:])
+    assert second is True
+    assert writes_before_interval == 1
+    assert sum(len(b) for b in fake.chat_messages.bulk) == 2
@@ -0,0 +1,122 @@
+"""
+Pooled async SMTP sender against a local aiosmtpd stand-in.
+No app server or database needed: the sender is exercised directly.
+"""
+import asyncio
+import socket
+
+import pytest
+
+pytest.importorskip("aiosmtplib")
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+from services.email_sender import EmailDeliveryError, SmtpSender  # noqa: E402
+
+
+class _Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("nobody@"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def _free_port() -> int:
+    # aiosmtpd's Controller can't bind port 0 (its readiness check connects to the given port)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = _Inbox()
+    controller = aiosmtpd_controller.Controller(inbox, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    yield controller, inbox
+    controller.stop()
+
+
+def _sender(controller) -> SmtpSender:
+    return SmtpSender(controller.hostname, controller.port, "orders@test.local", start_tls=False)
+
+
+def test_batch_sent_over_one_connection(smtp_server):
+    controller, inbox = smtp_server
+
+    async def run():
+        sender = _sender(controller)
+        try:
+            results = await asyncio.gather(*(
+                sender.send(f"user{i}@test.local", f"Order {i}", f"<p>Order {i}</p>") for i in range(5)
+            ))
+        finally:
+            await sender.stop()
+        return sender, results
+
+    sender, results = asyncio.run(run())
+    assert results == [True] * 5
+    assert len(inbox.messages) == 5
+    assert sender.stats["connects"] == 1
+    assert sender.stats["sent"] == 5
+    assert {m.rcpt_tos[0] for m in inbox.messages} == {f"user{i}@test.local" for i in range(5)}
+
+
+def test_reconnects_after_server_drops_connection(smtp_server):
+    controller, inbox = smtp_server
+
+    async def run():
+        sender = _sender(controller)
+        try:
+            assert await sender.send("a@test.local", "First", "<p>1</p>")
+            # Simulate the server closing an idle session
+            sender._smtp.close()
+            assert await sender.send("b@test.local", "Second", "<p>2</p>")
+        finally:
+            await sender.stop()
+        return sender
+
+    sender = asyncio.run(run())
+    assert len(inbox.messages) == 2
+    assert sender.stats["connects"] == 2
+
+
+def test_full_queue_defers_instead_of_blocking(smtp_server):
+    controller, _ = smtp_server
+
+    async def run():
+        sender = SmtpSender("127.0.0.1", 1, "orders@test.local", start_tls=False, queue_size=1)
+        sender.queue.put_nowait(("placeholder", asyncio.get_running_loop().create_future()))
+        sender.start = lambda: None  # keep the writer idle so the queue stays full
+        return await sender.send("c@test.local", "Dropped", "<p>x</p>"), sender
+
+    ok, sender = asyncio.run(run())
+    assert ok is False
+    assert sender.stats["rejectedQueueFull"] == 1
+
+
+def test_refused_recipient_fails_permanently_without_retry(smtp_server):
+    controller, inbox = smtp_server
+
+    async def run():
+        sender = _sender(controller)
+        try:
+            with pytest.raises(EmailDeliveryError) as refused:
+                await sender.deliver("nobody@test.local", "Bounce", "<p>x</p>")
+            await sender.deliver("d@test.local", "Next", "<p>y</p>")
+        finally:
+            await sender.stop()
+        return sender, refused.value
+
+    sender, error = asyncio.run(run())
+    assert error.transient is False
+    assert sender.stats["retries"] == 0
+    assert sender.stats["failed"] == 1
+    assert [m.rcpt_tos for m in inbox.messages] == [["d@test.local"]]
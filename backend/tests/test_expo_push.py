@@ -0,0 +1,64 @@
+"""
+Expo push batcher against a local HTTP stand-in for the Expo push API.
+Tickets are returned without ids and without errors, so no database writes happen.
+"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+
+pytestmark = pytest.mark.backend
+
+
+class _ExpoStandIn(BaseHTTPRequestHandler):
+    chunk_sizes: list = []
+
+    def do_POST(self):
+        messages = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        _ExpoStandIn.chunk_sizes.append(len(messages))
+        body = json.dumps({"data": [{"status": "ok"} for _ in messages]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def expo_stand_in(monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), _ExpoStandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _ExpoStandIn.chunk_sizes = []
+    from services import expo_push
+    monkeypatch.setattr(expo_push, "EXPO_API_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    yield expo_push
+    server.shutdown()
+
+
+def test_concurrent_callers_share_100_message_chunks(expo_stand_in):
+    expo_push = expo_stand_in
+    from services.http_client import close_http_client
+
+    async def run():
+        batcher = expo_push.ExpoBatcher(window=0.2)
+        try:
+            # 25 users × 10 devices arriving within one window
+            return await asyncio.gather(*(
+                batcher.send([{"to": f"ExponentPushToken[{u}-{d}]", "title": "t", "body": "b"} for d in range(10)])
+                for u in range(25)
+            ))
+        finally:
+            await close_http_client()
+
+    results = asyncio.run(run())
+    assert all(len(tickets) == 10 for tickets in results)
+    assert all(t["status"] == "ok" for tickets in results for t in tickets)
+    assert sorted(_ExpoStandIn.chunk_sizes) == [50, 100, 100]
@@ -574,8 +574,29 @@ class TestOrders:
     def test_list_orders_own(self, session, user_headers):
         resp = session.get(f"{BASE_URL}/api/orders", headers=user_headers)
         assert resp.status_code == 200
-        assert isinstance(resp.json(), list)
-        print(f"  PASS list orders: {len(resp.json())}")
+        page = resp.json()
+        assert isinstance(page["orders"], list)
+        for o in page["orders"]:
+            assert set(o.keys()) >= {"id", "status", "total", "createdAt", "itemCount"}
+            assert "items" not in o
+        print(f"  PASS list orders: {len(page['orders'])}")
+
+    def test_list_orders_cursor_pagination(self, session, user_headers):
+        """limit=1 pages walk newest-first without repeats."""
+        seen = []
+        cursor = None
+        for _ in range(3):
+            params = {"limit": 1, **({"cursor": cursor} if cursor else {})}
+            page = session.get(f"{BASE_URL}/api/orders", headers=user_headers, params=params).json()
+            assert len(page["orders"]) <= 1
+            seen.extend(o["id"] for o in page["orders"])
+            cursor = page["nextCursor"]
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen))
+        bad = session.get(f"{BASE_URL}/api/orders", headers=user_headers, params={"cursor": "nope"})
+        assert bad.status_code == 400
+        print(f"  PASS order cursor pagination: {len(seen)} orders walked")
 
     def test_list_orders_no_auth(self, session):
         """CONTRACT DEVIATION: 403 instead of 401 for missing token."""
@@ -616,6 +637,23 @@ class TestOrders:
         assert resp.status_code == 400
         print(f"  PASS cancel already-cancelled 400")
 
+    def test_cancelled_order_status_transition_rejected(self, session, admin_headers):
+        """State machine: Cancelled is terminal; re-sending the same status is a no-op."""
+        oid = _order_state.get("user_pending_id")
+        if not oid:
+            pytest.skip("No order created")
+        resp = session.patch(f"{BASE_URL}/api/admin/orders/{oid}/status",
+                             headers=admin_headers, json={"status": "Paid"})
+        assert resp.status_code == 400, resp.text
+        same = session.patch(f"{BASE_URL}/api/admin/orders/{oid}/status",
+                             headers=admin_headers, json={"status": "Cancelled"})
+        assert same.status_code == 200
+        assert same.json()["message"] == "Order status unchanged"
+        bogus = session.patch(f"{BASE_URL}/api/admin/orders/{oid}/status",
+                              headers=admin_headers, json={"status": "Shipped"})
+        assert bogus.status_code == 400
+        print(f"  PASS Cancelled → Paid 400, Cancelled → Cancelled no-op, unknown status 400")
+
     def test_create_order_missing_fields(self, session, user_headers):
         """Missing required fields → 422."""
         resp = session.post(f"{BASE_URL}/api/orders", headers=user_headers, json={
@@ -644,6 +682,73 @@ class TestOrders:
         assert resp.status_code in (404, 409)
         print(f"  PASS nonexistent product: {resp.status_code}")
 
+    def test_create_order_rejects_tampered_price(self, session, user_headers, sample_product):
+        """Line price must match the catalog → 409 (stale or tampered cart)."""
+        resp = session.post(f"{BASE_URL}/api/orders", headers=user_headers, json={
+            "items": [{"productId": sample_product["id"], "quantity": 1,
+                       "name": sample_product["name"], "price": 0.01}],
+            "total": 0.01, "pickupTime": "Now", "paymentMethod": "Zelle",
+        })
+        assert resp.status_code == 409, resp.text
+        print(f"  PASS tampered price rejected")
+
+    def test_create_order_rejects_underpaid_total(self, session, user_headers, sample_product):
+        """Submitted total below catalog subtotal (no discounts) → 400."""
+        if sample_product["price"] < 1:
+            pytest.skip("Sample product too cheap to undercut")
+        resp = session.post(f"{BASE_URL}/api/orders", headers=user_headers, json={
+            "items": [{"productId": sample_product["id"], "quantity": 1,
+                       "name": sample_product["name"], "price": sample_product["price"]}],
+            "total": 0.5, "pickupTime": "Now", "paymentMethod": "Zelle",
+        })
+        assert resp.status_code == 400, resp.text
+        print(f"  PASS underpaid total rejected")
+
+    def test_create_order_idempotency_key_replays(self, session, user_headers, sample_product):
+        """Same Idempotency-Key + body → same order; different body → 422."""
+        key = f"contract-{uuid.uuid4().hex}"
+        body = {
+            "items": [{"productId": sample_product["id"], "quantity": 1,
+                       "name": sample_product["name"], "price": sample_product["price"]}],
+            "total": sample_product["price"], "pickupTime": "IdempotencyTest", "paymentMethod": "Zelle",
+        }
+        headers = {**user_headers, "Idempotency-Key": key}
+        first = session.post(f"{BASE_URL}/api/orders", headers=headers, json=body)
+        if first.status_code == 409:
+            pytest.skip("Sample product out of stock")
+        assert first.status_code == 200, first.text
+        retry = session.post(f"{BASE_URL}/api/orders", headers=headers, json=body)
+        assert retry.status_code == 200, retry.text
+        assert retry.json()["id"] == first.json()["id"]
+
+        changed = session.post(f"{BASE_URL}/api/orders", headers=headers,
+                               json={**body, "pickupTime": "Different"})
+        assert changed.status_code == 422
+        session.post(f"{BASE_URL}/api/orders/{first.json()['id']}/cancel", headers=user_headers)
+        print(f"  PASS idempotent replay returned order {first.json()['id']}")
+
+    def test_pending_order_holds_then_releases_stock(self, session, user_headers, sample_product):
+        """Pending-payment order reserves stock (on-hand unchanged); cancelling returns it."""
+        pid = sample_product["id"]
+        before = session.get(f"{BASE_URL}/api/products/{pid}").json()
+        resp = session.post(f"{BASE_URL}/api/orders", headers=user_headers, json={
+            "items": [{"productId": pid, "quantity": 1,
+                       "name": sample_product["name"], "price": sample_product["price"]}],
+            "total": sample_product["price"], "pickupTime": "ReservationTest", "paymentMethod": "Zelle",
+        })
+        if resp.status_code == 409:
+            pytest.skip("Sample product out of stock")
+        assert resp.status_code == 200, resp.text
+        held = session.get(f"{BASE_URL}/api/products/{pid}").json()
+        assert held["stock"] == before["stock"]
+        assert held["reservedStock"] == before["reservedStock"] + 1
+        assert held["availableStock"] == before["availableStock"] - 1
+
+        session.post(f"{BASE_URL}/api/orders/{resp.json()['id']}/cancel", headers=user_headers)
+        after = session.get(f"{BASE_URL}/api/products/{pid}").json()
+        assert after["availableStock"] == before["availableStock"]
+        print(f"  PASS reservation held and released for {pid}")
+
     def test_create_order_store_credit_capped(self, session, admin_headers, sample_product):
         """storeCreditApplied capped at available balance."""
         me = session.get(f"{BASE_URL}/api/auth/me", headers=admin_headers).json()
@@ -1005,6 +1110,59 @@ class TestAdminOrders:
         assert resp.status_code == 403
         print(f"  PASS admin orders non-admin 403")
 
+    def test_order_expiry_stats(self, session, admin_headers):
+        resp = session.get(f"{BASE_URL}/api/admin/orders/expiry/stats", headers=admin_headers)
+        assert resp.status_code == 200
+        data = resp.json()
+        for key in ("runs", "ordersExpired", "unitsRestored", "lastDurationMs", "worker", "leaseOwner"):
+            assert key in data
+        print(f"  PASS order expiry stats: runs={data['runs']} leader={data['leaseOwner']}")
+
+    def test_push_campaign_lifecycle(self, session, admin_headers, user_headers):
+        """Create a segmented campaign, read its progress, reject bad segments and non-admins."""
+        bad = session.post(f"{BASE_URL}/api/admin/push/campaigns", headers=admin_headers,
+                           json={"title": "Hi", "body": "Test", "segment": "tier", "tierId": "nope"})
+        assert bad.status_code == 400
+        assert session.post(f"{BASE_URL}/api/admin/push/campaigns", headers=user_headers,
+                            json={"title": "Hi", "body": "Test", "segment": "all"}).status_code == 403
+
+        resp = session.post(f"{BASE_URL}/api/admin/push/campaigns", headers=admin_headers, json={
+            "title": "TEST campaign", "body": "Contract test broadcast",
+            "segment": "inactive", "inactiveDays": 365, "channels": ["web_push"],
+        })
+        assert resp.status_code == 200, resp.text
+        campaign = resp.json()
+        assert campaign["status"] in ("queued", "running", "completed")
+        assert "users" in campaign["progress"]
+
+        got = session.get(f"{BASE_URL}/api/admin/push/campaigns/{campaign['id']}", headers=admin_headers)
+        assert got.status_code == 200
+        assert got.json()["segment"] == {"type": "inactive", "inactiveDays": 365}
+        listed = session.get(f"{BASE_URL}/api/admin/push/campaigns", headers=admin_headers).json()
+        assert any(c["id"] == campaign["id"] for c in listed)
+        print(f"  PASS push campaign {campaign['id']} status={got.json()['status']}")
+
+    def test_notification_outbox_stats(self, session, admin_headers, user_headers):
+        resp = session.get(f"{BASE_URL}/api/admin/notifications/outbox/stats", headers=admin_headers)
+        assert resp.status_code == 200
+        data = resp.json()
+        for key in ("sent", "retried", "failed", "coalesced", "queue", "oldestPendingSeconds", "worker"):
+            assert key in data
+        assert session.get(f"{BASE_URL}/api/admin/notifications/outbox/stats",
+                           headers=user_headers).status_code == 403
+        print(f"  PASS outbox stats: sent={data['sent']} queue={data['queue']}")
+
+    def test_admin_jobs_status(self, session, admin_headers, user_headers):
+        resp = session.get(f"{BASE_URL}/api/admin/jobs", headers=admin_headers)
+        assert resp.status_code == 200
+        jobs = {j["name"]: j for j in resp.json()["jobs"]}
+        for name in ("order_expiry", "stock_reservation_release", "order_events", "notification_outbox",
+                     "leaderboard_snapshot"):
+            assert name in jobs
+            assert "lastRunAt" in jobs[name] and "lastDurationMs" in jobs[name] and "owner" in jobs[name]
+        assert session.get(f"{BASE_URL}/api/admin/jobs", headers=user_headers).status_code == 403
+        print(f"  PASS admin jobs: {sorted(jobs)}")
+
     def test_admin_update_order_status_to_paid(self, session, admin_headers, user_headers, sample_product):
         """Create order, mark Paid → loyalty points earned."""
         # Check user's points before
@@ -1032,6 +1190,37 @@ class TestAdminOrders:
         _admin_order_state["order_total"] = order_total
         print(f"  PASS admin order → Paid: order_total={order_total}")
 
+    def test_admin_bulk_order_status(self, session, admin_headers, user_headers, sample_product):
+        """Bulk status: valid orders move, terminal / unknown ids get per-order errors."""
+        resp = session.post(f"{BASE_URL}/api/orders", headers=user_headers, json={
+            "items": [{"productId": sample_product["id"], "quantity": 1,
+                       "name": sample_product["name"], "price": sample_product["price"]}],
+            "total": sample_product["price"],
+            "pickupTime": "Bulk status test",
+            "paymentMethod": "Zelle",
+        })
+        assert resp.status_code == 200, resp.text
+        oid = resp.json()["id"]
+        cancelled_id = _order_state.get("user_pending_id")
+        ids = [oid, "not-an-id", "0" * 24] + ([cancelled_id] if cancelled_id else [])
+
+        bulk = session.post(f"{BASE_URL}/api/admin/orders/bulk-status", headers=admin_headers,
+                            json={"orderIds": ids, "status": "Ready for Pickup"})
+        assert bulk.status_code == 200, bulk.text
+        body = bulk.json()
+        results = {r["orderId"]: r for r in body["results"]}
+        assert body["updated"] == 1
+        assert results[oid]["ok"] is True and results[oid]["previousStatus"] == "Pending Payment"
+        assert results["not-an-id"]["ok"] is False
+        assert results["0" * 24]["error"] == "Order not found"
+        if cancelled_id:
+            assert results[cancelled_id]["ok"] is False
+        order = session.get(f"{BASE_URL}/api/orders/{oid}", headers=user_headers).json()
+        assert order["status"] == "Ready for Pickup"
+        assert session.post(f"{BASE_URL}/api/admin/orders/bulk-status", headers=user_headers,
+                            json={"orderIds": [oid], "status": "Completed"}).status_code == 403
+        print(f"  PASS bulk status: {body['updated']} updated, per-order errors reported")
+
     def test_loyalty_points_earned_on_paid(self, session, user_headers):
         """User earns total*3 points when order is marked Paid."""
         if "pts_before" not in _admin_order_state:
@@ -1187,6 +1376,21 @@ class TestReviews:
         assert resp.status_code == 401
         print(f"  ACTUAL {resp.status_code} (contract says 401)")
 
+    def test_product_rating_summary_matches_reviews(self, session, sample_product):
+        """Catalog rating aggregates agree with the visible review list."""
+        pid = sample_product["id"]
+        product = session.get(f"{BASE_URL}/api/products/{pid}").json()
+        reviews = session.get(f"{BASE_URL}/api/reviews/product/{pid}").json()
+        assert product["ratingCount"] == len(reviews)
+        assert set(product["ratingHistogram"].keys()) == {"1", "2", "3", "4", "5"}
+        assert sum(product["ratingHistogram"].values()) == product["ratingCount"]
+        if reviews:
+            expected = round(sum(r["rating"] for r in reviews) / len(reviews), 2)
+            assert abs(product["ratingAverage"] - expected) < 0.01
+        else:
+            assert product["ratingAverage"] is None
+        print(f"  PASS rating summary: {product['ratingCount']} reviews avg={product['ratingAverage']}")
+
 
 # ─────────────────────────────────────────────────────────────────
 # PUSH & SUPPORT
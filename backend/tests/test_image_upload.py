@@ -9,6 +9,8 @@ import requests
 import os
 from pathlib import Path
 import io
+import struct
+import zlib
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://api.clouddistrict.club')
 BASE_URL = BASE_URL.rstrip('/')
@@ -120,6 +122,58 @@ class TestImageUploadEndpoint:
         assert response.status_code == 400, f"Expected 400 for invalid file type, got {response.status_code}"
         print(f"PASS: Invalid file type rejected with 400")
 
+    def test_upload_rejects_oversized_file(self, admin_client):
+        """Streamed upload is cut off once it passes 5MB"""
+        big = b'\x89PNG\r\n\x1a\n' + b'\x00' * (5 * 1024 * 1024 + 1)
+        files = {'file': ('big.png', io.BytesIO(big), 'image/png')}
+        response = admin_client.post(f"{BASE_URL}/api/upload/product-image", files=files)
+        assert response.status_code == 400, f"Expected 400 for oversized upload, got {response.status_code}"
+        assert "too large" in response.json().get("detail", "").lower()
+        print("PASS: Oversized upload rejected with 400")
+
+
+def _png_bytes(width: int, height: int) -> bytes:
+    """Build a solid-colour RGB PNG without needing Pillow on the test runner."""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    row = b"\x00" + b"\x2e\x6b\xff" * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+class TestImageDerivatives:
+    """Resized WebP derivatives + content-hash dedup for uploads"""
+
+    def test_upload_returns_derivative_urls(self, admin_client):
+        png = _png_bytes(1600, 900)
+        files = {'file': ('wide.png', io.BytesIO(png), 'image/png')}
+        response = admin_client.post(f"{BASE_URL}/api/upload/product-image", files=files)
+        assert response.status_code == 200, f"Upload failed: {response.text}"
+        variants = response.json().get("variants")
+        assert variants, f"Upload response missing variants: {response.json()}"
+        for size in ("thumb", "card", "detail"):
+            webp_url = variants[size]["webp"]
+            assert webp_url.startswith("/api/uploads/products/") and webp_url.endswith(".webp")
+            file_response = requests.get(f"{BASE_URL}{webp_url}")
+            assert file_response.status_code == 200, f"Derivative not served: {webp_url}"
+            assert "image/webp" in file_response.headers.get("content-type", "")
+        print(f"PASS: derivatives returned: {variants}")
+
+    def test_same_content_dedups_to_same_url(self, admin_client):
+        png = _png_bytes(64, 64)
+        urls = []
+        for name in ("first.png", "second.png"):
+            files = {'file': (name, io.BytesIO(png), 'image/png')}
+            response = admin_client.post(f"{BASE_URL}/api/upload/product-image", files=files)
+            assert response.status_code == 200
+            urls.append(response.json()["url"])
+        assert urls[0] == urls[1], f"Identical uploads should share one file: {urls}"
+        print(f"PASS: identical uploads deduped to {urls[0]}")
+
 
 class TestStaticFileServing:
     """Test /api/uploads/products/ static file serving"""
@@ -165,6 +219,36 @@ class TestStaticFileServing:
         
         pytest.skip("No JPEG migrated images found")
 
+    def _any_upload_url(self):
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        for p in products:
+            if p.get("image", "").startswith("/api/uploads/products/"):
+                return f"{BASE_URL}{p['image']}"
+        pytest.skip("No uploaded images found")
+
+    def test_uploads_are_immutable_cached(self):
+        """Upload filenames never change once written — served with a 1-year immutable Cache-Control"""
+        image_response = requests.get(self._any_upload_url())
+        assert image_response.status_code == 200
+        cache_control = image_response.headers.get("cache-control", "")
+        assert "immutable" in cache_control and "max-age=31536000" in cache_control, cache_control
+        print(f"PASS: Cache-Control is {cache_control}")
+
+    def test_conditional_request_returns_304(self):
+        url = self._any_upload_url()
+        etag = requests.get(url).headers.get("etag")
+        assert etag, "Upload response missing ETag"
+        response = requests.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304, f"Expected 304, got {response.status_code}"
+        print("PASS: If-None-Match returns 304")
+
+    def test_range_request_returns_partial_content(self):
+        response = requests.get(self._any_upload_url(), headers={"Range": "bytes=0-15"})
+        assert response.status_code == 206, f"Expected 206, got {response.status_code}"
+        assert len(response.content) == 16
+        assert response.headers.get("content-range", "").startswith("bytes 0-15/")
+        print(f"PASS: Range served {response.headers['content-range']}")
+
 
 class TestMigrationVerification:
     """Verify base64 to file migration ran correctly"""
@@ -214,6 +298,30 @@ class TestMigrationVerification:
         print(f"PASS: Invalid base64 product correctly skipped during migration")
 
 
+class TestImageMigrationJob:
+    """Background base64 → file migration job controls"""
+
+    def test_status_requires_admin(self):
+        response = requests.get(f"{BASE_URL}/api/admin/migrations/images")
+        assert response.status_code in [401, 403]
+
+    def test_status_reports_checkpoint(self, admin_client):
+        response = admin_client.get(f"{BASE_URL}/api/admin/migrations/images")
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["state"] in ("idle", "running", "paused", "completed", "failed")
+        assert data["catalogSteps"] > 0
+        print(f"PASS: migration status {data['state']}")
+
+    def test_pause_is_noop_when_not_running(self, admin_client):
+        status = admin_client.get(f"{BASE_URL}/api/admin/migrations/images").json()
+        if status["state"] == "running":
+            pytest.skip("Migration currently running — not pausing a live job from tests")
+        response = admin_client.post(f"{BASE_URL}/api/admin/migrations/images/pause")
+        assert response.status_code == 200
+        assert response.json()["state"] == status["state"]
+
+
 class TestProductAPIWithUploadedImages:
     """Test product CRUD with uploaded images"""
 
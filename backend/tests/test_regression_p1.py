@@ -311,8 +311,9 @@ class TestOrdersEndpoint:
         response = requests.get(f"{BASE_URL}/api/orders", headers=headers)
         assert response.status_code == 200
         data = response.json()
-        assert isinstance(data, list)
-        print(f"✓ Orders endpoint returns array with {len(data)} orders")
+        assert isinstance(data["orders"], list)
+        assert "nextCursor" in data
+        print(f"✓ Orders endpoint returns a page with {len(data['orders'])} orders")
 
 
 class TestLeaderboard:
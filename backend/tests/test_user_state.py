@@ -0,0 +1,80 @@
+"""
+User-state cache: coalesced lookups for reconnect storms, and revocation closing open sockets.
+The users collection is replaced with an in-memory stand-in; no database is needed.
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("jwt")
+pytest.importorskip("passlib")
+
+pytestmark = pytest.mark.backend
+
+
+class _Users:
+    def __init__(self, docs):
+        self.docs = {d["_id"]: d for d in docs}
+        self.queries = 0
+
+    def find(self, query, projection=None):
+        self.queries += 1
+        ids = query["_id"]["$in"]
+        docs = [self.docs[i] for i in ids if i in self.docs]
+
+        async def _iter():
+            for d in docs:
+                yield dict(d)
+        return _iter()
+
+
+class _FakeDb:
+    def __init__(self, users):
+        self.users = users
+
+
+@pytest.fixture
+def env(monkeypatch):
+    from bson import ObjectId
+    from services import chat_connections, user_state
+    users = _Users([{"_id": ObjectId(), "email": f"u{i}@example.com"} for i in range(300)])
+    monkeypatch.setattr(user_state, "db", _FakeDb(users))
+    manager = chat_connections.ConnectionManager()
+    monkeypatch.setattr(user_state, "chat_manager", manager)
+    return user_state, users, manager
+
+
+def test_reconnect_storm_coalesces_lookups(env):
+    user_state, users, _ = env
+    cache = user_state.UserStateCache(window=0.05)
+    ids = [str(i) for i in users.docs]
+
+    async def run():
+        # Every user reconnects twice at once
+        return await asyncio.gather(*(cache.get(uid) for uid in ids + ids))
+
+    states = asyncio.run(run())
+    assert all(s is not None for s in states)
+    assert users.queries == 1
+    asyncio.run(cache.get(ids[0]))
+    assert users.queries == 1  # served from cache
+
+
+def test_disable_closes_open_sockets(env, fake_socket):
+    user_state, users, manager = env
+    cache = user_state.UserStateCache()
+    target = next(iter(users.docs.values()))
+
+    async def run():
+        await manager.backplane.start(manager.deliver_local)
+        manager.subscribe(user_state.USER_STATE_CHANNEL, cache._on_change)
+        sock = fake_socket()
+        conn = await manager.connect("chat_x", sock)
+        conn.user_id = str(target["_id"])
+        target["isDisabled"] = True
+        await manager.broadcast(user_state.USER_STATE_CHANNEL, {"userId": conn.user_id})
+        return sock
+
+    sock = asyncio.run(run())
+    assert sock.closed_with == user_state.REVOKED_CLOSE_CODE
+    assert manager.all_connections() == []
@@ -1,31 +1,34 @@
 import { View, Text, StyleSheet, ScrollView, TouchableOpacity, RefreshControl } from 'react-native';
 import { useState, useEffect } from 'react';
+import { useRouter } from 'expo-router';
 import { Ionicons } from '@expo/vector-icons';
 import AppHeader from '../../components/AppHeader';
 import axios from 'axios';
 import { API_URL } from '../../constants/api';
 
-interface Order {
+// List rows are summaries; tapping one opens /order-detail for items, pickup and payment
+interface OrderSummary {
   id: string;
-  items: any[];
   total: number;
-  pickupTime: string;
-  paymentMethod: string;
   status: string;
   createdAt: string;
-  loyaltyPointsEarned: number;
-  loyaltyPointsUsed: number;
+  itemCount: number;
+  reviewPromptEligible: boolean;
 }
 
 export default function Orders() {
-  const [orders, setOrders] = useState<Order[]>([]);
+  const router = useRouter();
+  const [orders, setOrders] = useState<OrderSummary[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [refreshing, setRefreshing] = useState(false);
 
   const loadOrders = async () => {
     try {
       const response = await axios.get(`${API_URL}/api/orders`);
-      setOrders(response.data);
+      setOrders(response.data.orders);
+      setNextCursor(response.data.nextCursor);
     } catch (error) {
       console.error('Failed to load orders:', error);
     } finally {
@@ -34,6 +37,20 @@ export default function Orders() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API_URL}/api/orders`, { params: { cursor: nextCursor } });
+      setOrders(prev => [...prev, ...response.data.orders]);
+      setNextCursor(response.data.nextCursor);
+    } catch (error) {
+      console.error('Failed to load more orders:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     loadOrders();
   }, []);
@@ -84,7 +101,12 @@ export default function Orders() {
           </View>
         ) : (
           orders.map((order) => (
-            <View key={order.id} style={styles.orderCard}>
+            <TouchableOpacity
+              key={order.id}
+              style={styles.orderCard}
+              onPress={() => router.push(`/order-detail?id=${order.id}`)}
+              activeOpacity={0.85}
+            >
               <View style={styles.orderHeader}>
                 <View>
                   <Text style={styles.orderDate}>
@@ -104,18 +126,12 @@ export default function Orders() {
                 </View>
               </View>
 
-              <View style={styles.orderItems}>
-                {order.items.map((item, index) => (
-                  <Text key={index} style={styles.itemText}>
-                    {item.quantity}x {item.name}
-                  </Text>
-                ))}
-              </View>
-
               <View style={styles.orderFooter}>
                 <View>
-                  <Text style={styles.pickupLabel}>Pickup Time</Text>
-                  <Text style={styles.pickupTime}>{order.pickupTime}</Text>
+                  <Text style={styles.pickupLabel}>Items</Text>
+                  <Text style={styles.pickupTime}>
+                    {order.itemCount} {order.itemCount === 1 ? 'item' : 'items'}
+                  </Text>
                 </View>
                 <View style={styles.orderTotal}>
                   <Text style={styles.totalLabel}>Total</Text>
@@ -124,12 +140,24 @@ export default function Orders() {
               </View>
 
               <View style={styles.paymentInfo}>
-                <Ionicons name="card" size={14} color="#666" />
-                <Text style={styles.paymentText}>{order.paymentMethod}</Text>
+                {order.reviewPromptEligible ? (
+                  <>
+                    <Ionicons name="star" size={14} color="#fbbf24" />
+                    <Text style={styles.paymentText}>Leave a review</Text>
+                  </>
+                ) : (
+                  <Text style={styles.paymentText}>View details</Text>
+                )}
+                <Ionicons name="chevron-forward" size={14} color="#666" />
               </View>
-            </View>
+            </TouchableOpacity>
           ))
         )}
+        {nextCursor && !loading && (
+          <TouchableOpacity style={styles.loadMore} onPress={loadMore} disabled={loadingMore}>
+            <Text style={styles.loadMoreText}>{loadingMore ? 'Loading...' : 'Load older orders'}</Text>
+          </TouchableOpacity>
+        )}
       </ScrollView>
     </View>
   );
@@ -205,17 +233,6 @@ const styles = StyleSheet.create({
     fontSize: 12,
     fontWeight: '600',
   },
-  orderItems: {
-    marginBottom: 12,
-    paddingBottom: 12,
-    borderBottomWidth: 1,
-    borderBottomColor: '#333',
-  },
-  itemText: {
-    fontSize: 14,
-    color: '#ccc',
-    marginBottom: 4,
-  },
   orderFooter: {
     flexDirection: 'row',
     justifyContent: 'space-between',
@@ -254,4 +271,14 @@ const styles = StyleSheet.create({
     fontSize: 12,
     color: '#666',
   },
+  loadMore: {
+    alignItems: 'center',
+    paddingVertical: 14,
+    marginBottom: 32,
+  },
+  loadMoreText: {
+    fontSize: 14,
+    color: '#2E6BFF',
+    fontWeight: '600',
+  },
 });
\ No newline at end of file
@@ -13,9 +13,11 @@ interface ChatSession {
   lastMessage: string;
   lastMessageAt: string;
   online: boolean;
+  unread?: number;
 }
 
 interface Message {
+  id?: string;
   chatId: string;
   senderId: string;
   senderName: string;
@@ -25,6 +27,15 @@ interface Message {
   readAt?: string;
 }
 
+// Paging cursor for GET /api/chat/messages (?before= / ?since=)
+const messageCursor = (m: Message) => (m.id ? `${m.createdAt}_${m.id}` : m.createdAt);
+
+// Append `more` to `list`, skipping messages already present
+const mergeMessages = (list: Message[], more: Message[]) => {
+  const seen = new Set(list.map(m => m.id).filter(Boolean));
+  return [...list, ...more.filter(m => !m.id || !seen.has(m.id))];
+};
+
 const TypingDots = () => {
   const dot1 = useRef(new Animated.Value(0)).current;
   const dot2 = useRef(new Animated.Value(0)).current;
@@ -67,11 +78,19 @@ export default function AdminChats() {
   const [loading, setLoading] = useState(true);
   const [remoteTyping, setRemoteTyping] = useState(false);
   const [allRead, setAllRead] = useState(false);
+  const [hasEarlier, setHasEarlier] = useState(false);
+  const [loadingEarlier, setLoadingEarlier] = useState(false);
   const wsRef = useRef<WebSocket | null>(null);
   const flatListRef = useRef<FlatList>(null);
-  const pollRef = useRef<ReturnType<typeof setInterval> | null>(null);
+  const inboxWsRef = useRef<WebSocket | null>(null);
+  const inboxRetryRef = useRef<ReturnType<typeof setTimeout> | null>(null);
+  const sessionIdsRef = useRef<Set<string>>(new Set());
   const typingTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
   const lastTypingSentRef = useRef(0);
+  const selectedChatRef = useRef<string | null>(null);
+  const messagesRef = useRef<Message[]>([]);
+  const skipScrollToEndRef = useRef(false);
+  const chatRetryRef = useRef<ReturnType<typeof setTimeout> | null>(null);
 
   const loadSessions = useCallback(async () => {
     try {
@@ -87,34 +106,105 @@ export default function AdminChats() {
   }, [token]);
 
   useEffect(() => {
+    sessionIdsRef.current = new Set(sessions.map(s => s.chatId));
+  }, [sessions]);
+
+  // Live inbox updates replace polling
+  useEffect(() => {
+    let active = true;
+    let connectedBefore = false;
+    const connectInbox = () => {
+      if (!token || !active) return;
+      const wsUrl = API_URL?.replace('https://', 'wss://').replace('http://', 'ws://');
+      const ws = new WebSocket(`${wsUrl}/api/ws/admin/inbox?token=${token}&heartbeat=1`);
+      ws.onopen = () => {
+        if (connectedBefore) loadSessions();  // catch up on what was missed while disconnected
+        connectedBefore = true;
+      };
+      ws.onmessage = (e) => {
+        try {
+          const data = JSON.parse(e.data);
+          if (data.type === 'ping') {
+            ws.send(JSON.stringify({ type: 'pong' }));
+            return;
+          }
+          if (!sessionIdsRef.current.has(data.chatId)) {
+            if (data.type === 'chat_updated') loadSessions();  // new conversation
+            return;
+          }
+          setSessions(prev => {
+            const current = prev.find(s => s.chatId === data.chatId);
+            if (!current) return prev;
+            if (data.type === 'presence') {
+              return prev.map(s => s.chatId === data.chatId ? { ...s, online: data.online } : s);
+            }
+            if (data.type === 'chat_read') {
+              return prev.map(s => s.chatId === data.chatId ? { ...s, unread: 0 } : s);
+            }
+            if (data.type === 'chat_updated') {
+              const updated = {
+                ...current,
+                lastMessage: data.lastMessage,
+                lastMessageAt: data.lastMessageAt,
+                unread: data.isAdmin ? current.unread : (current.unread || 0) + 1,
+              };
+              return [updated, ...prev.filter(s => s.chatId !== data.chatId)];
+            }
+            return prev;
+          });
+        } catch {}
+      };
+      ws.onclose = () => {
+        if (active) inboxRetryRef.current = setTimeout(connectInbox, 5000);
+      };
+      inboxWsRef.current = ws;
+    };
     loadSessions();
-    pollRef.current = setInterval(loadSessions, 10000);
-    return () => { if (pollRef.current) clearInterval(pollRef.current); };
-  }, [loadSessions]);
+    connectInbox();
+    return () => {
+      active = false;
+      if (inboxRetryRef.current) clearTimeout(inboxRetryRef.current);
+      inboxWsRef.current?.close();
+    };
+  }, [loadSessions, token]);
 
-  const openChat = useCallback(async (chatId: string) => {
-    setSelectedChat(chatId);
-    setRemoteTyping(false);
-    setAllRead(false);
+  useEffect(() => { messagesRef.current = messages; }, [messages]);
+
+  // After a reconnect, fetch only what arrived while the socket was down
+  const catchUp = useCallback(async (chatId: string) => {
+    let last = messagesRef.current[messagesRef.current.length - 1];
     try {
-      const res = await axios.get(`${API_URL}/api/chat/messages/${chatId}`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      setMessages(res.data);
+      while (last && selectedChatRef.current === chatId) {
+        const res = await axios.get(`${API_URL}/api/chat/messages/${chatId}`, {
+          params: { since: messageCursor(last), limit: 200 },
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        if (res.data.length === 0 || selectedChatRef.current !== chatId) break;
+        skipScrollToEndRef.current = false;
+        setMessages(prev => mergeMessages(prev, res.data));
+        if (res.headers['x-has-more'] !== 'true') break;
+        last = res.data[res.data.length - 1];
+      }
     } catch (e) {
-      console.error('Failed to load messages:', e);
+      console.error('Failed to catch up on messages:', e);
     }
+  }, [token]);
 
-    // Connect WebSocket
+  const connectChat = useCallback((chatId: string, reconnect = false) => {
     wsRef.current?.close();
     const wsUrl = API_URL?.replace('https://', 'wss://').replace('http://', 'ws://');
-    const ws = new WebSocket(`${wsUrl}/api/ws/chat/${chatId}?token=${token}`);
+    const ws = new WebSocket(`${wsUrl}/api/ws/chat/${chatId}?token=${token}&heartbeat=1`);
     ws.onopen = () => {
       ws.send(JSON.stringify({ type: 'read' }));
+      if (reconnect) catchUp(chatId);
     };
     ws.onmessage = (e) => {
       try {
         const data = JSON.parse(e.data);
+        if (data.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
         if (data.type === 'typing') {
           if (data.senderId !== user?.id) {
             setRemoteTyping(data.isTyping);
@@ -132,15 +222,75 @@ export default function AdminChats() {
           return;
         }
         // Regular message
-        setMessages(prev => [...prev, data]);
+        skipScrollToEndRef.current = false;
+        setMessages(prev => mergeMessages(prev, [data]));
         setRemoteTyping(false);
         if (data.senderId !== user?.id) {
           ws.send(JSON.stringify({ type: 'read' }));
         }
       } catch {}
     };
+    ws.onclose = () => {
+      // Reconnect while this chat is still open; the replaced socket's close is ignored
+      if (wsRef.current === ws && selectedChatRef.current === chatId) {
+        chatRetryRef.current = setTimeout(() => {
+          if (selectedChatRef.current === chatId) connectChat(chatId, true);
+        }, 5000);
+      }
+    };
     wsRef.current = ws;
-  }, [token, user?.id]);
+  }, [token, user?.id, catchUp]);
+
+  const closeChat = () => {
+    selectedChatRef.current = null;
+    setSelectedChat(null);
+    if (chatRetryRef.current) clearTimeout(chatRetryRef.current);
+    wsRef.current?.close();
+  };
+
+  const openChat = useCallback(async (chatId: string) => {
+    selectedChatRef.current = chatId;
+    setSelectedChat(chatId);
+    setMessages([]);
+    setHasEarlier(false);
+    setRemoteTyping(false);
+    setAllRead(false);
+    try {
+      const res = await axios.get(`${API_URL}/api/chat/messages/${chatId}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      skipScrollToEndRef.current = false;
+      setMessages(res.data);
+      setHasEarlier(res.headers['x-has-more'] === 'true');
+    } catch (e) {
+      console.error('Failed to load messages:', e);
+    }
+
+    // Connect WebSocket
+    connectChat(chatId);
+  }, [token, connectChat]);
+
+  const loadEarlier = async () => {
+    const chatId = selectedChatRef.current;
+    const first = messagesRef.current[0];
+    if (!chatId || !first || loadingEarlier) return;
+    setLoadingEarlier(true);
+    try {
+      const res = await axios.get(`${API_URL}/api/chat/messages/${chatId}`, {
+        params: { before: messageCursor(first) },
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (selectedChatRef.current === chatId) {
+        skipScrollToEndRef.current = true;
+        setMessages(prev => mergeMessages(res.data, prev));
+        setHasEarlier(res.headers['x-has-more'] === 'true');
+      }
+    } catch (e) {
+      console.error('Failed to load earlier messages:', e);
+    } finally {
+      setLoadingEarlier(false);
+    }
+  };
 
   const emitTyping = (isTyping: boolean) => {
     const now = Date.now();
@@ -166,13 +316,17 @@ export default function AdminChats() {
   };
 
   useEffect(() => {
-    if (messages.length > 0) {
+    if (messages.length > 0 && !skipScrollToEndRef.current) {
       setTimeout(() => flatListRef.current?.scrollToEnd({ animated: true }), 100);
     }
   }, [messages.length]);
 
   useEffect(() => {
-    return () => { wsRef.current?.close(); };
+    return () => {
+      selectedChatRef.current = null;
+      if (chatRetryRef.current) clearTimeout(chatRetryRef.current);
+      wsRef.current?.close();
+    };
   }, []);
 
   if (selectedChat) {
@@ -180,7 +334,7 @@ export default function AdminChats() {
     return (
       <SafeAreaView style={styles.container} edges={['top']}>
         <View style={styles.chatHeader}>
-          <TouchableOpacity onPress={() => { setSelectedChat(null); wsRef.current?.close(); }} data-testid="admin-chat-back">
+          <TouchableOpacity onPress={closeChat} data-testid="admin-chat-back">
             <Ionicons name="arrow-back" size={24} color="#fff" />
           </TouchableOpacity>
           <View style={styles.chatHeaderInfo}>
@@ -222,10 +376,22 @@ export default function AdminChats() {
                 </View>
               );
             }}
-            keyExtractor={(_, i) => String(i)}
+            keyExtractor={(item, i) => item.id || String(i)}
             style={styles.messageList}
             contentContainerStyle={styles.messageListContent}
-            onContentSizeChange={() => flatListRef.current?.scrollToEnd({ animated: false })}
+            onContentSizeChange={() => {
+              if (!skipScrollToEndRef.current) flatListRef.current?.scrollToEnd({ animated: false });
+            }}
+            ListHeaderComponent={hasEarlier ? (
+              <TouchableOpacity
+                style={styles.loadEarlierBtn}
+                onPress={loadEarlier}
+                disabled={loadingEarlier}
+                data-testid="admin-chat-load-earlier"
+              >
+                <Text style={styles.loadEarlierText}>{loadingEarlier ? 'Loading...' : 'Load earlier messages'}</Text>
+              </TouchableOpacity>
+            ) : null}
             ListFooterComponent={remoteTyping ? <TypingDots /> : null}
           />
 
@@ -290,9 +456,16 @@ export default function AdminChats() {
                   <Text style={styles.sessionPreview} numberOfLines={1}>{session.lastMessage}</Text>
                 </View>
               </View>
-              <Text style={styles.sessionTime}>
-                {session.lastMessageAt ? new Date(session.lastMessageAt).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }) : ''}
-              </Text>
+              <View style={styles.sessionRight}>
+                <Text style={styles.sessionTime}>
+                  {session.lastMessageAt ? new Date(session.lastMessageAt).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }) : ''}
+                </Text>
+                {!!session.unread && (
+                  <View style={styles.unreadBadge}>
+                    <Text style={styles.unreadText}>{session.unread}</Text>
+                  </View>
+                )}
+              </View>
             </TouchableOpacity>
           ))}
         </ScrollView>
@@ -317,6 +490,9 @@ const styles = StyleSheet.create({
   sessionName: { color: '#fff', fontSize: 15, fontWeight: '600' },
   sessionPreview: { color: '#888', fontSize: 13, marginTop: 2 },
   sessionTime: { color: '#666', fontSize: 11 },
+  sessionRight: { alignItems: 'flex-end', gap: 6 },
+  unreadBadge: { minWidth: 20, height: 20, borderRadius: 10, paddingHorizontal: 6, backgroundColor: '#2E6BFF', alignItems: 'center', justifyContent: 'center' },
+  unreadText: { color: '#fff', fontSize: 11, fontWeight: '700' },
   chatHeader: { flexDirection: 'row', alignItems: 'center', padding: 16, gap: 12, borderBottomWidth: 1, borderBottomColor: '#1a1a1a' },
   chatHeaderInfo: { flex: 1 },
   chatHeaderName: { color: '#fff', fontSize: 17, fontWeight: '700' },
@@ -326,6 +502,8 @@ const styles = StyleSheet.create({
   onlineLabel: { color: '#888', fontSize: 12 },
   messageList: { flex: 1 },
   messageListContent: { padding: 16, gap: 8 },
+  loadEarlierBtn: { alignSelf: 'center', paddingHorizontal: 14, paddingVertical: 6, borderRadius: 14, backgroundColor: '#1a1a1a', marginBottom: 8 },
+  loadEarlierText: { color: '#888', fontSize: 12, fontWeight: '600' },
   msgRow: { flexDirection: 'row', marginBottom: 4 },
   msgRowRight: { justifyContent: 'flex-end' },
   msgRowLeft: { justifyContent: 'flex-start' },
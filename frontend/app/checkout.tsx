@@ -1,5 +1,5 @@
 import { View, Text, StyleSheet, ScrollView, TouchableOpacity, Alert, ActivityIndicator } from 'react-native';
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useRouter } from 'expo-router';
 import { SafeAreaView } from 'react-native-safe-area-context';
 import { useCartStore } from '../store/cartStore';
@@ -48,6 +48,8 @@ export default function Checkout() {
   const [storeCreditApplied, setStoreCreditApplied] = useState(false);
   const [loading, setLoading] = useState(false);
   const [loadingRewards, setLoadingRewards] = useState(true);
+  // Same key for retries of an unchanged order, so a retry after a timeout can't double-order
+  const idempotencyRef = useRef<{ body: string; key: string } | null>(null);
 
   const authHeaders = { headers: { Authorization: `Bearer ${token}` } };
 
@@ -114,7 +116,16 @@ export default function Checkout() {
         storeCreditApplied: parseFloat(creditDiscount.toFixed(2)),
       };
 
-      const response = await axios.post(`${API_URL}/api/orders`, orderData, authHeaders);
+      const body = JSON.stringify(orderData);
+      if (!idempotencyRef.current || idempotencyRef.current.body !== body) {
+        idempotencyRef.current = {
+          body,
+          key: `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`,
+        };
+      }
+      const response = await axios.post(`${API_URL}/api/orders`, orderData, {
+        headers: { ...authHeaders.headers, 'Idempotency-Key': idempotencyRef.current.key },
+      });
       const orderId = response.data.id;
 
       clearCart();
@@ -25,6 +25,7 @@ interface Product {
   nicotinePercent: number;
   price: number;
   stock: number;
+  availableStock?: number;
 }
 
 export default function ProductDetail() {
@@ -42,7 +43,8 @@ export default function ProductDetail() {
   const loadProduct = async () => {
     try {
       const response = await axios.get(`${API_URL}/api/products/${id}`);
-      setProduct(response.data);
+      // Customers see what's left after pending-payment holds, not on-hand stock
+      setProduct({ ...response.data, stock: response.data.availableStock ?? response.data.stock });
     } catch (error) {
       console.error('Failed to load product:', error);
       Alert.alert('Error', 'Failed to load product');
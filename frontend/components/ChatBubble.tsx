@@ -14,6 +14,7 @@ const MIN_Y = 60;
 const MAX_Y = SCREEN.height - TAB_BAR_HEIGHT - FAB_SIZE - 16;
 
 interface Message {
+  id?: string;
   chatId: string;
   senderId: string;
   senderName: string;
@@ -24,6 +25,15 @@ interface Message {
   type?: string;
 }
 
+// Paging cursor for GET /api/chat/messages (?before= / ?since=)
+const messageCursor = (m: Message) => (m.id ? `${m.createdAt}_${m.id}` : m.createdAt);
+
+// Append `more` to `list`, skipping messages already present
+const mergeMessages = (list: Message[], more: Message[]) => {
+  const seen = new Set(list.map(m => m.id).filter(Boolean));
+  return [...list, ...more.filter(m => !m.id || !seen.has(m.id))];
+};
+
 const TypingDots = () => {
   const dot1 = useRef(new Animated.Value(0)).current;
   const dot2 = useRef(new Animated.Value(0)).current;
@@ -67,12 +77,16 @@ export default function ChatBubble() {
   const [remoteTyping, setRemoteTyping] = useState(false);
   const [allRead, setAllRead] = useState(false);
   const [unreadCount, setUnreadCount] = useState(0);
+  const [hasEarlier, setHasEarlier] = useState(false);
+  const [loadingEarlier, setLoadingEarlier] = useState(false);
   const wsRef = useRef<WebSocket | null>(null);
   const bgWsRef = useRef<WebSocket | null>(null);
   const flatListRef = useRef<FlatList>(null);
   const typingTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
   const lastTypingSentRef = useRef(0);
   const openRef = useRef(false);
+  const messagesRef = useRef<Message[]>([]);
+  const skipScrollToEndRef = useRef(false);
 
   const chatId = user ? `chat_${user.id}` : '';
 
@@ -159,11 +173,15 @@ export default function ChatBubble() {
     if (bgRetryCount.current >= 5) return; // max 5 retries
     bgWsRef.current?.close();
     const wsUrl = API_URL?.replace('https://', 'wss://').replace('http://', 'ws://');
-    const ws = new WebSocket(`${wsUrl}/api/ws/chat/${chatId}?token=${token}`);
+    const ws = new WebSocket(`${wsUrl}/api/ws/chat/${chatId}?token=${token}&heartbeat=1`);
     ws.onopen = () => { bgRetryCount.current = 0; }; // reset on success
     ws.onmessage = (e) => {
       try {
         const data = JSON.parse(e.data);
+        if (data.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
         if (data.type === 'typing' || data.type === 'read') return;
         if (!openRef.current && data.senderId !== user?.id) {
           setUnreadCount(prev => prev + 1);
@@ -192,29 +210,79 @@ export default function ChatBubble() {
     };
   }, [chatId, token, open]);
 
+  useEffect(() => { messagesRef.current = messages; }, [messages]);
+
   const loadHistory = useCallback(async () => {
     if (!chatId || !token) return;
     try {
       const res = await axios.get(`${API_URL}/api/chat/messages/${chatId}`, {
         headers: { Authorization: `Bearer ${token}` },
       });
-      setMessages(res.data);
+      skipScrollToEndRef.current = false;
+      // Keep anything the socket delivered while the page was loading
+      const newest = res.data.length ? res.data[res.data.length - 1].createdAt : '';
+      setMessages(prev => mergeMessages(res.data, prev.filter(m => m.createdAt > newest)));
+      setHasEarlier(res.headers['x-has-more'] === 'true');
     } catch (e) {
       console.error('Load chat history:', e);
     }
   }, [chatId, token]);
 
+  const loadEarlier = async () => {
+    const first = messagesRef.current[0];
+    if (!first || loadingEarlier) return;
+    setLoadingEarlier(true);
+    try {
+      const res = await axios.get(`${API_URL}/api/chat/messages/${chatId}`, {
+        params: { before: messageCursor(first) },
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      skipScrollToEndRef.current = true;
+      setMessages(prev => mergeMessages(res.data, prev));
+      setHasEarlier(res.headers['x-has-more'] === 'true');
+    } catch (e) {
+      console.error('Load earlier messages:', e);
+    } finally {
+      setLoadingEarlier(false);
+    }
+  };
+
+  // After a reconnect, fetch only what arrived while the socket was down
+  const catchUp = useCallback(async () => {
+    let last = messagesRef.current[messagesRef.current.length - 1];
+    try {
+      while (last) {
+        const res = await axios.get(`${API_URL}/api/chat/messages/${chatId}`, {
+          params: { since: messageCursor(last), limit: 200 },
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        if (res.data.length === 0) break;
+        skipScrollToEndRef.current = false;
+        setMessages(prev => mergeMessages(prev, res.data));
+        if (res.headers['x-has-more'] !== 'true') break;
+        last = res.data[res.data.length - 1];
+      }
+    } catch (e) {
+      console.error('Chat catch-up:', e);
+    }
+  }, [chatId, token]);
+
   const connectWS = useCallback(() => {
     if (!chatId || !token) return;
     bgWsRef.current?.close();
     const wsUrl = API_URL?.replace('https://', 'wss://').replace('http://', 'ws://');
-    const ws = new WebSocket(`${wsUrl}/api/ws/chat/${chatId}?token=${token}`);
+    const ws = new WebSocket(`${wsUrl}/api/ws/chat/${chatId}?token=${token}&heartbeat=1`);
     ws.onopen = () => {
       ws.send(JSON.stringify({ type: 'read' }));
+      if (messagesRef.current.length > 0) catchUp();
     };
     ws.onmessage = (e) => {
       try {
         const data = JSON.parse(e.data);
+        if (data.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
         if (data.type === 'typing') {
           if (data.senderId !== user?.id) {
             setRemoteTyping(data.isTyping);
@@ -231,7 +299,8 @@ export default function ChatBubble() {
           }
           return;
         }
-        setMessages(prev => [...prev, data]);
+        skipScrollToEndRef.current = false;
+        setMessages(prev => mergeMessages(prev, [data]));
         setRemoteTyping(false);
         if (data.senderId !== user?.id) {
           ws.send(JSON.stringify({ type: 'read' }));
@@ -245,7 +314,7 @@ export default function ChatBubble() {
       }
     };
     wsRef.current = ws;
-  }, [chatId, token, user?.id]);
+  }, [chatId, token, user?.id, catchUp]);
 
   useEffect(() => {
     if (open && chatId) {
@@ -285,7 +354,7 @@ export default function ChatBubble() {
   };
 
   useEffect(() => {
-    if (messages.length > 0) {
+    if (messages.length > 0 && !skipScrollToEndRef.current) {
       setTimeout(() => flatListRef.current?.scrollToEnd({ animated: true }), 100);
     }
   }, [messages.length]);
@@ -367,10 +436,22 @@ export default function ChatBubble() {
                 ref={flatListRef}
                 data={messages}
                 renderItem={renderMessage}
-                keyExtractor={(_, i) => String(i)}
+                keyExtractor={(item, i) => item.id || String(i)}
                 style={styles.messageList}
                 contentContainerStyle={styles.messageListContent}
-                onContentSizeChange={() => flatListRef.current?.scrollToEnd({ animated: false })}
+                onContentSizeChange={() => {
+                  if (!skipScrollToEndRef.current) flatListRef.current?.scrollToEnd({ animated: false });
+                }}
+                ListHeaderComponent={hasEarlier ? (
+                  <TouchableOpacity
+                    style={styles.loadEarlierBtn}
+                    onPress={loadEarlier}
+                    disabled={loadingEarlier}
+                    data-testid="chat-load-earlier"
+                  >
+                    <Text style={styles.loadEarlierText}>{loadingEarlier ? 'Loading...' : 'Load earlier messages'}</Text>
+                  </TouchableOpacity>
+                ) : null}
                 ListFooterComponent={remoteTyping ? <TypingDots /> : null}
               />
             )}
@@ -451,6 +532,8 @@ const styles = StyleSheet.create({
   emptySubtext: { color: '#666', fontSize: 13, textAlign: 'center' },
   messageList: { flex: 1 },
   messageListContent: { padding: 16, gap: 8 },
+  loadEarlierBtn: { alignSelf: 'center', paddingHorizontal: 14, paddingVertical: 6, borderRadius: 14, backgroundColor: '#1a1a1a', marginBottom: 8 },
+  loadEarlierText: { color: '#888', fontSize: 12, fontWeight: '600' },
   msgRow: { flexDirection: 'row', marginBottom: 4 },
   msgRowRight: { justifyContent: 'flex-end' },
   msgRowLeft: { justifyContent: 'flex-start' },
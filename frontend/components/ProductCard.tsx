@@ -15,6 +15,7 @@ interface Product {
   flavor: string;
   price: number;
   stock: number;
+  availableStock?: number;
   cloudzReward?: number;
   loyaltyEarnRate?: number;
 }
@@ -30,7 +31,8 @@ const ProductCard = memo(({ product }: { product: Product }) => {
   const imageUri = resolveImageUri(product.image);
   const displayBrand = product.brandName || product.brand || '';
   const cloudzReward = product.cloudzReward ?? Math.round(product.price * (product.loyaltyEarnRate ?? 3));
-  const isLowStock = product.stock > 0 && product.stock <= 3;
+  const stock = product.availableStock ?? product.stock;
+  const isLowStock = stock > 0 && stock <= 3;
 
   return (
     <TouchableOpacity
@@ -57,7 +59,7 @@ const ProductCard = memo(({ product }: { product: Product }) => {
             <Text style={styles.placeholderText}>No Image</Text>
           </View>
         )}
-        {product.stock === 0 && (
+        {stock === 0 && (
           <View style={styles.outOfStockBadge}>
             <Text style={styles.outOfStockText}>Sold Out</Text>
           </View>